@@ -0,0 +1,63 @@
+"""
+Benchmark of the import time of S4.
+
+Each measurement imports `s4` in a new interpreter, as a batch worker does,
+and reports the best and median wall time of the import and if the plotting
+and FITS libraries were loaded by it. With `--max`, it exits with an error if
+the best time is longer than the given number of seconds, e.g., to be run by
+a continuous integration job.
+
+Usage, with S4 installed or on PYTHONPATH:
+
+    python benchmarks/bench_import.py [--max seconds] [repetitions]
+"""
+import sys
+import json
+import subprocess as sp
+import numpy as np
+
+
+# Modules that `import s4` should not load
+LAZY_MODULES = ['matplotlib', 'astropy']
+
+SCRIPT = """
+import sys, time, json
+start = time.time()
+import s4
+wall = time.time() - start
+print(json.dumps([wall, [name for name in {} if name in sys.modules]]))
+""".format(LAZY_MODULES)
+
+
+def import_time():
+    """Wall time of `import s4` and lazy modules loaded in a new process."""
+    output = sp.check_output([sys.executable, '-c', SCRIPT])
+    wall, loaded = json.loads(output.splitlines()[-1])
+    return wall, loaded
+
+
+def main(repetitions=10, max_time=None):
+    import_time()   # Warm the file system cache and the .pyc files
+    results = [import_time() for _ in range(repetitions)]
+    times = [wall for wall, _ in results]
+    loaded = sorted(set(name for _, names in results for name in names))
+
+    print '{:>10s}{:>12s}{:>12s}  {}'.format('imports', 'best (s)',
+                                             'median (s)', 'loaded')
+    print '{:>10d}{:>12.3f}{:>12.3f}  {}'.format(
+        repetitions, min(times), np.median(times),
+        ', '.join(loaded) or '-')
+
+    if max_time is not None and min(times) > max_time:
+        sys.exit('import s4 took {:.3f} s, more than {} s.'.format(
+            min(times), max_time))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    max_time = None
+    if '--max' in args:
+        n = args.index('--max')
+        max_time = float(args[n + 1])
+        del args[n:n + 2]
+    main(int(args[0]) if args else 10, max_time)
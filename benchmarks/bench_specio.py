@@ -0,0 +1,82 @@
+"""
+Benchmark of the parsers of Synspec output files.
+
+Compares `specio.loadtxt_fast` with the former generator-based parser, which
+converted each token with a Python call, on synthetic spectra of several
+sizes. The former parser only accepts single spaces between columns, so the
+spectra are written that way; `loadtxt_fast` is also timed on the
+fixed-width format of fort.7 and on Fortran `D` exponents.
+
+Usage, with S4 installed or on PYTHONPATH:
+
+    python benchmarks/bench_specio.py [number of points ...]
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import numpy as np
+from s4.io import specio
+
+
+def loadtxt_generator(filename, dtype=np.int, skiprows=0, delimiter=' '):
+    """The former `specio.loadtxt_fast`."""
+    def iter_func():
+        with open(filename, 'r') as infile:
+            for _ in range(skiprows):
+                next(infile)
+            for line in infile:
+                line = line.strip().split(delimiter)
+                for item in line:
+                    yield dtype(item)
+            loadtxt_generator.rowlength = len(line)
+    data = np.fromiter(iter_func(), dtype=dtype)
+    return data.reshape((-1, loadtxt_generator.rowlength))
+
+
+def best_time(function, *args, **kwargs):
+    """Best wall time of three calls."""
+    times = []
+    for _ in range(3):
+        start = time.time()
+        function(*args, **kwargs)
+        times.append(time.time() - start)
+    return min(times)
+
+
+def main(sizes):
+    path = tempfile.mkdtemp()
+    try:
+        print '{:>10s}{:>16s}{:>16s}{:>9s}{:>12s}{:>12s}'.format(
+            'points', 'generator (s)', 'vectorized (s)', 'speedup',
+            'fort.7 (s)', 'D exp. (s)')
+        for size in sizes:
+            spectrum = np.column_stack([np.linspace(4000, 5000, size),
+                                        np.random.random(size)])
+            fnames = [os.path.join(path, name)
+                      for name in ['single', 'fort.7', 'dexp']]
+            np.savetxt(fnames[0], spectrum, fmt='%.3f %.5E')
+            np.savetxt(fnames[1], spectrum, fmt='%12.5f%15.5E')
+            np.savetxt(fnames[2], spectrum, fmt='%.3f %.5E')
+            with open(fnames[2]) as infile:
+                text = infile.read().replace('E', 'D')
+            with open(fnames[2], 'w') as out:
+                out.write(text)
+
+            old = best_time(loadtxt_generator, fnames[0], np.float)
+            new = best_time(specio.loadtxt_fast, fnames[0], np.float)
+            fort7 = best_time(specio.loadtxt_fast, fnames[1], np.float)
+            dexp = best_time(specio.loadtxt_fast, fnames[2], np.float)
+            assert np.array_equal(loadtxt_generator(fnames[0], np.float),
+                                  specio.loadtxt_fast(fnames[0], np.float))
+
+            print '{:>10d}{:>16.3f}{:>16.3f}{:>9.1f}{:>12.3f}{:>12.3f}'.format(
+                size, old, new, old / new, fort7, dexp)
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] or
+         [10000, 100000, 1000000, 3000000])
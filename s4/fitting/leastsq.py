@@ -0,0 +1,192 @@
+"""
+Levenberg-Marquardt
+===================
+
+Damped least-squares minimization with bounds, used by `Synfit` with
+`method='lm'`.
+
+The residuals are asked in batches: the perturbed points of each
+finite-difference Jacobian are asked at once, so they can be calculated at
+the same time.
+"""
+import numpy as np
+
+# Limits of the damping factor.
+MIN_DAMPING = 1e-7
+MAX_DAMPING = 1e7
+
+
+def jacobian(residuals, x, res, lower, upper, steps, feasible=None):
+    """
+    Finite-difference Jacobian of the residuals at `x`.
+
+    Each parameter is perturbed forward by its step or, if the point is out of
+    the bounds or not feasible, backward. A parameter that can not be
+    perturbed has a null column.
+
+    Parameters
+    ----------
+
+    residuals: function;
+        See `levenberg_marquardt`.
+
+    x: numpy.ndarray;
+        Point of the parameters.
+
+    res: numpy.ndarray;
+        Residuals at `x`.
+
+    lower, upper, steps: numpy.ndarray;
+        Bounds and step of each parameter.
+
+    feasible: function (optional);
+        See `levenberg_marquardt`.
+
+    Returns
+    -------
+
+    numpy.ndarray;
+        The Jacobian with shape (number of residuals, number of parameters).
+    """
+    columns = []
+    points = []
+    for n, step in enumerate(steps):
+        for value in [x[n] + step, x[n] - step]:
+            point = x.copy()
+            point[n] = value
+            if lower[n] <= value <= upper[n] and \
+               (feasible is None or feasible(point)):
+                columns.append(n)
+                points.append(point)
+                break
+
+    jac = np.zeros((len(res), len(x)))
+    for n, point, perturbed in zip(columns, points, residuals(points)):
+        if perturbed is not None:
+            jac[:, n] = (perturbed - res) / (point[n] - x[n])
+
+    return jac
+
+
+def covariance(jac, chisq):
+    """
+    Covariance of the parameters from the Jacobian at the minimum, scaled by
+    the reduced chi-square. Parameters with a null column have NaN variance.
+    """
+    size, n_params = jac.shape
+    free = np.any(jac != 0, axis=0)
+    dof = max(size - free.sum(), 1)
+
+    cov = np.empty((n_params, n_params))
+    cov.fill(np.nan)
+    alpha = np.dot(jac[:, free].T, jac[:, free])
+    cov[np.ix_(free, free)] = np.linalg.pinv(alpha) * chisq / dof
+
+    return cov
+
+
+def levenberg_marquardt(residuals, x0, lower, upper, steps, feasible=None,
+                        max_iterations=20, tolerance=1e-3, damping=1e-3):
+    """
+    Minimize the sum of squares of the residuals by Levenberg-Marquardt,
+    keeping the parameters inside their bounds.
+
+    Parameters
+    ----------
+
+    residuals: function;
+        Receives a list of points, each an array with the parameters, and
+        returns a list with the vector of residuals of each, or None if they
+        could not be calculated.
+
+    x0: list;
+        Initial value of each parameter.
+
+    lower, upper: list;
+        Bounds of each parameter.
+
+    steps: list;
+        Finite-difference step of each parameter. The fit also converges when
+        each parameter changes less than `tolerance` times its step.
+
+    feasible: function (optional);
+        Receives a point and returns if its residuals can be calculated,
+        e.g., if it is covered by the grid of models. Points that are not
+        feasible are never asked.
+
+    max_iterations: int (optional);
+        Maximum number of Jacobians to be calculated.
+
+    tolerance: float (optional);
+        The fit converges when the chi-square improves less than this
+        fraction or the parameters change less than this fraction of their
+        steps.
+
+    damping: float (optional);
+        Initial damping factor.
+
+    Returns
+    -------
+
+    dict;
+        The best point, `x`, its `chisquare` and `covariance`, the number of
+        `iterations` and if the fit `converged`.
+    """
+    lower = np.asarray(lower, dtype=float)
+    upper = np.asarray(upper, dtype=float)
+    steps = np.abs(np.asarray(steps, dtype=float))
+    x = np.clip(np.asarray(x0, dtype=float), lower, upper)
+
+    if feasible is not None and not feasible(x):
+        raise ValueError('The initial point is not feasible.')
+    res = residuals([x])[0]
+    if res is None:
+        raise RuntimeError('The residuals of the initial point could not be '
+                           'calculated.')
+    chisq = np.dot(res, res)
+
+    converged = False
+    iterations = 0
+    jac = None
+    while iterations < max_iterations and not converged:
+        iterations += 1
+        jac = jacobian(residuals, x, res, lower, upper, steps, feasible)
+        alpha = np.dot(jac.T, jac)
+        beta = -np.dot(jac.T, res)
+        scale = np.diag(alpha).copy()
+        scale[scale == 0] = 1
+
+        improved = False
+        while damping <= MAX_DAMPING:
+            delta = np.linalg.lstsq(alpha + damping * np.diag(scale), beta,
+                                    rcond=-1)[0]
+            trial = np.clip(x + delta, lower, upper)
+            if np.all(np.abs(trial - x) <= tolerance * steps):
+                # The step is too small to improve the fit
+                break
+            if feasible is None or feasible(trial):
+                trial_res = residuals([trial])[0]
+                if trial_res is not None and \
+                   np.dot(trial_res, trial_res) < chisq:
+                    improved = True
+                    break
+            damping *= 10
+
+        if not improved:
+            # No step along the gradient decreases the chi-square
+            converged = True
+            break
+
+        trial_chisq = np.dot(trial_res, trial_res)
+        converged = chisq - trial_chisq <= tolerance * chisq or \
+            np.all(np.abs(trial - x) <= tolerance * steps)
+        x, res, chisq = trial, trial_res, trial_chisq
+        damping = max(damping / 10, MIN_DAMPING)
+        jac = None
+
+    # Covariance from the Jacobian at the best point
+    if jac is None:
+        jac = jacobian(residuals, x, res, lower, upper, steps, feasible)
+
+    return {'x': x, 'chisquare': chisq, 'covariance': covariance(jac, chisq),
+            'iterations': iterations, 'converged': converged}
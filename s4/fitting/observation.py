@@ -0,0 +1,214 @@
+"""
+Observed spectrum of a fit.
+
+The observation is loaded, corrected for radial velocity and masked by the
+windows of the fit once. The linear interpolation of a synthetic wavelength
+grid onto the unmasked observed pixels is a sparse operator, with two
+non-zero values per pixel, so it is precomputed as their indices and weights
+and kept per grid. The synthetic grid only depends on `wstart` and `wend`,
+so all spectra of a fit usually share it, and the chi-square of a batch of
+spectra is one vectorized operation on the unmasked pixels.
+"""
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# Number of resampling operators kept per observation.
+MEMO_SIZE = 8
+
+# Number of wavelengths sampled by the key of a grid.
+KEY_SAMPLES = 16
+
+
+def grid_key(wave):
+    """
+    Key of a synthetic wavelength grid, from a few of its wavelengths. Grids
+    with the same key are compared with `same_grid`.
+    """
+    stride = max(1, len(wave) // KEY_SAMPLES)
+    return (len(wave), wave[-1]) + tuple(wave[::stride])
+
+
+def same_grid(wave, other):
+    """Check if two wavelength grids are equal."""
+    return wave is other or np.array_equal(wave, other)
+
+
+def interpolate(fluxes, lower, upper, fraction):
+    """Apply a resampling operator to the rows of `fluxes`."""
+    low = fluxes[:, lower]
+
+    # In C order, so the chi-square of a spectrum does not depend on the size
+    # of its batch
+    return np.ascontiguousarray(low + (fluxes[:, upper] - low) * fraction)
+
+
+class Observation(object):
+    """
+    Observed spectrum against which synthetic spectra are compared.
+
+    Parameters
+    ----------
+
+    spectrum: numpy.ndarray;
+        Wavelength and flux of the observation, already corrected for radial
+        velocity.
+
+    weights: numpy.ndarray;
+        Weight of each pixel. Pixels with zero weight are dropped.
+
+    Attributes
+    ----------
+
+    wave, flux, weights: numpy.ndarray;
+        Wavelength, flux and weight of the unmasked pixels, read-only.
+    """
+
+    def __init__(self, spectrum, weights):
+        mask = np.asarray(weights) > 0
+        self.wave = spectrum[mask, 0]
+        self.flux = spectrum[mask, 1]
+        self.weights = np.asarray(weights, dtype=float)[mask]
+        for array in [self.wave, self.flux, self.weights]:
+            array.setflags(write=False)
+        self._operators = OrderedDict()
+        self._lock = threading.Lock()
+
+
+    def __getstate__(self):
+        """The operators and the lock are not sent to other processes."""
+        state = dict(self.__dict__)
+        state['_operators'] = OrderedDict()
+        del state['_lock']
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+    def operator(self, wave):
+        """
+        Sparse operator of the linear interpolation of a synthetic wavelength
+        grid onto the observed pixels, as `numpy.interp`: values outside the
+        grid are those of its edges.
+
+        Returns
+        -------
+
+        used: numpy.ndarray;
+            Indices of the synthetic points used by the interpolation.
+
+        lower, upper: numpy.ndarray;
+            Positions on `used` of the synthetic points around each observed
+            pixel.
+
+        fraction: numpy.ndarray;
+            Weight of the upper point on each pixel.
+        """
+        key = grid_key(wave)
+        with self._lock:
+            if key in self._operators and \
+               same_grid(wave, self._operators[key][0]):
+                return self._operators[key][1]
+
+        if len(wave) == 1:
+            lower = upper = np.zeros(len(self.wave), dtype=int)
+            fraction = np.zeros(len(self.wave))
+        else:
+            upper = np.clip(np.searchsorted(wave, self.wave, side='right'),
+                            1, len(wave) - 1)
+            lower = upper - 1
+            step = wave[upper] - wave[lower]
+            step[step == 0] = 1.
+            fraction = np.clip((self.wave - wave[lower]) / step, 0., 1.)
+
+        # Only the synthetic points around unmasked pixels are read
+        used, positions = np.unique(np.concatenate([lower, upper]),
+                                    return_inverse=True)
+        operator = (used, positions[:len(lower)], positions[len(lower):],
+                    fraction)
+
+        with self._lock:
+            self._operators[key] = (np.array(wave), operator)
+            while len(self._operators) > MEMO_SIZE:
+                self._operators.popitem(last=False)
+
+        return operator
+
+
+    def resample(self, wave, fluxes):
+        """
+        Interpolate synthetic fluxes onto the observed pixels.
+
+        Parameters
+        ----------
+
+        wave: numpy.ndarray;
+            Synthetic wavelength grid.
+
+        fluxes: numpy.ndarray;
+            One flux, or one per row, on `wave`.
+
+        Returns
+        -------
+
+        numpy.ndarray;
+            The fluxes on the observed pixels, one per row.
+        """
+        used, lower, upper, fraction = self.operator(wave)
+
+        return interpolate(np.atleast_2d(fluxes)[:, used], lower, upper,
+                           fraction)
+
+
+    def chi_square(self, spectra):
+        """
+        Chi-square of a batch of synthetic spectra.
+
+        Parameters
+        ----------
+
+        spectra: list;
+            Wavelength and flux of each spectrum. Spectra on the same grid
+            are evaluated together.
+
+        Returns
+        -------
+
+        numpy.ndarray;
+            The chi-square of each spectrum.
+        """
+        chisq = np.empty(len(spectra))
+        groups = []
+        keys = {}
+        for n, (wave, flux) in enumerate(spectra):
+            key = grid_key(wave)
+            for group in keys.setdefault(key, []):
+                if same_grid(wave, group[0]):
+                    group[1].append(n)
+                    break
+            else:
+                keys[key].append((wave, [n]))
+                groups.append(keys[key][-1])
+
+        for wave, rows in groups:
+            used, lower, upper, fraction = self.operator(wave)
+            # Only the points used are copied to the batch
+            flm = interpolate(np.array([spectra[n][1][used] for n in rows]),
+                              lower, upper, fraction)
+            chisq[rows] = np.sum((self.flux - flm)**2 / flm * self.weights,
+                                 axis=1)
+
+        return chisq
+
+
+    def residuals(self, wave, flux):
+        """
+        Residuals of a synthetic spectrum on the unmasked pixels. The sum of
+        their squares is the chi-square.
+        """
+        flm = self.resample(wave, flux)[0]
+
+        return (self.flux - flm) * np.sqrt(self.weights / flm)
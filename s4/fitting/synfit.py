@@ -8,29 +8,54 @@ region. Is is allowed any number of parameters.
 
 The best fit is found by minimizing the chi^2. `Synfit` calculates the
 synthetic spectrum for all values asked and then select the one with minimum
-chi^2 and returns it to the user.
+chi^2 and returns it to the user. With `method='lm'`, the parameters are
+fitted by Levenberg-Marquardt instead, see `leastsq`.
 
 It is also possible to select a subregion of the spectrum by using the
 `windows` argument.
 """
 import os
-import shutil
 import re
-import json
 import shutil
+import tempfile
+import multiprocessing as mp
 from copy import deepcopy
+from collections import OrderedDict
 import numpy as np
-import matplotlib.pyplot as plt
 from itertools import product
-from ..io import specio
-from ..synthesis import Synplot
+from ..io import specio, wrappers
+from ..synthesis import Synplot, atmosphere
+from ..synthesis.emulator import load_emulator, parameter_key
+from ..synthesis.synplotwrapper import CONVOLUTION_KEYS
+from ..synthesis.cache import (normalize_value, IGNORED_PARAMETERS,
+                               POSTPROCESS_KEYS)
+from ..synthesis.timings import Timings
 from ..spectools import rvcorr
+from ..utils.elements import periodic_table, element_symbols
+from leastsq import levenberg_marquardt
+from observation import Observation
+
+# Errors of a synthesis that mark its grid point as failed instead of
+# aborting the fit. Any other error is a bug and aborts it.
+SYNTHESIS_ERRORS = (wrappers.CommandError, IOError)
+
+# Number of spectra whose chi-square is calculated at once.
+BATCH_SIZE = 64
 
-# Loads the chemical elements and their atomic numbers
-PERIODIC = json.load(open(os.getenv('HOME')+'/.s4/extra_resc'+\
-                          '/chemical_elements.json'))
+# Settings that must be those of the training of an emulator, unless they
+# are parameters of its grid. Any other setting saved with the emulator is
+# compared as well.
+EMULATOR_SETTINGS = ['teff', 'logg', 'wstart', 'wend', 'convolution',
+                     'metal', 'abund', 'linlist', 'vturb',
+                     'atmos'] + CONVOLUTION_KEYS
 
-REVERSE_PERIODIC = {val:key for key, val in PERIODIC.iteritems()}
+# Options of the training that only change how the spectra are calculated.
+EMULATOR_RUN_OPTIONS = ['synplot_path', 'idl', 'tmpdir', 'backend', 'timeout',
+                        'retries', 'max_output', 'workers', 'chunks',
+                        'reconvolve', 'norun']
+
+# Value of the settings that Synplot sets when they are not given.
+EMULATOR_DEFAULTS = {'relative': 0, 'convolution': 'rotin3'}
 
 def iterator(fit_keys, iter_params):
     """
@@ -61,6 +86,296 @@ def iterator(fit_keys, iter_params):
 
     return np.array(iter_values, dtype={'names':fit_keys, 'formats':data_type})
 
+
+def chisquare_table(fit_keys, iter_values):
+    """
+    Create the array of the values of each parameter and the chi-square,
+    set as NaN, of a list of grid points.
+
+    Parameters
+    ----------
+
+    fit_keys: list;
+        Name of the parameters.
+
+    iter_values: numpy.ndarray;
+        The grid points, as returned by `iterator`.
+    """
+    n_params = len(fit_keys)
+
+    ## Create an array of NaN
+    chisquare = np.empty([len(iter_values), 1])
+    chisquare.fill(np.nan)
+
+    ## Create the array with the iteration avlues + NaN for the chisquare
+
+    ### Remove the data type of the iter_values array.
+    ### this is necessary in order to add the chisquare array
+    #### Removes data type
+    tmp_array = iter_values.view((float, n_params))
+    #### Guarantee that the format will be correct for any number of
+    #### parameters
+    tmp_array = tmp_array.reshape(len(iter_values), -1)
+
+    ### Join the arrays
+    chisq_values = np.hstack((tmp_array, chisquare))
+
+    ### Set the data type for the chisq_values array
+    data_type = fit_keys + ['chisquare']
+    chisq_values.dtype = {'names':data_type,
+                          'formats':[float]*len(data_type)}
+
+    return chisq_values
+
+
+def refine_indices(center, half_width, stride, size):
+    """
+    Indices of a grid of `size` points to be calculated around `center`.
+
+    Parameters
+    ----------
+
+    center: int;
+        Index of the best point.
+
+    half_width: int;
+        Number of points on each side of `center` to be covered.
+
+    stride: int;
+        Step, in points, between the calculated points.
+
+    size: int;
+        Number of points of the dense grid.
+
+    Returns
+    -------
+
+    list;
+        Sorted indices, including `center` and the limits of the window.
+    """
+    first = max(center - half_width, 0)
+    last = min(center + half_width, size - 1)
+
+    return sorted(set(range(first, last + 1, stride)) | set([center, last]))
+
+
+def branch_and_bound(evaluate, sizes, seed, margin=1., convex=False):
+    """
+    Calculate the chi-square of a grid outward from a seed point, skipping
+    the points whose chi-square is bound to exceed the best one found so far
+    by more than `margin` times it.
+
+    The chi-square is assumed to rise monotonically away from its minimum
+    along each axis. A point is skipped when the two points between it and
+    the seed on one axis were calculated and the chi-square rises towards
+    it: its lower bound is the chi-square of the nearest one or, if
+    `convex`, its linear extrapolation. A point next to a skipped one that
+    rises on the same axis and direction shares its bound.
+
+    Parameters
+    ----------
+
+    evaluate: function;
+        Receives an array of rows of the grid, as given by
+        `numpy.ravel_multi_index`, and returns their chi-square, NaN if
+        failed. It is called once for all points at the same distance from
+        the seed.
+
+    sizes: list;
+        Number of values of each parameter.
+
+    seed: list;
+        Index of the first point on each axis.
+
+    margin: float (optional);
+        Fraction of the best chi-square by which a bound must exceed it.
+
+    convex: bool (optional);
+        If True, the chi-square is also assumed to be convex along each
+        axis.
+
+    Returns
+    -------
+
+    chisquare: numpy.ndarray;
+        The chi-square of each row, NaN if it was skipped.
+
+    pruned: numpy.ndarray;
+        True for the rows skipped.
+    """
+    size = int(np.prod(sizes))
+    index = np.indices(sizes).reshape(len(sizes), -1)
+    distance = np.abs(index - np.reshape(seed, (-1, 1))).sum(axis=0)
+    # Distance between rows of consecutive values of each parameter
+    strides = np.cumprod([1] + list(sizes[:0:-1]))[::-1]
+
+    chisquare = np.empty(size)
+    chisquare.fill(np.nan)
+    bound = np.empty(size)
+    bound.fill(np.nan)
+    calculated = np.zeros(size, dtype=bool)
+    pruned = np.zeros(size, dtype=bool)
+    rising = {}
+
+    for ring in range(distance.max() + 1):
+        if np.isfinite(chisquare).any():
+            best = np.nanmin(chisquare)
+            threshold = best + margin * abs(best)
+        else:
+            threshold = np.inf
+
+        rows = []
+        for row in np.flatnonzero(distance == ring):
+            bounds = {}
+            for axis, offset in enumerate(index[:, row] - seed):
+                if offset == 0:
+                    continue
+                direction = 1 if offset > 0 else -1
+                near = row - direction * strides[axis]
+                if pruned[near]:
+                    if (axis, direction) in rising[near]:
+                        bounds[axis, direction] = bound[near]
+                    continue
+
+                far = near - direction * strides[axis]
+                if not 0 <= index[axis, row] - 2 * direction < sizes[axis] \
+                   or not calculated[near] or not calculated[far] \
+                   or not chisquare[near] > chisquare[far]:
+                    continue
+                bounds[axis, direction] = chisquare[near]
+                if convex:
+                    bounds[axis, direction] += chisquare[near] - \
+                        chisquare[far]
+
+            rising_axes = [key for key, val in bounds.iteritems()
+                           if val > threshold]
+            if rising_axes:
+                pruned[row] = True
+                bound[row] = max(bounds[key] for key in rising_axes)
+                rising[row] = set(rising_axes)
+            else:
+                rows.append(row)
+
+        if rows:
+            chisquare[rows] = evaluate(np.array(rows))
+            calculated[rows] = True
+
+    return chisquare, pruned
+
+
+def synthetic_flux(synthesis):
+    """Wavelength and flux of a synthesis, with its scale applied."""
+    wave, flux = synthesis.spectrum[:, 0], synthesis.spectrum[:, 1]
+    if 'scale' in synthesis.parameters:
+        flux = flux * synthesis.parameters['scale']
+
+    return wave, flux
+
+
+# Observation of the fit on worker processes, see `Synfit.map_tasks`.
+_OBSERVATION = None
+
+
+def _share_observation(observation):
+    """Set the observation of the fit on a worker process."""
+    global _OBSERVATION
+    _OBSERVATION = observation
+
+
+def _library_one(task):
+    """
+    Calculate one spectrum of the library of `Synfit` on a worker process
+    and move its unconvolved spectrum to the library.
+
+    Returns
+    -------
+
+    error: Exception or None;
+        The error of a failed synthesis.
+
+    timings: Timings;
+        Timings of the synthesis.
+    """
+    args, synplot_params, files = task
+    synthesis = Synplot(*args, **synplot_params)
+    try:
+        synthesis.run()
+        for name, destination in files.iteritems():
+            shutil.move(synthesis.workspace.file(name), destination)
+        return None, synthesis.timings
+    except SYNTHESIS_ERRORS as err:
+        return err, synthesis.timings
+    finally:
+        synthesis.cleanup()
+        synthesis.forget_run()
+
+
+def _iteration_one(task, observation=None):
+    """
+    Calculate the chi-square of one grid point of `Synfit` on a worker
+    process, against `observation` or the one shared with the process.
+
+    Returns
+    -------
+
+    chisq: float;
+        The chi-square, or NaN if the synthesis failed.
+
+    error: Exception or None;
+        The error of a failed synthesis.
+
+    timings: Timings;
+        Timings of the synthesis and of the chi-square.
+    """
+    args, synplot_params, stage = task
+    if observation is None:
+        observation = _OBSERVATION
+    synthesis = Synplot(*args, **synplot_params)
+    try:
+        synthesis.run(stage=stage)
+        with synthesis.timings.measure('chisquare'):
+            chisq = observation.chi_square([synthetic_flux(synthesis)])[0]
+        return chisq, None, synthesis.timings
+    except SYNTHESIS_ERRORS as err:
+        return np.nan, err, synthesis.timings
+    finally:
+        synthesis.cleanup()
+        synthesis.forget_run()
+
+
+def _residuals_one(task, observation=None):
+    """
+    Calculate the residuals of one point of the least-squares fit of
+    `Synfit` on a worker process, against `observation` or the one shared
+    with the process.
+
+    Returns
+    -------
+
+    residuals: numpy.ndarray or None;
+        The residuals, or None if the synthesis failed.
+
+    error: Exception or None;
+        The error of a failed synthesis.
+
+    timings: Timings;
+        Timings of the synthesis and of the residuals.
+    """
+    args, synplot_params, stage = task
+    if observation is None:
+        observation = _OBSERVATION
+    synthesis = Synplot(*args, **synplot_params)
+    try:
+        synthesis.run(stage=stage)
+        with synthesis.timings.measure('chisquare'):
+            res = observation.residuals(*synthetic_flux(synthesis))
+        return res, None, synthesis.timings
+    except SYNTHESIS_ERRORS as err:
+        return None, err, synthesis.timings
+    finally:
+        synthesis.cleanup()
+        synthesis.forget_run()
+
 class Synfit:
     """
     Fit a spectral line by iterating on user defined parameter
@@ -81,7 +396,103 @@ class Synfit:
 
     kwargs;
         All Synplot parameters desired to be use, including `teff`,
-        `logg`, `synplot_path`, `idl`, `noplot`.
+        `logg`, `synplot_path`, `idl`, `noplot`, `backend`, `pool`, `cache`
+        and `convolution`. If a `GDLPool` is passed as `pool` or a
+        `SpectrumCache` as `cache`, all syntheses of the fit share them. With
+        `convolution='python'`, the fit of rotation and instrumental
+        parameters only convolves the stored unconvolved spectra. With
+        `timeout` and `retries`, a synthesis that hangs is killed and run
+        again; grid points whose synthesis fails have a NaN chi-square and
+        are listed on `failed`. The timings of all syntheses of the last fit
+        are added up on `timings`.
+
+        workers: int (optional);
+            Number of processes in which the library of unconvolved spectra
+            and the grid points are calculated, each synthesis in its own
+            workspace. The chi-square values are the same of a serial fit,
+            but the grid points are not plotted. A `pool` can not be
+            shared between processes. The default is 1.
+
+        refine: bool (optional);
+            If True, a coarse grid of about `refine_points` values per
+            parameter is calculated first and then calculated again around
+            its best point, with the step reduced by `refine_shrink` at each
+            level, down to the step of `fit_params`. Points already
+            calculated are not calculated again and the ones never
+            calculated have a NaN chi-square. The number of syntheses saved
+            is on `refinement`. It assumes a single minimum of the
+            chi-square around the best point of each level. The default is
+            False.
+
+        refine_points: int (optional);
+            Number of values of each parameter on the coarse grid. The
+            default is 5.
+
+        refine_shrink: float (optional);
+            Factor, between 0 and 1, applied to the step at each level. The
+            default is 0.5.
+
+        refine_tolerance: float (optional);
+            If set, the refinement also stops when the best chi-square of a
+            level improves less than this fraction of the previous one.
+
+        method: str (optional);
+            With 'grid', the default, the chi-square of every point of the
+            grid is calculated. With 'lm', the parameters are fitted by
+            Levenberg-Marquardt on the residuals of the observed spectrum:
+            the first two values of `fit_params` are the bounds of each
+            parameter and the third one is its finite-difference step. The
+            perturbed syntheses of each Jacobian are calculated in `workers`
+            processes and no point is calculated twice. Teff and log g are
+            kept inside the BSTAR2006 grid. The calculated points are on
+            `chisq_values`, the covariance of the best values, in the order
+            of `fit_keys`, on `covariance` and their standard errors on
+            `uncertainties`. The number of `points` and `iterations` and if
+            the fit `converged` are on `least_squares_fit`. Points are not
+            plotted.
+
+        prune: bool or str (optional);
+            If True or 'monotonic', the grid is calculated outward from
+            `prune_seed` and the points whose chi-square is bound to exceed
+            the best one by more than `prune_margin` times it are skipped,
+            assuming the chi-square rises away from its minimum along each
+            axis. With 'convex', it is also assumed to be convex, which
+            skips more points. Skipped points have a NaN chi-square and are
+            True on `pruned`; the number of syntheses saved is on
+            `pruning`. It can not be used with `refine`. The default is
+            False.
+
+        prune_margin: float (optional);
+            The default is 1, i.e., points bound to have more than twice the
+            best chi-square are skipped.
+
+        prune_seed: dict (optional);
+            Value of the parameters at which the calculation starts. The
+            default is the middle of the grid.
+
+        emulator: Emulator or str (optional);
+            An emulator of the spectra, or the name of a saved one. The fit
+            uses the spectra it predicts instead of syntheses, and the best
+            point is then verified with a synthesis: its chi-square is the
+            one of `best_fit`, and both chi-squares are on `verification`.
+            Points out of the grid of the emulator fail and points are not
+            plotted. The fitted parameters must be parameters of its grid
+            and the `EMULATOR_SETTINGS` that are not, and the other settings
+            saved with it, must be those of its training, or ValueError is
+            raised.
+
+        lm_initial: dict (optional);
+            Initial value of the parameters fitted with 'lm'. The default is
+            the middle of their bounds.
+
+        lm_iterations: int (optional);
+            Maximum number of Jacobians calculated with 'lm'. The default is
+            20.
+
+        lm_tolerance: float (optional);
+            The 'lm' fit stops when the chi-square improves less than this
+            fraction or the parameters change less than this fraction of
+            their steps. The default is 1e-3.
 
         abund: dic (optional);
             Abundance of chosen chemical elements.
@@ -124,12 +535,16 @@ class Synfit:
         # Check if there is a an observed spectrum.
         # If not quit.
         try:
-            # If there is, load it to calculate the weights
-            obs_spec = specio.load_spectrum(self.syn_params['observ'])
-            # Correct for radial velocity
-            obs_spec[:,0] *= rvcorr(self.rad_vel)
+            # If there is, load it only once. The syntheses that plot it
+            # share this read-only array.
+            self.observed_spectrum = specio.load_spectrum(
+                self.syn_params.pop('observ'))
+            self.observed_spectrum.setflags(write=False)
         except IOError:
             raise IOError('There is not any observed spectrum.')
+        # Correct for radial velocity to calculate the weights
+        obs_spec = self.observed_spectrum.copy()
+        obs_spec[:,0] *= rvcorr(self.rad_vel)
 
 
         #Prepare kwargs
@@ -143,6 +558,44 @@ class Synfit:
         else:
             self.idl = False  # It will run GDL
 
+        self.workers = self.syn_params.pop('workers', None) or 1
+        self.refine = self.syn_params.pop('refine', False)
+        self.refine_points = int(self.syn_params.pop('refine_points', 5))
+        self.refine_shrink = float(self.syn_params.pop('refine_shrink', 0.5))
+        self.refine_tolerance = self.syn_params.pop('refine_tolerance', None)
+        if not 0 < self.refine_shrink < 1:
+            raise ValueError('refine_shrink must be between 0 and 1.')
+        if self.refine_points < 2:
+            raise ValueError('refine_points must be at least 2.')
+        self.refinement = None
+        self.prune = self.syn_params.pop('prune', False)
+        if self.prune is True:
+            self.prune = 'monotonic'
+        if self.prune not in [False, None, 'monotonic', 'convex']:
+            raise ValueError("prune must be 'monotonic' or 'convex'.")
+        if self.prune and self.refine:
+            raise ValueError('prune and refine can not be used together.')
+        self.prune_margin = float(self.syn_params.pop('prune_margin', 1.))
+        self.prune_seed = self.syn_params.pop('prune_seed', None) or {}
+        self.pruning = None
+        self.pruned = None
+        self.method = self.syn_params.pop('method', 'grid')
+        if self.method not in ['grid', 'lm']:
+            raise ValueError("method must be 'grid' or 'lm'.")
+        self.lm_initial = self.syn_params.pop('lm_initial', None) or {}
+        self.lm_iterations = int(self.syn_params.pop('lm_iterations', 20))
+        self.lm_tolerance = float(self.syn_params.pop('lm_tolerance', 1e-3))
+        self.covariance = None
+        self.least_squares_fit = None
+        self.emulator = self.syn_params.pop('emulator', None)
+        if isinstance(self.emulator, basestring):
+            self.emulator = load_emulator(self.emulator)
+        self.verification = None
+        self.uncertainties = {}
+        self.lm_residuals = {}
+        if self.workers > 1 and self.syn_params.get('pool') is not None:
+            raise ValueError('A GDL pool can not be shared by processes.')
+
         if 'noplot' in self.syn_params and self.syn_params['noplot'] == True:
             self.noplot = True
             del self.syn_params['noplot']
@@ -162,6 +615,9 @@ class Synfit:
             self.weights = np.ones_like(obs_spec[:,0])
             self.windows = None
 
+        # Observed pixels with non-zero weight, compared to each synthesis
+        self.observation = Observation(obs_spec, self.weights)
+
         # Obtain teff and logg if set on syn_params
         if 'teff' in self.syn_params:
             self.teff = self.syn_params.pop('teff')
@@ -169,9 +625,18 @@ class Synfit:
         if 'logg' in self.syn_params:
             self.logg = self.syn_params.pop('logg')
 
+        # Directory of the library of unconvolved spectra
+        self.library_dir = None
+
         # Initialize variable to store the best fit values
         self.best_fit = {}
 
+        # Errors of the failed syntheses, by grid point or library spectrum
+        self.failed = {}
+
+        # Timings of all syntheses of the fit
+        self.timings = Timings()
+
 
     def sample_params(self):
         """
@@ -235,55 +700,509 @@ class Synfit:
         """
         # Creates the values in which each parameter will be fitted
         self.sample_params()
+        if self.emulator is not None:
+            self.check_emulator()
+
+        self.failed = {}
+        self.timings = Timings()
+        self.refinement = None
+        self.pruning = None
+        self.pruned = None
+        self.least_squares_fit = None
+        self.verification = None
+        try:
+            if self.method == 'lm':
+                self.least_squares()
+            elif self.refine:
+                self.refine_grid()
+            elif self.prune:
+                self.prune_grid()
+            else:
+                # Create iterator.
+                iter_values = iterator(self.fit_keys, self.iter_params)
+
+                # Create a library of unconvolved spectra
+                if self.emulator is None:
+                    self.build_library()
 
-        # Create iterator.
-        iter_values = iterator(self.fit_keys, self.iter_params)
+                # Loop it!
+                self.evaluate(iter_values)
 
-        #Obtain the number of varying params
-        n_params = len(self.fit_keys)
+            # Find the best value
+            if self.method == 'grid':
+                self.find_best_fit()
 
-        ######
-        # Array to store the values of each parameter and the chisquare
+            if self.emulator is not None:
+                self.verify_best_fit()
+        finally:
+            self.remove_library()
 
-        ## Create an array of NaN
-        chisquare = np.empty([len(iter_values), 1])
+
+    def evaluate(self, iter_values):
+        """
+        Calculate the chi-square of grid points, on a new `chisq_values`.
+        """
+        self.chisq_values = chisquare_table(self.fit_keys, iter_values)
+
+        if self.emulator is not None:
+            batch = []
+            for n, it in enumerate(iter_values):
+                try:
+                    with self.timings.measure('emulator'):
+                        batch.append((n, self.emulate(it)))
+                except ValueError as err:
+                    self.synthesis_failed(n, err)
+            self.store_chi_square(batch)
+        elif self.workers > 1:
+            self.parallel_iterations(iter_values)
+        elif self.noplot:
+            self.batch_iterations(iter_values)
+        else:
+            for n, it in enumerate(iter_values):
+                self.iteration(n, it)
+
+
+    def refine_grid(self):
+        """
+        Calculate a coarse grid and then finer ones around its best point,
+        down to the step of `fit_params`. See `refine` on `Synfit`.
+
+        At the end, `chisq_values` has all points of the dense grid, with
+        NaN for the ones not calculated, and the grid points that failed
+        are keyed on `failed` by their row on it.
+        """
+        vectors = [self.iter_params[key] for key in self.fit_keys]
+        sizes = [len(vector) for vector in vectors]
+        strides = [max(1, int(np.ceil((size - 1.) / (self.refine_points - 1))))
+                   for size in sizes]
+        indices = [refine_indices(0, size - 1, stride, size)
+                   for size, stride in zip(sizes, strides)]
+
+        chisquare = np.empty(int(np.prod(sizes)))
         chisquare.fill(np.nan)
+        calculated = np.zeros(len(chisquare), dtype=bool)
+        failed_points = {}
+        library_size = 0
+        levels = 0
+        previous = None
+
+        self.remove_library()
+        self.library_dir = tempfile.mkdtemp(prefix='s4_synfit_')
+        while True:
+            levels += 1
+            rows = np.ravel_multi_index(np.array(list(product(*indices))).T,
+                                        sizes)
+            rows = rows[~calculated[rows]]
+
+            if len(rows) > 0:
+                chisquare[rows], library = self.evaluate_rows(rows,
+                                                              failed_points)
+                library_size += library
+                calculated[rows] = True
+
+            if np.isnan(chisquare).all() or max(strides) == 1:
+                break
+
+            best = np.nanmin(chisquare)
+            if self.refine_tolerance is not None and previous is not None \
+               and previous - best <= self.refine_tolerance * abs(previous):
+                break
+            previous = best
+
+            center = np.unravel_index(np.nanargmin(chisquare), sizes)
+            new_strides = [max(1, int(stride * self.refine_shrink))
+                           for stride in strides]
+            indices = [refine_indices(index, stride, new_stride, size)
+                       for index, stride, new_stride, size
+                       in zip(center, strides, new_strides, sizes)]
+            strides = new_strides
+
+        self.chisq_values = chisquare_table(
+            self.fit_keys, iterator(self.fit_keys, self.iter_params))
+        self.chisq_values['chisquare'][:, 0] = chisquare
+        self.failed.update(failed_points)
+
+        dense = self.dense_syntheses()
+        calculations = int(calculated.sum()) + library_size
+        self.refinement = {'levels': levels, 'syntheses': calculations,
+                           'dense_syntheses': dense,
+                           'saved': dense - calculations}
+
+
+    def prune_grid(self):
+        """
+        Calculate the grid outward from `prune_seed`, skipping the points
+        whose chi-square is bound to exceed the best one. See `prune` on
+        `Synfit` and `branch_and_bound`.
+
+        At the end, `chisq_values` has all points of the grid, with NaN for
+        the ones skipped, and the grid points that failed are keyed on
+        `failed` by their row on it.
+        """
+        vectors = [self.iter_params[key] for key in self.fit_keys]
+        seed = [np.abs(vector - self.prune_seed[key]).argmin()
+                if key in self.prune_seed else (len(vector) - 1) // 2
+                for key, vector in zip(self.fit_keys, vectors)]
+
+        failed_points = {}
+        library_sizes = []
+
+        def evaluate(rows):
+            """Chi-square of rows of the grid."""
+            chisquare, library_size = self.evaluate_rows(rows, failed_points)
+            library_sizes.append(library_size)
+            return chisquare
+
+        self.remove_library()
+        self.library_dir = tempfile.mkdtemp(prefix='s4_synfit_')
+        chisquare, self.pruned = branch_and_bound(
+            evaluate, [len(vector) for vector in vectors], seed,
+            self.prune_margin, self.prune == 'convex')
+
+        self.chisq_values = chisquare_table(
+            self.fit_keys, iterator(self.fit_keys, self.iter_params))
+        self.chisq_values['chisquare'][:, 0] = chisquare
+        self.failed.update(failed_points)
+
+        dense = self.dense_syntheses()
+        calculations = int((~self.pruned).sum()) + sum(library_sizes)
+        self.pruning = {'syntheses': calculations, 'dense_syntheses': dense,
+                        'pruned': int(self.pruned.sum())}
+
+
+    def evaluate_rows(self, rows, failed_points):
+        """
+        Calculate the chi-square of rows of the dense grid of `iter_params`
+        and the spectra of the library they need.
+
+        Parameters
+        ----------
+
+        rows: numpy.ndarray;
+            Rows of the dense grid, in the order of `iterator`.
+
+        failed_points: dict;
+            The errors of the grid points that fail are added to it, keyed by
+            their row.
 
-        ## Create the array with the iteration avlues + NaN for the chisquare
+        Returns
+        -------
 
-        ### Remove the data type of the iter_values array.
-        ### this is necessary in order to add the chisquare array
-        #### Removes data type
-        tmp_array = iter_values.view((float, n_params))
-        #### Guarantee that the format will be correct for any number of
-        #### parameters
-        tmp_array = tmp_array.reshape(len(iter_values), -1)
+        chisquare: numpy.ndarray;
+            The chi-square of each row.
 
-        ### Join the arrays
-        self.chisq_values = np.hstack((tmp_array, chisquare))
+        library_size: int;
+            Number of spectra of the library calculated.
+        """
+        vectors = [self.iter_params[key] for key in self.fit_keys]
+        sizes = [len(vector) for vector in vectors]
+        iter_values = np.array(
+            [tuple(vector[i] for vector, i in zip(vectors, index))
+             for index in zip(*np.unravel_index(rows, sizes))],
+            dtype={'names':self.fit_keys,
+                   'formats':[float] * len(self.fit_keys)})
+
+        if self.emulator is None:
+            library_size = self.build_library(
+                self.no_rot_points(iter_values), keep=True)
+        else:
+            library_size = 0
+        self.evaluate(iter_values)
 
-        ### Set the data type for the chisq_values array
-        data_type = self.fit_keys + ['chisquare']
-        self.chisq_values.dtype = {'names':data_type,
-                                   'formats':[float]*len(data_type)}
-        ######
+        # Failed grid points by their row on the dense grid
+        for n in [key for key in self.failed
+                  if isinstance(key, (int, long))]:
+            failed_points[int(rows[n])] = self.failed.pop(n)
 
-        # Create a library of unconvolved spectra
-        self.build_library()
+        return self.chisq_values['chisquare'][:, 0], library_size
 
-        # Loop it!
-        for n, it in enumerate(iter_values):
-            self.iteration(n, it)
 
-        # Find the best value
-        self.find_best_fit()
+    def no_rot_points(self, iter_values):
+        """
+        Distinct values of the parameters not related to rotation of a list of
+        points, i.e., the spectra of the library they need, or None if the
+        fit has no library of that kind.
+        """
+        if len(self.no_rot_keys) == 0 or len(self.rot_keys) == 0:
+            return None
+
+        return np.array(
+            OrderedDict.fromkeys(tuple(it[key] for key in self.no_rot_keys)
+                                 for it in iter_values).keys(),
+            dtype={'names':self.no_rot_keys,
+                   'formats':[float] * len(self.no_rot_keys)})
 
 
-    def build_library(self):
-        """Build spectra library of unconvolved spectra"""
+    def dense_syntheses(self):
+        """Number of syntheses of the dense grid, including its library."""
+        if len(self.no_rot_keys) > 0 and len(self.rot_keys) > 0:
+            dense_library = int(np.prod([len(self.iter_params[key])
+                                         for key in self.no_rot_keys]))
+        else:
+            dense_library = len(self.rot_keys) > 0
+
+        return int(np.prod([len(self.iter_params[key])
+                            for key in self.fit_keys])) + dense_library
+
+
+    def least_squares(self):
+        """
+        Fit the parameters by Levenberg-Marquardt. See `method` on `Synfit`.
+        """
+        bounds = np.array([[float(val) for val in self.fit_params[key]]
+                           for key in self.fit_keys])
+        lower = bounds[:, :2].min(axis=1)
+        upper = bounds[:, :2].max(axis=1)
+        steps = np.abs(bounds[:, 2])
+
+        # Limit Teff and log g to the ranges of the grid of models
+        for n, key in enumerate(self.fit_keys):
+            limits = {'teff': atmosphere.TEFF_RANGE,
+                      'logg': atmosphere.LOGG_RANGE}.get(key)
+            if limits is not None:
+                lower[n] = max(lower[n], limits[0])
+                upper[n] = min(upper[n], limits[1])
+
+        initial = [self.lm_initial.get(key, (low + up) / 2.)
+                   for key, low, up in zip(self.fit_keys, lower, upper)]
+
+        self.lm_residuals = OrderedDict()
+        self.remove_library()
+        self.library_dir = tempfile.mkdtemp(prefix='s4_synfit_')
+        result = levenberg_marquardt(self.point_residuals, initial, lower,
+                                     upper, steps, feasible=self.in_grid,
+                                     max_iterations=self.lm_iterations,
+                                     tolerance=self.lm_tolerance)
+
+        # Chi-square of all points calculated
+        self.chisq_values = chisquare_table(
+            self.fit_keys,
+            np.array(self.lm_residuals.keys(),
+                     dtype={'names':self.fit_keys,
+                            'formats':[float] * len(self.fit_keys)}))
+        self.chisq_values['chisquare'][:, 0] = [
+            np.nan if res is None else np.dot(res, res)
+            for res in self.lm_residuals.values()]
+
+        self.best_fit = dict(zip(self.fit_keys, result['x']))
+        self.best_fit['chisquare'] = result['chisquare']
+        self.covariance = result['covariance']
+        self.uncertainties = {key: np.sqrt(var) for key, var in
+                              zip(self.fit_keys, np.diag(self.covariance))}
+        self.least_squares_fit = {'points': len(self.lm_residuals),
+                                  'iterations': result['iterations'],
+                                  'converged': result['converged']}
+
+
+    def point_residuals(self, points):
+        """
+        Residuals of a list of points of the least-squares fit, each an array
+        with the values of `fit_keys`. The points not calculated yet are
+        calculated in `workers` processes and kept on `lm_residuals`, with
+        None if their synthesis failed.
+        """
+        names = [tuple(float(val) for val in point) for point in points]
+        missing = [name for name in OrderedDict.fromkeys(names)
+                   if name not in self.lm_residuals]
+        if not missing:
+            return [self.lm_residuals[name] for name in names]
+
+        iter_values = np.array(missing,
+                               dtype={'names':self.fit_keys,
+                                      'formats':[float] * len(self.fit_keys)})
+
+        if self.emulator is not None:
+            for name, it in zip(missing, iter_values):
+                try:
+                    with self.timings.measure('emulator'):
+                        wave, flux = self.emulate(it)
+                except ValueError as err:
+                    self.synthesis_failed(name, err)
+                    self.lm_residuals[name] = None
+                    continue
+                self.lm_residuals[name] = self.observation.residuals(wave,
+                                                                     flux)
+            return [self.lm_residuals[name] for name in names]
+
+        # Unconvolved spectra of the new points
+        self.build_library(self.no_rot_points(iter_values), keep=True)
+
+        calculated = []
+        tasks = []
+        for name, it in zip(missing, iter_values):
+            teff, logg, synplot_params, stage, spec_name = \
+                self.point_parameters(it)
+            if spec_name in self.failed:
+                self.lm_residuals[name] = None
+                continue
+            calculated.append(name)
+            tasks.append(((teff, logg, self.synplot_path, self.idl),
+                          synplot_params, stage))
+
+        for name, (res, err, timings) in zip(
+                calculated, self.map_tasks(_residuals_one, tasks, shared=True)):
+            self.timings.merge(timings)
+            if err is not None:
+                self.synthesis_failed(name, err)
+            self.lm_residuals[name] = res
+
+        return [self.lm_residuals[name] for name in names]
+
+
+    def in_grid(self, point):
+        """
+        Check if the model atmosphere of a point of the least-squares fit can
+        be interpolated from the BSTAR2006 grid. Only fitted Teff and log g
+        are checked.
+        """
+        params = dict(zip(self.fit_keys, point))
+        if self.emulator is not None:
+            return self.emulator.covers(self.emulator_point(params))
+
+        if 'teff' not in params and 'logg' not in params:
+            return True
+
+        teff = params.get('teff', self.teff)
+        logg = params.get('logg', self.logg)
+        grids = [atmosphere.BSTAR_GRID]
+        if params.get('metal', self.syn_params.get('metal')) is not None:
+            grids.append(atmosphere.BSTAR_GRID_LOW_Z)
+
+        return all(atmosphere.grid_covers(teff, logg, self.synplot_path, grid)
+                   for grid in grids)
+
+
+    def check_emulator(self):
+        """
+        Check if the emulator predicts the spectra of the fit: the fitted
+        parameters must be parameters of its grid and the other
+        `EMULATOR_SETTINGS`, and settings saved with the emulator, those of
+        its training.
+        """
+        keys = self.emulator.keys
+        missing = [key for key in self.fit_keys
+                   if parameter_key(key) not in keys]
+        if missing:
+            raise ValueError('The emulator does not vary {}.'.format(
+                ', '.join(str(key) for key in missing)))
+
+        point = self.emulator_point({})
+        skipped = set(keys + EMULATOR_RUN_OPTIONS + IGNORED_PARAMETERS +
+                      POSTPROCESS_KEYS)
+        settings = set(EMULATOR_SETTINGS).union(self.emulator.parameters)
+        for key in sorted(settings.difference(skipped)):
+            trained = self.emulator_setting(
+                key, self.emulator.parameters.get(key))
+            used = self.emulator_setting(key, point.get(key))
+            if trained != used:
+                raise ValueError('The emulator was trained with {}={}, but '
+                                 'the fit uses {}.'.format(key, trained,
+                                                           used))
+
+
+    def emulator_setting(self, key, value):
+        """
+        Normalized value of a setting of the emulator, with the default of
+        Synplot if it is not given. Elements of the grid are left out of
+        `abund`, and the line list is compared by its full path.
+        """
+        if value is None:
+            value = EMULATOR_DEFAULTS.get(key)
+        value = normalize_value(value)
+
+        if key == 'abund' and isinstance(value, dict):
+            periodic = periodic_table()
+            grid = [str(periodic.get(element, element))
+                    for element in self.emulator.keys]
+            value = {element: val for element, val in value.iteritems()
+                     if element not in grid} or 'None'
+        elif key == 'linlist' and value != 'None':
+            value = os.path.realpath(os.path.expanduser(value))
+
+        return value
+
+
+    def emulator_point(self, params):
+        """
+        Values of the parameters of the emulator at a point, from the fitted
+        values, a dict, and the fixed ones.
+        """
+        point = dict(self.syn_params)
+        for key in ['teff', 'logg']:
+            if hasattr(self, key):
+                point[key] = getattr(self, key)
+        point.update({parameter_key(key): val for key, val
+                      in self.syn_params.get('abund', {}).iteritems()})
+        point.update({parameter_key(key): val
+                      for key, val in params.iteritems()})
+
+        return point
+
+
+    def emulate(self, it):
+        """
+        Wavelength and flux predicted by the emulator at a grid point, with
+        the scale applied.
+        """
+        point = self.emulator_point(dict(zip(it.dtype.names, it)))
+        spectrum, _ = self.emulator.predict(point)
+        flux = spectrum[:, 1]
+        if 'scale' in point:
+            flux = flux * float(point['scale'])
+
+        return spectrum[:, 0], flux
+
+
+    def verify_best_fit(self):
+        """
+        Calculate the spectrum of the best point of a fit against the
+        emulator, and its unconvolved spectrum if needed, and replace the
+        emulated chi-square by its one.
+        """
+        iter_values = np.array(
+            [tuple(self.best_fit[key] for key in self.fit_keys)],
+            dtype={'names':self.fit_keys,
+                   'formats':[float] * len(self.fit_keys)})
+        self.build_library(self.no_rot_points(iter_values), keep=True)
+        teff, logg, synplot_params, stage, spec_name = \
+            self.point_parameters(iter_values[0])
+
+        chisq = np.nan
+        if spec_name not in self.failed:
+            self.synthesis = Synplot(teff, logg, self.synplot_path, self.idl,
+                                     **synplot_params)
+            try:
+                self.run_synthesis(self.synthesis, stage)
+                with self.timings.measure('chisquare'):
+                    chisq = self.observation.chi_square(
+                        [synthetic_flux(self.synthesis)])[0]
+            except SYNTHESIS_ERRORS as err:
+                self.synthesis_failed('best_fit', err)
+
+        self.verification = {'emulated': self.best_fit['chisquare'],
+                             'synthesized': chisq}
+        if np.isfinite(chisq):
+            self.best_fit['chisquare'] = chisq
+
+
+    def library_parameters(self, no_rot_values=None):
+        """
+        Name, effective temperature, surface gravity and Synplot parameters
+        of each unconvolved spectrum of the library.
+
+        Parameters
+        ----------
+
+        no_rot_values: numpy.ndarray (optional);
+            Values of the parameters not related to rotation, as returned by
+            `iterator`. The default is all the values of `iter_params`.
+        """
         if len(self.no_rot_keys) > 0 and len(self.rot_keys) > 0:
             # Build library for non rotation parameters with vsini=vmac_rt=0
-            no_rot_values = iterator(self.no_rot_keys, self.iter_params)
+            if no_rot_values is None:
+                no_rot_values = iterator(self.no_rot_keys, self.iter_params)
+
+            library = []
             for n, it in enumerate(no_rot_values):
                 ## Creates a dic with the parameters and values to be fitted
                 ## in this loop
@@ -306,7 +1225,8 @@ class Synfit:
                 ### Gets all chemical elements asked to be fit
                 abund = {key:it[key]
                          for key in it.dtype.names
-                         if (key in PERIODIC) or (key in REVERSE_PERIODIC)}
+                         if (key in periodic_table()) or
+                            (key in element_symbols())}
                 if abund:
                     ### delete the chemical elements parameters from the
                     ### dictionary
@@ -320,19 +1240,12 @@ class Synfit:
                 ## Deal with fixed and varying abundances
                 self.merge_abundances(abund, synplot_params)
 
-                ## Synthesize spectrum
-                self.synthesis = Synplot(self.teff, self.logg,
-                                         self.synplot_path, self.idl,
-                                         **synplot_params)
-                self.synthesis.run()
-
-                ## Backup fort.7 and fort.17
                 spec_name = '_'.join(['{}_{}'.format(key, val)
                                       for key, val in zip(it.dtype.names, it)])
-                shutil.move('{}fort.7'.format(self.synplot_path),
-                            '/tmp/synfit_{}.7'.format(spec_name))
-                shutil.move('{}fort.17'.format(self.synplot_path),
-                            '/tmp/synfit_{}.17'.format(spec_name))
+                library.append((spec_name, self.teff, self.logg,
+                                synplot_params))
+
+            return library
 
         elif len(self.no_rot_keys) == 0 and len(self.rot_keys) > 0:
             # There is only 'vrot' or/and 'vmac_rt'. All iteration fits will
@@ -345,22 +1258,13 @@ class Synfit:
             synplot_params['vrot'] = 0
             synplot_params['vmac_rt'] = 0
 
-            ## Synthesize spectrum
-            synthesis = Synplot(self.teff, self.logg, self.synplot_path,
-                                self.idl, **synplot_params)
-            synthesis.run()
-
-            ## Backup fort.7 and fort.17
-            shutil.move('{}fort.7'.format(self.synplot_path),
-                        '/tmp/synfit.7')
-            shutil.move('{}fort.17'.format(self.synplot_path),
-                        '/tmp/synfit.17')
+            return [('synfit', self.teff, self.logg, synplot_params)]
 
         elif len(self.no_rot_keys) > 0 and len(self.rot_keys) == 0:
             # No rotational parameters
             # Do not build library.
             # There is no need since Synspec will have to run every time.
-            pass
+            return []
         else:
             # There is no parameters. Something wen wrong?
             raise RuntimeError("There is no parameters or it was not " + \
@@ -368,19 +1272,162 @@ class Synfit:
                                "It seems that something went wrong.")
 
 
-    def iteration(self, n, it):
-        """Code to be iterated on a loop."""
+    def build_library(self, no_rot_values=None, keep=False):
+        """
+        Build spectra library of unconvolved spectra.
+
+        The fort.7 and fort.17 of each spectrum are kept in a private
+        directory, `library_dir`, so fits can run at the same time.
+
+        Parameters
+        ----------
+
+        no_rot_values: numpy.ndarray (optional);
+            See `library_parameters`.
+
+        keep: bool (optional);
+            If True, the spectra already in the library, or that failed,
+            are kept and not calculated again.
+
+        Returns
+        -------
+
+        int;
+            Number of spectra calculated.
+        """
+        if not keep or self.library_dir is None:
+            self.remove_library()
+            self.library_dir = tempfile.mkdtemp(prefix='s4_synfit_')
+
+        library = [entry for entry in self.library_parameters(no_rot_values)
+                   if entry[0] not in self.failed and not
+                   os.path.isfile(self.library_files(entry[0])['fort.7'])]
+
+        if self.workers > 1:
+            tasks = [((teff, logg, self.synplot_path, self.idl),
+                      synplot_params, self.library_files(spec_name))
+                     for spec_name, teff, logg, synplot_params in library]
+            results = self.map_tasks(_library_one, tasks)
+            for (spec_name, _, _, _), (err, timings) in zip(library,
+                                                            results):
+                self.timings.merge(timings)
+                if err is not None:
+                    self.synthesis_failed(spec_name, err)
+            return len(library)
+
+        for spec_name, teff, logg, synplot_params in library:
+            ## Synthesize spectrum
+            self.synthesis = Synplot(teff, logg, self.synplot_path, self.idl,
+                                     **synplot_params)
+            try:
+                self.run_synthesis(self.synthesis)
+            except SYNTHESIS_ERRORS as err:
+                ## The convolutions of this spectrum will fail too
+                self.synthesis_failed(spec_name, err)
+                continue
+
+            ## Backup fort.7 and fort.17
+            self.store_unconvolved(self.synthesis, spec_name)
+
+        return len(library)
+
 
+    def map_tasks(self, function, tasks, shared=False):
+        """
+        Run a function of the module on a list of tasks, in `workers`
+        processes, keeping their order.
+
+        If `shared`, the function also receives the observation. The worker
+        processes inherit it when they are forked, so it is neither pickled
+        with each task nor loaded again, and its arrays are shared until
+        they are written, which they never are.
+        """
+        workers = min(self.workers, len(tasks))
+        if workers <= 1:
+            if shared:
+                return [function(task, self.observation) for task in tasks]
+            return [function(task) for task in tasks]
+
+        if shared:
+            pool = mp.Pool(workers, initializer=_share_observation,
+                           initargs=(self.observation,))
+        else:
+            pool = mp.Pool(workers)
+        try:
+            return pool.map(function, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+
+    def run_synthesis(self, synthesis, stage=None):
+        """Run a synthesis, adding its timings to those of the fit."""
+        try:
+            synthesis.run(stage=stage)
+        finally:
+            self.timings.merge(synthesis.timings)
+
+
+    def synthesis_failed(self, name, err):
+        """
+        Record the error of a synthesis, whose grid points will have a NaN
+        chi-square.
+        """
+        self.failed[name] = err
+
+
+    def store_unconvolved(self, synthesis, spec_name):
+        """
+        Move the unconvolved spectrum (fort.7 and fort.17) of a synthesis
+        to the library.
+        """
+        for ext in ['7', '17']:
+            shutil.move(synthesis.workspace.file('fort.' + ext),
+                        os.path.join(self.library_dir,
+                                     '{}.{}'.format(spec_name, ext)))
+
+
+    def library_files(self, spec_name):
+        """
+        Files to be staged on the workspace of a synthesis in order to
+        convolve a spectrum of the library.
+        """
+        return {'fort.' + ext: os.path.join(self.library_dir,
+                                            '{}.{}'.format(spec_name, ext))
+                for ext in ['7', '17']}
+
+
+    def remove_library(self):
+        """Delete the library of unconvolved spectra."""
+        if self.library_dir is not None:
+            shutil.rmtree(self.library_dir, ignore_errors=True)
+            self.library_dir = None
+
+
+    def point_parameters(self, it):
+        """
+        Synplot arguments of a grid point.
+
+        Returns
+        -------
+
+        teff, logg: float;
+            Effective temperature and surface gravity.
+
+        synplot_params: dict;
+            Synplot parameters.
+
+        stage: dict;
+            Files of the library to be convolved, or None if the spectrum is
+            calculated.
+
+        spec_name: str;
+            Name of the spectrum of the library, or None.
+        """
         # Creates a dic with the parameters and values to be fitted
         #in this loop
         params = {key:val for key, val in zip(it.dtype.names, it)}
 
-
-        #make plot title before removing teff and logg
-        if self.noplot == False:
-            plot_title = ', '.join(['{}={}'.format(key, val)
-                                    for key, val in params.iteritems()])
-
         # Check if teff and logg were selected to be fitted.
         # If yes, set a variable to them.
         if 'teff' in params:
@@ -394,7 +1441,7 @@ class Synfit:
         ## Gets all chemical elements asked to be fit
         abund = {key:it[key]
                  for key in it.dtype.names
-                 if (key in PERIODIC) or (key in REVERSE_PERIODIC)}
+                 if (key in periodic_table()) or (key in element_symbols())}
         if abund:
             ## delete the chemical elements parameters from the dictionary
             for key in abund:
@@ -419,10 +1466,6 @@ class Synfit:
             spec_name = '_'.join(['{}_{}'.format(key, val)
                                   for key, val in zip(it.dtype.names, it)
                                   if key not in ['vrot', 'vmac_rt']])
-            shutil.copy('/tmp/synfit_{}.7'.format(spec_name),
-                        '{}fort.7'.format(self.synplot_path))
-            shutil.copy('/tmp/synfit_{}.17'.format(spec_name),
-                        '{}fort.17'.format(self.synplot_path))
 
         elif len(self.no_rot_keys) == 0 and len(self.rot_keys) > 0:
             # Set to not calculate spectrum, just convolve
@@ -431,60 +1474,126 @@ class Synfit:
             synplot_params['norun'] = 1
 
             ## There is only 'vrot' or/and 'vmac_rt'.
-            shutil.copy('/tmp/synfit.7',
-                        '{}fort.7'.format(self.synplot_path))
-            shutil.copy('/tmp/synfit.17',
-                        '{}fort.17'.format(self.synplot_path))
+            spec_name = 'synfit'
+
         elif len(self.no_rot_keys) > 0 and len(self.rot_keys) == 0:
             # No rotational parameters
-            pass
+            return self.teff, self.logg, synplot_params, None, None
         else:
             # There is no parameters. Something wen wrong?
             raise RuntimeError("There is no parameters or it was not " + \
                                "classified as rotational or non rotational. " +\
                                "It seems that something went wrong.")
 
+        return (self.teff, self.logg, synplot_params,
+                self.library_files(spec_name), spec_name)
 
-        # Synthesize spectrum
-        self.synthesis = Synplot(self.teff, self.logg, self.synplot_path,
-                                 self.idl, **synplot_params)
-        self.synthesis.run()
 
-        # Apply scale and radial velocity if needed
-        if 'scale' in self.synthesis.parameters:
-            self.synthesis.apply_scale()
+    def synthesize_point(self, n, it, plot=False):
+        """
+        Calculate the spectrum of a grid point. If `plot`, the synthesis
+        also gets the observed spectrum, to be plotted.
+
+        Returns
+        -------
+
+        Synplot or None;
+            The synthesis, or None if it failed.
+        """
+        teff, logg, synplot_params, stage, spec_name = \
+            self.point_parameters(it)
+
+        ## Its unconvolved spectrum failed. Keep the NaN chi-square.
+        if spec_name in self.failed:
+            return None
+
+        # Synthesize spectrum
+        if plot:
+            synplot_params['observ'] = self.observed_spectrum
+        self.synthesis = Synplot(teff, logg, self.synplot_path, self.idl,
+                                 **synplot_params)
+        try:
+            self.run_synthesis(self.synthesis, stage)
+        except SYNTHESIS_ERRORS as err:
+            # Keep the NaN chi-square of this grid point
+            self.synthesis_failed(n, err)
+            return None
 
-        self.synthesis.observation[:, 0] *= rvcorr(self.rad_vel)
+        return self.synthesis
 
-        #Do an interpolation
 
-        flm = np.interp(self.synthesis.observation[:,0],
-                        self.synthesis.spectrum[:,0],
-                        self.synthesis.spectrum[:,1])
-                        #/max(syn.observation[:,1])
+    def iteration(self, n, it):
+        """Code to be iterated on a loop."""
 
-        #Some kind of normalization on the observed flux?
-        fobm = self.synthesis.observation[:,1]#/max(syn.observation[:,1])
+        #make plot title before removing teff and logg
+        params = {key:val for key, val in zip(it.dtype.names, it)}
+        plot_title = ', '.join(['{}={}'.format(key, val)
+                                for key, val in params.iteritems()])
 
-        # Calculate the chi**2
-        chisq = np.sum(((fobm - flm)**2/flm) * self.weights)
-        #chisq = chisq * max(fobs)                 #????
+        synthesis = self.synthesize_point(n, it, plot=True)
+        if synthesis is None:
+            return
 
         # store the values of the parameters
-        self.chisq_values['chisquare'][n] = chisq
+        self.store_chi_square([(n, synthetic_flux(synthesis))])
+        chisq = self.chisq_values['chisquare'][n, 0]
 
-        # Plot, if desired
-        if self.noplot == False:
-            # The synthetic spectrum was corrected by scale and the
-            #observed one by radial velocity. The plot function in Synplot
-            #also does that, so we need to set those parameters to 1 and 0,
-            # respectively.
-            self.synthesis.parameters['scale'] = 1
-            self.synthesis.parameters['rv'] = 0
+        # Plot. Synplot applies the scale and the radial velocity.
+        # Adds the value of chisquare to the title
+        plot_title += r'$\chi^2$='+'{:.06f}'.format(chisq)
+        synthesis.plot(title=plot_title, windows=self.windows)
 
-            # Adds the value of chisquare to the title
-            plot_title += r'$\chi^2$='+'{:.06f}'.format(chisq)
-            self.synthesis.plot(title=plot_title, windows=self.windows)
+
+    def batch_iterations(self, iter_values):
+        """
+        Calculate the spectra of the grid points, without plotting them, and
+        their chi-square in batches of `BATCH_SIZE` spectra.
+        """
+        for start in range(0, len(iter_values), BATCH_SIZE):
+            batch = []
+            for n in range(start, min(start + BATCH_SIZE, len(iter_values))):
+                synthesis = self.synthesize_point(n, iter_values[n])
+                if synthesis is not None:
+                    batch.append((n, synthetic_flux(synthesis)))
+            self.store_chi_square(batch)
+
+
+    def store_chi_square(self, batch):
+        """
+        Calculate the chi-square of a batch of spectra, a list of the grid
+        point and the wavelength and flux of each, on `chisq_values`.
+        """
+        if not batch:
+            return
+
+        rows, spectra = zip(*batch)
+        with self.timings.measure('chisquare'):
+            self.chisq_values['chisquare'][list(rows), 0] = \
+                self.observation.chi_square(list(spectra))
+
+
+    def parallel_iterations(self, iter_values):
+        """
+        Calculate the chi-square of the grid points in `workers` processes.
+        """
+        points = []
+        tasks = []
+        for n, it in enumerate(iter_values):
+            teff, logg, synplot_params, stage, spec_name = \
+                self.point_parameters(it)
+            if spec_name in self.failed:
+                continue
+            points.append(n)
+            tasks.append(((teff, logg, self.synplot_path, self.idl),
+                          synplot_params, stage))
+
+        for n, (chisq, err, timings) in zip(
+                points, self.map_tasks(_iteration_one, tasks, shared=True)):
+            self.timings.merge(timings)
+            if err is not None:
+                self.synthesis_failed(n, err)
+            else:
+                self.chisq_values['chisquare'][n] = chisq
 
 
     @staticmethod
@@ -500,7 +1609,7 @@ class Synfit:
             ### Transform all elements to its symbol
             for key, val in deepcopy(abund).iteritems():
                 try:
-                    abund[REVERSE_PERIODIC[key]] = val
+                    abund[element_symbols()[key]] = val
                     del abund[key]
                 except KeyError:
                     #### The chemical element is already as a symbol
@@ -508,7 +1617,7 @@ class Synfit:
 
             for key, val in deepcopy(synplot_params['abund']).iteritems():
                 try:
-                    synplot_params['abund'][REVERSE_PERIODIC[key]] = val
+                    synplot_params['abund'][element_symbols()[key]] = val
                     del synplot_params['abund'][key]
                 except KeyError:
                     #### The chemical element is already as a symbol
@@ -532,10 +1641,14 @@ class Synfit:
     def find_best_fit(self):
         """
         Obtain the fitted parameters for the chosen parameters and the
-        value of the chi^2.
+        value of the chi^2. Grid points whose synthesis failed, i.e., with
+        NaN chi^2, are ignored.
         """
-        fitted_vals = self.chisq_values[np.argmin(
-                                        self.chisq_values['chisquare'])]
+        chisquare = self.chisq_values['chisquare']
+        if np.isnan(chisquare).all():
+            raise RuntimeError('All syntheses failed.')
+
+        fitted_vals = self.chisq_values[np.nanargmin(chisquare)]
 
         self.best_fit = {param:fitted_value
                            for param, fitted_value
@@ -581,7 +1694,7 @@ class Synfit:
         ## Gets all chemical elements asked to be fit
         abund = {key:val
                  for key, val in self.best_fit.iteritems()
-                 if (key in PERIODIC) or (key in REVERSE_PERIODIC)}
+                 if (key in periodic_table()) or (key in element_symbols())}
         if abund:
             for key in abund:
                 del best_fit[key]
@@ -596,7 +1709,8 @@ class Synfit:
 
         # Synthesize spectrum
         synthesis = Synplot(self.teff, self.logg, self.synplot_path,
-                            self.idl, **synplot_params)
+                            self.idl, observ=self.observed_spectrum,
+                            **synplot_params)
         synthesis.plot(title=title, windows=self.windows)
 
 
@@ -621,6 +1735,8 @@ class Synfit:
         kwargs;
             Matplotlib.pyplot.plot kwargs.
         """
+        import matplotlib.pyplot as plt
+
         # Number of parameters fitted.
         number_params = len(self.fit_keys)
 
@@ -633,14 +1749,17 @@ class Synfit:
             else:
                 y_axis = self.chisq_values['chisquare']
 
-            ax.plot(self.iter_params[self.fit_keys[0]],
-                    y_axis, zorder=5, **kwargs)
+            # Points not calculated, or failed, are not plotted
+            x_axis = self.chisq_values[self.fit_keys[0]][:, 0]
+            finite = np.isfinite(self.chisq_values['chisquare'][:, 0])
+            order = [n for n in np.argsort(x_axis) if finite[n]]
+            ax.plot(x_axis[order], y_axis[order], zorder=5, **kwargs)
 
             xlabel = self.fit_keys[0]
 
             ax.set_xlabel(xlabel)
             ax.set_xticks(self.iter_params[xlabel])
-            if xlabel in PERIODIC:
+            if xlabel in periodic_table():
                 ax.set_xticklabels(ax.get_xticks(), rotation=-45)
 
             ax.set_ylabel(r'$\chi^2$')
@@ -656,7 +1775,7 @@ class Synfit:
             ## Check for abundance
             if 'abund' in self.chisq_values.dtype.names:
                 elem = [param for param in self.fit_params.keys()
-                        if param in PERIODIC][0]
+                        if param in periodic_table()][0]
 
                 chisq_values['abund'] = [abund
                                          for abund in chisq_values['abund']]
@@ -666,6 +1785,7 @@ class Synfit:
             ## Guarantee that the format will be correct for any number of
             ## parameters
             chisquare_arr = chisquare_arr.reshape(len(chisq_values), -1)
+            chisquare_arr = chisquare_arr[np.isfinite(chisquare_arr[:, -1])]
 
             edges = np.hstack([(min(param_vector), max(param_vector))
                                for param_vector in chisquare_arr.T[:-1]])
@@ -699,12 +1819,12 @@ class Synfit:
 
             ax.set_xlabel(xlabel)
             ax.set_xticks(self.iter_params[xlabel])
-            if xlabel in PERIODIC:
+            if xlabel in periodic_table():
                 ax.set_xticklabels(ax.get_xticks(), rotation=-45)
 
             ax.set_ylabel(ylabel)
             ax.set_yticks(self.iter_params[ylabel])
-            if ylabel in PERIODIC:
+            if ylabel in periodic_table():
                 ax.set_yticklabels(ax.get_yticks(), rotation=-45)
 
             ax.grid(zorder=0)
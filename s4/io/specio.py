@@ -3,14 +3,58 @@ In this module we have the methods regarding Input/Output.
 """
 import os
 import numpy as np
-from astropy.io import fits as pyfits
+
+
+# Characters of numbers written by Synspec and the model atmospheres
+FLOAT_CHARS = '0123456789.+-eE \t\r\n'
+INT_CHARS = '0123456789+- \t\r\n'
+
+
+def parse_values(text, dtype=np.float):
+    """
+    Convert a text with numbers separated by whitespace to an array, in bulk.
+
+    Fortran double precision exponents, e.g., `1.5D+02`, are accepted.
+
+    Parameters
+    ----------
+
+    text: str;
+        The numbers.
+
+    dtype: dtype (optional);
+        Data type. The default is float.
+
+    Returns
+    -------
+
+    A 1-D numpy.ndarray with the values.
+    """
+    is_float = np.dtype(dtype).kind in 'fc'
+    if is_float and ('D' in text or 'd' in text):
+        text = text.replace('D', 'E').replace('d', 'e')
+
+    values = np.fromstring(text, dtype=dtype, sep=' ')
+
+    # fromstring silently stops at the first token it can not convert.
+    # Tokens are checked one by one only if the text has other characters.
+    if text.translate(None, FLOAT_CHARS if is_float else INT_CHARS):
+        tokens = text.split()
+        if values.size < len(tokens):
+            raise ValueError("could not convert '{}' to {}".format(
+                tokens[values.size], np.dtype(dtype).name))
+
+    return values
 
 
 def loadtxt_fast(filename, dtype=np.int, skiprows=0, delimiter=' '):
     """
     Function to load text files. Faster than numpy.loadtxt
 
-    Obtained from http://cyrille.rossant.net/numpy-performance-tricks/
+    The whole file is read at once and converted by `parse_values`, so any
+    amount of whitespace between columns and Fortran `D` exponents are
+    accepted. The number of columns is the one of the first line; an
+    incomplete last line, e.g., of a file still being written, is dropped.
 
     Parameters
     ----------
@@ -25,26 +69,30 @@ def loadtxt_fast(filename, dtype=np.int, skiprows=0, delimiter=' '):
         Number of rows to skip. The default is 0.
 
     delimiter: str (optional);
-        The delimiter. The default is ' '.
+        The delimiter. The default is ' ', i.e., any whitespace.
 
     Returns
     -------
 
     A numpy.ndarray with the data.
     """
-    def iter_func():
-        with open(filename, 'r') as infile:
-            for _ in range(skiprows):
-                next(infile)
-            skip = 0
-            for line in infile:
-                line = line.strip().split(delimiter)
-                for item in line:
-                    yield dtype(item)
-            loadtxt_fast.rowlength = len(line)
-    data = np.fromiter(iter_func(), dtype=dtype)
-    data = data.reshape((-1, loadtxt_fast.rowlength))
-    return data
+    with open(filename, 'rb') as infile:
+        for _ in range(skiprows):
+            infile.readline()
+        text = infile.read()
+
+    if delimiter.strip():
+        text = text.replace(delimiter, ' ')
+
+    first = text.lstrip().split('\n', 1)[0]
+    ncols = len(first.split())
+    if ncols == 0:
+        return np.empty((0, 0), dtype=dtype)
+
+    values = parse_values(text, dtype)
+    nrows = values.size // ncols
+
+    return values[:nrows * ncols].reshape(nrows, ncols)
 
 
 def get_wstart(ref, wave_ref, wave_per_pixel):
@@ -121,6 +169,7 @@ def load_spectrum(fname):
 
     # Load spectrum
     if fname.split('.')[1] == 'fits':
+        from astropy.io import fits as pyfits
         spec_FITS = pyfits.open(fname)
         #Load flux
         flux = spec_FITS[0].data
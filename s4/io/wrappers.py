@@ -2,13 +2,199 @@
 A series of wrappers.
 """
 
+import os
 import json
+import time
+import errno
+import select
+import signal
 import subprocess as sp
 
-def run_command(cmd, do_log = False):
+
+class CommandError(RuntimeError):
+    """
+    A command failed, i.e., it did not finish in time or, if checked,
+    returned a non-zero status. The `CommandResult` is on `result`.
+    """
+
+    def __init__(self, message, result=None):
+        RuntimeError.__init__(self, message)
+        self.result = result
+
+
+class CommandTimeout(CommandError):
+    """A command did not finish in time."""
+    pass
+
+
+class RingBuffer(object):
+    """
+    A buffer that keeps only the last `max_size` bytes written to it.
+
+    Parameters
+    ----------
+
+    max_size: int (optional);
+        Maximum number of bytes. If None, everything is kept.
+    """
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.chunks = []
+        self.size = 0
+        self.truncated = False
+
+    def write(self, data):
+        """Append data, discarding the oldest if full."""
+        self.chunks.append(data)
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            data = ''.join(self.chunks)[-self.max_size:]
+            self.chunks = [data]
+            self.size = len(data)
+            self.truncated = True
+
+    def getvalue(self):
+        """The content of the buffer."""
+        return ''.join(self.chunks)
+
+
+class CommandResult(tuple):
+    """
+    The output of a command, as a (stdout, stderr) pair, with the
+    `returncode`, the number of `attempts`, the `elapsed` wall time and the
+    `cpu` time of the last attempt and whether the output was `truncated`.
+    """
+
+    def __new__(cls, stdout, stderr, returncode=None, attempts=1,
+                elapsed=None, truncated=False, cpu=None):
+        result = tuple.__new__(cls, (stdout, stderr))
+        result.returncode = returncode
+        result.attempts = attempts
+        result.elapsed = elapsed
+        result.truncated = truncated
+        result.cpu = cpu
+        return result
+
+    @property
+    def stdout(self):
+        return self[0]
+
+    @property
+    def stderr(self):
+        return self[1]
+
+
+def wait_process(process):
+    """
+    Wait for a process to end.
+
+    Returns
+    -------
+
+    float;
+        The CPU time, user and system, of the process and of the children it
+        waited for, or None if it is not known.
+    """
+    while True:
+        try:
+            _, status, usage = os.wait4(process.pid, 0)
+        except OSError as err:
+            if err.errno == errno.EINTR:
+                continue
+            # Already waited for
+            process.wait()
+            return None
+        break
+
+    # Popen can not wait for it any more, so its status is set here
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+    return usage.ru_utime + usage.ru_stime
+
+
+def kill_group(process):
+    """Kill a process started by `run_command` and all its children."""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+    return wait_process(process)
+
+
+def run_once(cmd, cwd=None, timeout=None, max_output=None):
+    """
+    Run a command once. See `run_command` for the parameters.
+
+    Returns
+    -------
+
+    CommandResult;
+        The output of the command. If it did not finish in time,
+        `returncode` is None.
+    """
+    start = time.time()
+    deadline = None if timeout is None else start + timeout
+
+    # A new process group, so the shell and its children can be killed.
+    process = sp.Popen(cmd, stderr=sp.PIPE, stdout=sp.PIPE, shell=True,
+                       cwd=cwd, preexec_fn=os.setsid, close_fds=True)
+    buffers = {process.stdout.fileno(): RingBuffer(max_output),
+               process.stderr.fileno(): RingBuffer(max_output)}
+    stdout = buffers[process.stdout.fileno()]
+    stderr = buffers[process.stderr.fileno()]
+    opened = set(buffers)
+
+    try:
+        while opened:
+            if deadline is None:
+                wait = None
+            else:
+                wait = deadline - time.time()
+                if wait <= 0:
+                    cpu = kill_group(process)
+                    return CommandResult(stdout.getvalue(), stderr.getvalue(),
+                                         None, elapsed=time.time() - start,
+                                         truncated=stdout.truncated or
+                                         stderr.truncated, cpu=cpu)
+            try:
+                ready, _, _ = select.select(list(opened), [], [], wait)
+            except select.error as err:
+                if err.args[0] == errno.EINTR:
+                    continue
+                raise
+            for fdesc in ready:
+                chunk = os.read(fdesc, 65536)
+                if chunk:
+                    buffers[fdesc].write(chunk)
+                else:
+                    opened.discard(fdesc)
+        cpu = wait_process(process)
+    except BaseException:
+        # Cancelled, e.g., by KeyboardInterrupt
+        kill_group(process)
+        raise
+    finally:
+        process.stdout.close()
+        process.stderr.close()
+
+    return CommandResult(stdout.getvalue(), stderr.getvalue(),
+                         process.returncode, elapsed=time.time() - start,
+                         truncated=stdout.truncated or stderr.truncated,
+                         cpu=cpu)
+
+
+def run_command(cmd, do_log = False, log_file = 'run.log', cwd = None,
+                timeout = None, retries = 0, check = False,
+                max_output = None):
     """
     Run a command on the shell.
 
+    The command runs in its own process group, which is killed if it does
+    not finish in time or if the call is interrupted.
+
     Parameters
     ----------
 
@@ -18,6 +204,28 @@ def run_command(cmd, do_log = False):
     do_log: bool, opt;
         If True, wirte stdout and stderr to a file.
 
+    log_file: str, opt;
+        File in which the log is written. The default is `run.log` on the
+        current directory.
+
+    cwd: str, opt;
+        Directory in which the command will run. The default is the current
+        directory.
+
+    timeout: float, opt;
+        Maximum time of each attempt, in seconds. The default is None, i.e.,
+        wait forever.
+
+    retries: int, opt;
+        Number of times a failed command is run again. The default is 0.
+
+    check: bool, opt;
+        If True, a non-zero exit status is a failure.
+
+    max_output: int, opt;
+        Maximum number of bytes kept of stdout and of stderr. Only the last
+        bytes are kept. The default is None, i.e., keep everything.
+
     Returns
     -------
 
@@ -26,17 +234,41 @@ def run_command(cmd, do_log = False):
 
     stderr: str;
         the error output of the command
-    """
 
-    subp = sp.Popen(cmd, stderr = sp.PIPE, stdout = sp.PIPE, shell = True)
+    The pair is a `CommandResult`, which also has the `returncode`, the
+    number of `attempts` and the `elapsed` and `cpu` times.
 
-    (stdout, stderr) = subp.communicate()
+    Raises
+    ------
+
+    CommandTimeout;
+        If the last attempt did not finish in time.
+
+    CommandError;
+        If `check` is True and the last attempt returned a non-zero status.
+    """
+    for attempt in range(1, retries + 2):
+        result = run_once(cmd, cwd, timeout, max_output)
+        result.attempts = attempt
+
+        if result.returncode is None:
+            error = CommandTimeout("Command '{}' did not finish in {} s."
+                                   .format(cmd, timeout), result)
+        elif check and result.returncode != 0:
+            error = CommandError("Command '{}' returned {}.".format(
+                cmd, result.returncode), result)
+        else:
+            error = None
+            break
 
     if do_log:
-        with open('run.log', 'w') as out:
-            out.write('{}\n{}'.format(stdout, stderr))
-    else:
-        return stdout, stderr
+        with open(log_file, 'w') as out:
+            out.write('{}\n{}'.format(result.stdout, result.stderr))
+
+    if error is not None:
+        raise error
+
+    return result
 
 
 class JsonHandling:
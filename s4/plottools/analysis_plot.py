@@ -5,8 +5,6 @@ Plot modules.
 #=============================================================================
 #Modules
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.mlab import griddata
 
  
 def contour_plot(array3d, **kwargs):
@@ -33,6 +31,8 @@ def contour_plot(array3d, **kwargs):
             Name for saved file.
           
     """
+    import matplotlib.pyplot as plt
+
     n_x = len(np.unique(array3d[:, 0]))
     n_y = len(np.unique(array3d[:, 1]))
     
@@ -93,6 +93,9 @@ def color_map_plot(X_vector, Y_vector, Z_vector, num = 100, **kwargs):
         
     Adapted from Anderson Ribeiro code.
     """
+    import matplotlib.pyplot as plt
+    from matplotlib.mlab import griddata
+
 
     xi = np.linspace(min(X_vector), max(X_vector), num)    
     yi = np.linspace(min(Y_vector), max(Y_vector), num)
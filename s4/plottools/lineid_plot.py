@@ -13,7 +13,6 @@ Based on `lineid_plot` version located at https://github.com/phn/lineid_plot.
 from __future__ import division, print_function
 import warnings
 import numpy as np
-from matplotlib import pyplot as plt
 
 __version__ = "0.2mod"
 __author__ = "Prasanth Nair"
@@ -227,6 +226,7 @@ def adjust_boxes(line_wave, box_widths, left_edge, right_edge,
 def prepare_axes(wave, flux, fig=None, ax_lower=(0.1, 0.1),
                  ax_dim=(0.85, 0.65)):
     """Create fig and axes if needed and layout axes in fig."""
+    from matplotlib import pyplot as plt
     # Axes location in figure.
     if not fig:
         fig = plt.figure()
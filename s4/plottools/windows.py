@@ -6,10 +6,8 @@ pre-defined spectrum and to plot the windows on a spectrum.
 @author: gbra
 """
 
-import matplotlib.pyplot as plt
 from decimal import Decimal
 from ..spectools import subselect_spectra
-from matplotlib.widgets import SpanSelector, Cursor
 
 
 # This functions plots the windows.
@@ -23,6 +21,8 @@ def plot_windows(windows):
     windows: list:
         position of the beggining and the end of the list.
     """
+    import matplotlib.pyplot as plt
+
     #Plot the horizontal lines
     for i in range(len(windows)/2):
         plt.hlines(1.025, windows[2*i], windows[2*i+1], colors='b')
@@ -48,6 +48,9 @@ def choose_windows(spectrum, wstart, wend):
     wend: int, float;
         Ending wavelength.
     """
+    import matplotlib.pyplot as plt
+    from matplotlib.widgets import SpanSelector, Cursor
+
 
     #Define function that will obtain the cursor x position
     def onselect(vmin, vmax):
@@ -0,0 +1,296 @@
+"""
+Rotational, macroturbulent and instrumental broadening of spectra.
+
+A NumPy implementation of what `rotin3` does to the spectrum calculated by
+Synspec. The spectrum is resampled on a uniform grid in log-wavelength, where
+the rotational and macroturbulent profiles have the same width everywhere,
+and is convolved, by FFT, with the product of the three kernels:
+
+- rotation, with a linear limb darkening law with coefficient 0.6;
+- radial-tangential macroturbulence, as tabulated by `rotin3` (Gray);
+- a Gaussian instrumental profile.
+
+The instrumental profile of `rotin3` has a constant FWHM in wavelength. Here
+it has the FWHM of the central wavelength, which differs by less than
+(wend - wstart) / wstart over the interval.
+
+Example
+-------
+
+::
+
+    spec = broaden(wave, flux, vrot=50, fwhm=0.5)
+"""
+import numpy as np
+from scipy.signal import fftconvolve
+
+
+# Speed of light in km/s, as in rotin3
+LIGHT_SPEED = 2.997925e5
+
+# Limb darkening coefficient of rotin3
+EPSILON = 0.6
+
+# Radial-tangential macroturbulence profile of rotin3, from 0 to 2 vmac in
+# steps of vmac / 10.
+RT_PROFILE = np.array([1.128, 0.939, 0.773, 0.628, 0.504, 0.399, 0.312,
+                       0.240, 0.182, 0.133, 0.101, 0.070, 0.052, 0.037,
+                       0.024, 0.017, 0.012, 0.010, 0.009, 0.007, 0.006])
+
+# Width of the Gaussian profile, in FWHM, as in rotin3
+GAUSS_LIMIT = 3.
+
+
+def rotation_kernel(dv, vrot, epsilon=EPSILON):
+    """
+    Rotational broadening profile.
+
+    Parameters
+    ----------
+
+    dv: float;
+        Velocity step, in km/s.
+
+    vrot: float;
+        Projected rotational velocity, in km/s.
+
+    epsilon: float (optional);
+        Limb darkening coefficient.
+
+    Returns
+    -------
+
+    numpy.ndarray;
+        The normalized profile, with an odd number of points.
+    """
+    n = int(vrot / dv)
+    if n < 1:
+        return np.ones(1)
+
+    x = np.arange(-n, n + 1) * dv / vrot
+    x1 = np.abs(1. - x**2)
+    kernel = 2. * (1. - epsilon) * np.sqrt(x1) + 0.5 * np.pi * epsilon * x1
+
+    return kernel / kernel.sum()
+
+
+def macroturbulence_kernel(dv, vmac):
+    """
+    Radial-tangential macroturbulence profile, as in `rotin3`.
+
+    See `rotation_kernel` for the parameters.
+    """
+    n = int(2. * vmac / dv)
+    if n < 1:
+        return np.ones(1)
+
+    x = np.abs(np.arange(-n, n + 1) * dv) / (0.1 * vmac)
+    kernel = np.interp(x, np.arange(len(RT_PROFILE)), RT_PROFILE)
+
+    return kernel / kernel.sum()
+
+
+def gaussian_kernel(dv, fwhm):
+    """
+    Gaussian profile.
+
+    Parameters
+    ----------
+
+    dv: float;
+        Velocity step, in km/s.
+
+    fwhm: float;
+        Full width at half maximum, in km/s.
+
+    Returns
+    -------
+
+    numpy.ndarray;
+        The normalized profile, with an odd number of points.
+    """
+    n = int(GAUSS_LIMIT * fwhm / dv)
+    if n < 1:
+        return np.ones(1)
+
+    x = np.arange(-n, n + 1) * dv
+    # The same width of rotin3, which is not exactly fwhm / 2.35482
+    kernel = np.exp(-(x / (0.60056 * fwhm))**2)
+
+    return kernel / kernel.sum()
+
+
+def broaden(wave, flux, vrot=0, vmac=0, fwhm=0, step=0.01, out_wave=None):
+    """
+    Convolve a spectrum with the rotational, macroturbulent and instrumental
+    profiles.
+
+    Parameters
+    ----------
+
+    wave, flux: numpy.ndarray;
+        The spectrum, with increasing wavelength in angstroms.
+
+    vrot: float (optional);
+        Projected rotational velocity, in km/s.
+
+    vmac: float (optional);
+        Radial-tangential macroturbulent velocity, in km/s.
+
+    fwhm: float (optional);
+        FWHM of the instrumental profile, in angstroms.
+
+    step: float (optional);
+        Wavelength step of the convolution, at the reddest wavelength, in
+        angstroms. The default is 0.01, as in `rotin3`.
+
+    out_wave: numpy.ndarray (optional);
+        Wavelengths of the convolved spectrum. The default is `wave`.
+
+    Returns
+    -------
+
+    numpy.ndarray;
+        The convolved flux at `out_wave`.
+    """
+    wave = np.asarray(wave, dtype=float)
+    flux = np.asarray(flux, dtype=float)
+    if out_wave is None:
+        out_wave = wave
+
+    center = 0.5 * (wave[0] + wave[-1])
+    dv = LIGHT_SPEED * step / wave[-1]
+    # At least 10 points on each half of the narrowest profile
+    widths = [width for width in [vrot, 2. * vmac,
+                                  GAUSS_LIMIT * LIGHT_SPEED * fwhm / center]
+              if width > 0]
+    if widths:
+        dv = min(dv, 0.1 * min(widths))
+
+    kernel = np.ones(1)
+    if vrot > 0:
+        kernel = np.convolve(kernel, rotation_kernel(dv, vrot))
+    if vmac > 0:
+        kernel = np.convolve(kernel, macroturbulence_kernel(dv, vmac))
+    if fwhm > 0:
+        kernel = np.convolve(kernel,
+                             gaussian_kernel(dv, LIGHT_SPEED * fwhm / center))
+
+    if len(kernel) == 1:
+        return np.interp(out_wave, wave, flux)
+
+    # Uniform grid in log-wavelength, extended by half kernel on each side
+    # with the flux of the edges, as rotin3 does.
+    dlog = np.log1p(dv / LIGHT_SPEED)
+    half = len(kernel) // 2
+    npts = int(np.log(wave[-1] / wave[0]) / dlog) + 1
+    log_wave = np.log(wave[0]) + np.arange(-half, npts + half) * dlog
+    grid = np.exp(log_wave)
+
+    resampled = np.interp(grid, wave, flux)
+    convolved = fftconvolve(resampled, kernel, mode='same')
+
+    return np.interp(out_wave, grid[half:-half], convolved[half:-half])
+
+
+def rotin(wave, flux, cont_wave, cont_flux, wstart, wend, vrot=0, fwhm=0,
+          vmac=0, relative=0, chard=0.01, steprot=0, stepins=0):
+    """
+    Convolve the spectrum calculated by Synspec as `rotin3` does, i.e.,
+    normalizing it, if asked, and calculating it on the same wavelengths.
+
+    Parameters
+    ----------
+
+    wave, flux: numpy.ndarray;
+        The detailed spectrum (fort.7).
+
+    cont_wave, cont_flux: numpy.ndarray;
+        The continuum (fort.17).
+
+    wstart, wend: float;
+        Wavelength interval.
+
+    vrot, fwhm, vmac: float (optional);
+        Projected rotational velocity (km/s), FWHM of the instrumental profile
+        (angstroms) and radial-tangential macroturbulent velocity (km/s).
+
+    relative: int (optional);
+        If 1, the spectrum is normalized by the continuum.
+
+    chard: float (optional);
+        Characteristic wavelength step of the spectrum (`wdist`).
+
+    steprot, stepins: float (optional);
+        Wavelength steps of the rotated and of the convolved spectrum, as in
+        `rotin3`.
+
+    Returns
+    -------
+
+    numpy.ndarray;
+        The convolved spectrum, as fort.11.
+    """
+    wave = np.asarray(wave, dtype=float)
+    flux = np.asarray(flux, dtype=float)
+    inside = (wave >= wstart) & (wave <= wend)
+    wave = wave[inside]
+    flux = flux[inside]
+
+    if int(relative) == 1:
+        cont_wave = np.asarray(cont_wave, dtype=float)
+        cont_flux = np.asarray(cont_flux, dtype=float)
+        near = (cont_wave >= wstart - 10.) & (cont_wave <= wend + 10.)
+        if not near.any():
+            raise ValueError('There is no continuum around the interval.')
+        # rotin3 skips continuum points that are not increasing
+        cont_wave, unique = np.unique(cont_wave[near], return_index=True)
+        flux = flux / np.interp(wave, cont_wave, cont_flux[near][unique])
+
+    # Default parameters of rotin3
+    slam = 0.5 * (wstart + wend)
+    drot = slam * abs(vrot) / 3e5
+    dins = fwhm / 20.
+    if chard <= 0:
+        chard = 0.01
+    if drot < dins and vrot >= 0:
+        drot = dins
+        vrot = drot * 3e5 / slam
+    vrot = abs(vrot)
+    if steprot == 0:
+        steprot = max(drot / 20., chard)
+    if stepins == 0:
+        stepins = max(fwhm / 20., chard)
+    stepins = max(stepins, steprot)
+
+    # The convolutions are done one after the other, on the wavelengths of
+    # each step of rotin3, which does not convolve the points at and beyond
+    # the edges of its input.
+    def convolve(in_wave, in_flux, out_wave, **kwargs):
+        """One convolution of rotin3."""
+        out_flux = broaden(in_wave, in_flux, step=chard, out_wave=out_wave,
+                           **kwargs)
+        out_flux[out_wave <= in_wave[0]] = in_flux[0]
+        out_flux[out_wave >= in_wave[-1]] = in_flux[-1]
+        return out_flux
+
+    if vrot > 0:
+        rot_wave = wave
+        if steprot > 0:
+            rot_wave = wstart + steprot * np.arange(int((wend - wstart) /
+                                                        steprot) + 1)
+        flux = convolve(wave, flux, rot_wave, vrot=vrot)
+        wave = rot_wave
+
+    if vmac > 0:
+        flux = convolve(wave, flux, wave, vmac=vmac)
+
+    if fwhm > 0:
+        ins_wave = wave
+        if stepins > 0:
+            ins_wave = wstart + stepins * np.arange(int((wend - wstart) /
+                                                        stepins) + 1)
+        flux = convolve(wave, flux, ins_wave, fwhm=fwhm)
+        wave = ins_wave
+
+    return np.column_stack([wave, flux])
@@ -0,0 +1,426 @@
+"""
+Model atmospheres for Synspec.
+
+This module replaces `intrpmod.pro` and `intrpmet.pro`: it selects the four
+models of the grid that bracket `teff` and `logg`, as `synplot.pro` does, and
+interpolates them in log space with NumPy. If a metallicity is asked, the
+same is done on a second grid and both models are interpolated in
+metallicity.
+
+If the grid was packed with `modelgrid.pack_grid`, the models are read from
+the binary store instead of from the `.7` files. Interpolated models are
+memoized per (teff, logg, metal), so repeated runs only write the files.
+"""
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from ..io import specio
+import modelgrid
+
+
+# Core name of the BSTAR2006 grids, relative to the Synplot directory.
+BSTAR_GRID = '../bstar2006/BG'
+BSTAR_GRID_LOW_Z = '../bstar2006/BL'
+
+# Metallicity of the grids by the last letter of their core name.
+GRID_METALLICITY = {'C': 0.3, 'G': 0.0, 'L': -0.3, 'S': -0.7, 'T': -1.0}
+
+# Flags of the atoms from C to Zn on the `.5` file written by `intrpmet.pro`,
+# for models hotter and cooler than 30000 K.
+ATOMS_HOT = [(2, 'C'), (2, 'N'), (2, 'O'), (1, ''), (2, 'Ne'), (1, ''),
+             (1, ''), (1, ''), (2, 'Si'), (2, 'P'), (2, 'S'), (1, ''),
+             (1, ''), (1, ''), (1, ''), (1, ''), (1, ''), (1, ''), (1, ''),
+             (1, ''), (2, 'Fe'), (1, ''), (2, 'Ni'), (1, ''), (1, '')]
+ATOMS_COOL = [(2, 'C'), (2, 'N'), (2, 'O'), (1, ''), (2, 'Ne'), (1, ''),
+              (2, 'Mg'), (2, 'Al'), (2, 'Si'), (1, ''), (2, 'S'), (1, ''),
+              (1, ''), (1, ''), (1, ''), (1, ''), (1, ''), (1, ''), (1, ''),
+              (1, ''), (2, 'Fe'), (1, ''), (1, ''), (1, ''), (1, '')]
+
+# Number of interpolated models kept in memory.
+MEMO_SIZE = 32
+_MODELS = OrderedDict()
+_MODELS_LOCK = threading.Lock()
+
+# Coverage of the BSTAR2006 grid.
+TEFF_RANGE = (15000, 30000)
+LOGG_RANGE = (1.75, 4.75)
+
+
+def bracketing_models(teff, logg, grid=BSTAR_GRID):
+    """
+    Obtain the core names of the four models that bracket `teff` and `logg`,
+    using the same rules of `synplot.pro`.
+
+    Parameters
+    ----------
+
+    teff: float;
+        Effective temperature.
+
+    logg: float;
+        Surface gravity.
+
+    grid: str (optional);
+        Core name of the grid of models.
+
+    Returns
+    -------
+
+    models: list;
+        Core names of the models with, respectively, low Teff and low log g,
+        low Teff and high log g, high Teff and low log g and high Teff and high
+        log g.
+    """
+    if teff < TEFF_RANGE[0] or teff >= TEFF_RANGE[1]:
+        raise ValueError('teff out of range')
+
+    if logg < LOGG_RANGE[0] or logg > LOGG_RANGE[1]:
+        raise ValueError('log g out of range')
+
+    tef1 = int(teff) // 1000 * 1000
+    g1 = int(logg * 100.) // 25 * 25
+
+    return ['{}{}g{}v2'.format(grid, tl, gl)
+            for tl in [tef1, tef1 + 1000]
+            for gl in [g1, g1 + 25]]
+
+
+def model_parameters(core_name):
+    """
+    Obtain the effective temperature and the surface gravity of a model of the
+    grid from its name, e.g., `BG20000g400v2`.
+    """
+    name = os.path.basename(core_name)
+    teff, logg = name[2:].split('v')[0].split('g')
+
+    return float(teff), float(logg) * 1e-2
+
+
+def grid_covers(teff, logg, path, grid=BSTAR_GRID):
+    """
+    Check if the four models that bracket `teff` and `logg` exist in a grid,
+    on its binary store or as `.7` files. The lowest log g of the BSTAR2006
+    grid increases with Teff, so its coverage is not a rectangle.
+
+    Parameters
+    ----------
+
+    teff: float;
+        Effective temperature.
+
+    logg: float;
+        Surface gravity.
+
+    path: str;
+        Directory to which the grid is relative, usually the Synplot
+        directory.
+
+    grid: str (optional);
+        Core name of the grid of models.
+    """
+    core = os.path.realpath(os.path.join(path, grid))
+    try:
+        models = bracketing_models(teff, logg, core)
+    except ValueError:
+        return False
+
+    store = modelgrid.open_grid(core)
+    if store is not None and store.covers(teff, logg):
+        return True
+
+    return all(os.path.isfile(core_name + '.7') for core_name in models)
+
+
+def read_model(fname):
+    """
+    Read a model atmosphere file (`.7`).
+
+    Parameters
+    ----------
+
+    fname: str;
+        Name of the file.
+
+    Returns
+    -------
+
+    dm: numpy.ndarray;
+        Column mass at each depth.
+
+    params: numpy.ndarray;
+        Model parameters with shape (number of depths, number of parameters).
+    """
+    with open(fname) as infile:
+        nd, npar = [int(i) for i in infile.readline().split()[:2]]
+        # Fortran double precision uses 'D' as exponent
+        values = specio.parse_values(infile.read())
+
+    dm = values[:nd]
+    params = values[nd:nd + nd * npar].reshape(nd, npar)
+
+    return dm, params
+
+
+def format_model(dm, params):
+    """
+    Format a model atmosphere in the same format of `intrpmod.pro`, i.e.,
+    with six values per line.
+
+    Returns
+    -------
+
+    str;
+        The content of the `.7` file.
+    """
+    def rows_format(size):
+        """Format string of a vector with `size` values."""
+        fmt = ('%13.6e' * 6 + '\n') * (size // 6)
+        if size % 6:
+            fmt += '%13.6e' * (size % 6) + '\n'
+        return fmt
+
+    depth_format = rows_format(params.shape[1])
+
+    return ''.join(['%5i%5i\n' % params.shape,
+                    rows_format(len(dm)) % tuple(dm)] +
+                   [depth_format % tuple(depth) for depth in params])
+
+
+def write_model(fname, dm, params):
+    """
+    Write a model atmosphere file (`.7`) in the same format of
+    `intrpmod.pro`.
+    """
+    with open(fname, 'w') as out:
+        out.write(format_model(dm, params))
+
+
+def interpolate_models(models, teff, logg):
+    """
+    Interpolate four models in log space, as `intrpmod.pro`.
+
+    Parameters
+    ----------
+
+    models: list;
+        Core names of the four models, in the order returned by
+        `bracketing_models`.
+
+    teff: float;
+        Effective temperature.
+
+    logg: float;
+        Surface gravity.
+
+    Returns
+    -------
+
+    dm: numpy.ndarray;
+        Column mass at each depth.
+
+    params: numpy.ndarray;
+        Model parameters with shape (number of depths, number of parameters).
+    """
+    temps = []
+    gravs = []
+    log_dm = []
+    log_params = []
+    for core_name in models:
+        dm, params = read_model(core_name + '.7')
+        tt, gg = model_parameters(core_name)
+        temps.append(np.log10(tt))
+        gravs.append(gg)
+        log_dm.append(np.log10(dm))
+        log_params.append(np.log10(np.maximum(params, 1e-35)))
+
+    # Interpolation in log g for the low and high Teff
+    a1 = (gravs[1] - logg) / (gravs[1] - gravs[0])
+    dm1 = a1 * log_dm[0] + (1. - a1) * log_dm[1]
+    x1 = a1 * log_params[0] + (1. - a1) * log_params[1]
+
+    a2 = (gravs[3] - logg) / (gravs[3] - gravs[2])
+    dm2 = a2 * log_dm[2] + (1. - a2) * log_dm[3]
+    x2 = a2 * log_params[2] + (1. - a2) * log_params[3]
+
+    # Interpolation in Teff
+    a3 = (temps[2] - np.log10(teff)) / (temps[2] - temps[0])
+    dm3 = a3 * dm1 + (1. - a3) * dm2
+    x3 = a3 * x1 + (1. - a3) * x2
+
+    return 10.**dm3, 10.**x3
+
+
+def interpolate_metallicity(model1, model2, met1, met2, metal):
+    """
+    Interpolate two models in metallicity, in log space, as `intrpmet.pro`.
+
+    Parameters
+    ----------
+
+    model1, model2: tuple;
+        Column mass and parameters of each model, as returned by
+        `interpolate_models`.
+
+    met1, met2: float;
+        Metallicity of each model.
+
+    metal: float;
+        Desired metallicity.
+
+    Returns
+    -------
+
+    dm: numpy.ndarray;
+        Column mass at each depth.
+
+    params: numpy.ndarray;
+        Model parameters with shape (number of depths, number of parameters).
+    """
+    a1 = (met2 - metal) / (met2 - met1)
+    dm = a1 * np.log10(model1[0]) + (1. - a1) * np.log10(model2[0])
+    params = a1 * np.log10(np.maximum(model1[1], 1e-35)) + \
+             (1. - a1) * np.log10(np.maximum(model2[1], 1e-35))
+
+    return 10.**dm, 10.**params
+
+
+def metallicity_input(fort5, metal):
+    """
+    Change the atomic abundances of a `.5` file to a metallicity, as
+    `intrpmet.pro`.
+
+    Parameters
+    ----------
+
+    fort5: str;
+        Content of the `.5` file.
+
+    metal: float;
+        Metallicity.
+
+    Returns
+    -------
+
+    str;
+        The new content of the `.5` file.
+    """
+    lines = fort5.splitlines(True)
+    teff = float(lines[0].split()[0])
+
+    met = '-' + '{:.5f}'.format(10.**metal)[:5]
+    atoms = ATOMS_HOT if teff >= 30000. else ATOMS_COOL
+    middle = ['    {}  {}      0{}\n'.format(mode, met,
+                                              '  ! ' + name if name else '')
+              for mode, name in atoms]
+
+    return ''.join(lines[:17] + middle + lines[43:])
+
+
+def grid_metallicity(grid):
+    """Metallicity of a grid from its core name, e.g., 'BG' or 'BL'."""
+    return GRID_METALLICITY[os.path.basename(grid)[-1]]
+
+
+def model_files(teff, logg, path, metal=None, grid=BSTAR_GRID,
+                grid2=BSTAR_GRID_LOW_Z):
+    """
+    Obtain the content of the files of the interpolated model atmosphere.
+
+    The result is memoized, so the grid is read and interpolated only once
+    per (teff, logg, metal).
+
+    Parameters
+    ----------
+
+    teff: float;
+        Effective temperature.
+
+    logg: float;
+        Surface gravity.
+
+    path: str;
+        Directory to which the grids are relative, usually the Synplot
+        directory.
+
+    metal: float (optional);
+        Metallicity. If set, the models of `grid` and `grid2` are interpolated
+        to it.
+
+    grid, grid2: str (optional);
+        Core names of the grids of models.
+
+    Returns
+    -------
+
+    fort7, fort5: str;
+        The content of the `.7` and `.5` files.
+    """
+    grids = [os.path.realpath(os.path.join(path, grid))]
+    if metal is not None:
+        grids.append(os.path.realpath(os.path.join(path, grid2)))
+
+    memo_key = (float(teff), float(logg),
+                None if metal is None else float(metal), tuple(grids))
+    with _MODELS_LOCK:
+        if memo_key in _MODELS:
+            _MODELS[memo_key] = _MODELS.pop(memo_key)
+            return _MODELS[memo_key]
+
+    interpolated = []
+    for core in grids:
+        models = bracketing_models(teff, logg, core)
+        store = modelgrid.open_grid(core)
+        if store is not None and store.covers(teff, logg):
+            log_dm, log_params = store.interpolate(teff, logg)
+            interpolated.append((10.**log_dm, 10.**log_params))
+        else:
+            for core_name in models:
+                if not os.path.isfile(core_name + '.7'):
+                    raise IOError("Model '{}' does not exist.".format(
+                        core_name))
+            interpolated.append(interpolate_models(models, teff, logg))
+        if len(interpolated) == 1:
+            with open(models[0] + '.5') as infile:
+                fort5 = infile.read()
+
+    if metal is None:
+        dm, params = interpolated[0]
+    else:
+        dm, params = interpolate_metallicity(interpolated[0], interpolated[1],
+                                             grid_metallicity(grid),
+                                             grid_metallicity(grid2),
+                                             float(metal))
+        fort5 = metallicity_input(fort5, float(metal))
+
+    files = (format_model(dm, params), fort5)
+
+    with _MODELS_LOCK:
+        _MODELS[memo_key] = files
+        while len(_MODELS) > MEMO_SIZE:
+            _MODELS.popitem(last=False)
+
+    return files
+
+
+def make_model(teff, logg, path, outfile='intrp', metal=None,
+               grid=BSTAR_GRID, grid2=BSTAR_GRID_LOW_Z):
+    """
+    Create the interpolated model atmosphere files, `outfile.5` and
+    `outfile.7`, for a given `teff` and `logg` in the directory `path`.
+
+    See `model_files` for the parameters.
+
+    Returns
+    -------
+
+    outfile: str;
+        The core name of the created model.
+    """
+    fort7, fort5 = model_files(teff, logg, path, metal, grid, grid2)
+
+    for ext, content in [('.7', fort7), ('.5', fort5)]:
+        with open(os.path.join(path, outfile + ext), 'w') as out:
+            out.write(content)
+
+    return outfile
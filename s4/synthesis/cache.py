@@ -0,0 +1,387 @@
+"""
+A content-addressed on-disk cache of synthetic spectra.
+
+Each entry is keyed by a hash of the normalized Synplot parameters and of the
+content of every file the synthesis depends on: the model atmospheres, the
+line list and any file staged in the workspace (e.g., the unconvolved spectrum
+of a convolution-only run). Entries are compressed NumPy files with the
+calculated spectrum (fort.11) and, optionally, the unconvolved spectrum
+(fort.7 and fort.17) and the line identification tables (fort.12 and fort.14).
+
+The cache has a size limit and the least recently used entries are removed
+when it is exceeded.
+
+Example
+-------
+
+::
+
+    cache = SpectrumCache(max_size=2 * 1024**3)
+    syn = Synplot(20000, 4, wstart=4460, wend=4480, cache=cache)
+    syn.run()
+    cache.stats()
+    # {'hits': 0, 'misses': 1, 'stores': 1, 'evictions': 0}
+"""
+import os
+import json
+import hashlib
+import tempfile
+import threading
+import numpy as np
+from ..utils.elements import periodic_table
+import atmosphere
+
+
+# Parameters that do not change the calculated spectrum.
+IGNORED_PARAMETERS = ['noplot', 'observ', 'notalk', 'charsize', 'extend',
+                      'lidshift', 'oplot', 'idtab', 'idlim', 'save']
+
+# Parameters only applied in Python, after the spectrum is calculated.
+POSTPROCESS_KEYS = ['scale', 'rv']
+
+# Output files kept, besides fort.11, if available.
+EXTRA_FILES = ['fort.7', 'fort.17', 'fort.12', 'fort.14']
+
+# Content hashes of files, by (path, size, modification time).
+_FILE_HASHES = {}
+_FILE_HASHES_LOCK = threading.Lock()
+
+
+def file_hash(fname):
+    """
+    Obtain the SHA-1 hash of the content of a file.
+
+    The hashes are memoized by path, size and modification time, so each file
+    is read only once per process.
+    """
+    fname = os.path.realpath(fname)
+    info = os.stat(fname)
+    memo_key = (fname, info.st_size, info.st_mtime)
+
+    with _FILE_HASHES_LOCK:
+        if memo_key in _FILE_HASHES:
+            return _FILE_HASHES[memo_key]
+
+    sha = hashlib.sha1()
+    with open(fname, 'rb') as infile:
+        for block in iter(lambda: infile.read(1 << 20), b''):
+            sha.update(block)
+    digest = sha.hexdigest()
+
+    with _FILE_HASHES_LOCK:
+        _FILE_HASHES[memo_key] = digest
+
+    return digest
+
+
+def normalize_value(value):
+    """Normalize a parameter value so equal values have equal text."""
+    if isinstance(value, dict):
+        periodic = periodic_table()
+        return {str(periodic.get(key, key)): normalize_value(val)
+                for key, val in value.iteritems()}
+
+    if isinstance(value, (list, tuple)):
+        return [normalize_value(val) for val in value]
+
+    try:
+        return '%.10g' % float(value)
+    except (TypeError, ValueError):
+        return str(value).strip().strip("'\"")
+
+
+def dependencies(parameters, synplot_path):
+    """
+    List the files on which a synthesis depends.
+
+    Parameters
+    ----------
+
+    parameters: dict;
+        Synplot parameters.
+
+    synplot_path: str;
+        Path to the Synplot directory.
+
+    Returns
+    -------
+
+    list;
+        Paths of the files.
+    """
+    files = []
+
+    # Line list
+    linlist = normalize_value(parameters.get('linlist', 'fort.19'))
+    files.append(os.path.join(synplot_path, linlist))
+
+    # Model atmospheres
+    if 'atmos' in parameters:
+        atmos = parameters['atmos']
+        if isinstance(atmos, (list, tuple)):
+            files += [os.path.join(synplot_path, normalize_value(name))
+                      for name in atmos]
+        else:
+            core_name = os.path.join(synplot_path, normalize_value(atmos))
+            files += [core_name + '.5', core_name + '.7']
+    elif 'norun' not in parameters:
+        grids = [atmosphere.BSTAR_GRID]
+        if 'metal' in parameters:
+            grids.append(atmosphere.BSTAR_GRID_LOW_Z)
+        models = []
+        for grid in grids:
+            try:
+                models += atmosphere.bracketing_models(
+                    float(parameters['teff']), float(parameters['logg']), grid)
+            except (KeyError, ValueError):
+                pass
+        for core_name in models:
+            core_name = os.path.join(synplot_path, core_name)
+            files += [core_name + '.5', core_name + '.7']
+
+    return [fname for fname in files if os.path.isfile(fname)]
+
+
+def cache_key(parameters, synplot_path, stage=None):
+    """
+    Obtain the key of a synthesis.
+
+    Parameters
+    ----------
+
+    parameters: dict;
+        Synplot parameters.
+
+    synplot_path: str;
+        Path to the Synplot directory.
+
+    stage: dict (optional);
+        Files staged in the workspace before the run.
+
+    Returns
+    -------
+
+    str;
+        Hexadecimal SHA-1 hash.
+    """
+    normalized = {key: normalize_value(val)
+                  for key, val in parameters.iteritems()
+                  if key not in IGNORED_PARAMETERS + POSTPROCESS_KEYS}
+    if 'linlist' in normalized:
+        # The content matters, not the name
+        del normalized['linlist']
+
+    files = {os.path.basename(fname): file_hash(fname)
+             for fname in dependencies(parameters, synplot_path)}
+    if stage is not None:
+        files.update({'stage:' + name: file_hash(fname)
+                      for name, fname in stage.iteritems()})
+
+    text = json.dumps([normalized, files], sort_keys=True)
+
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class SpectrumCache(object):
+    """
+    A cache of synthetic spectra on disk with LRU eviction.
+
+    Parameters
+    ----------
+
+    directory: str (optional);
+        Directory of the cache. The default is `~/.s4/cache`.
+
+    max_size: int (optional);
+        Maximum size of the cache in bytes. The default is 1 GiB.
+
+    unconvolved: bool (optional);
+        If True, also keep the unconvolved spectrum (fort.7 and fort.17) and
+        the line identification tables (fort.12 and fort.14). The default is
+        True.
+
+    Attributes
+    ----------
+
+    hits, misses, stores, evictions: int;
+        Statistics of this instance.
+    """
+
+    def __init__(self, directory=None, max_size=1024**3, unconvolved=True):
+        if directory is None:
+            directory = os.path.join(os.getenv('HOME'), '.s4', 'cache')
+        self.directory = directory
+        self.max_size = max_size
+        self.unconvolved = unconvolved
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Created by another process in the meantime
+                if not os.path.isdir(directory):
+                    raise
+
+
+    def path(self, key):
+        """Path of the entry of a key."""
+        return os.path.join(self.directory, key + '.npz')
+
+
+    def get(self, key):
+        """
+        Obtain an entry.
+
+        Returns
+        -------
+
+        entry: dict or None;
+            A dictionary with the 'spectrum', the 'eqw' and the content of the
+            extra files (keys as 'fort.7'), or None if the key is not cached.
+        """
+        fname = self.path(key)
+        try:
+            with np.load(fname) as data:
+                entry = {name: data[name] for name in data.files}
+            # Mark as recently used
+            os.utime(fname, None)
+        except (IOError, OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+
+        entry['eqw'] = float(entry['eqw'])
+        for name in EXTRA_FILES:
+            if name in entry:
+                entry[name] = entry[name].tostring()
+
+        return entry
+
+
+    def put(self, key, spectrum, eqw=None, path=None):
+        """
+        Store an entry.
+
+        Parameters
+        ----------
+
+        key: str;
+            Key of the entry.
+
+        spectrum: numpy.ndarray;
+            The calculated spectrum.
+
+        eqw: float (optional);
+            Total equivalent width.
+
+        path: str (optional);
+            Directory of the run, from which the extra files are read.
+        """
+        arrays = {'spectrum': np.asarray(spectrum),
+                  'eqw': np.nan if eqw is None else eqw}
+
+        if self.unconvolved and path is not None:
+            for name in EXTRA_FILES:
+                fname = os.path.join(path, name)
+                if os.path.isfile(fname):
+                    with open(fname, 'rb') as infile:
+                        arrays[name] = np.frombuffer(infile.read(),
+                                                     dtype=np.uint8)
+
+        # Write to a temporary file and rename it, so readers never see an
+        # incomplete entry.
+        fdesc, tmpname = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fdesc, 'wb') as out:
+                np.savez_compressed(out, **arrays)
+            os.rename(tmpname, self.path(key))
+        except:
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+            raise
+
+        with self._lock:
+            self.stores += 1
+
+        self.evict()
+
+
+    def size(self):
+        """Total size of the entries in bytes."""
+        return sum(size for _, size, _ in self._entries())
+
+
+    def _entries(self):
+        """List the entries as (path, size, last use)."""
+        entries = []
+        for fname in os.listdir(self.directory):
+            if not fname.endswith('.npz'):
+                continue
+            fname = os.path.join(self.directory, fname)
+            try:
+                info = os.stat(fname)
+            except OSError:
+                continue
+            entries.append((fname, info.st_size, info.st_mtime))
+        return entries
+
+
+    def evict(self):
+        """Remove the least recently used entries above the size limit."""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_size:
+            return
+
+        for fname, size, _ in sorted(entries, key=lambda entry: entry[2]):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(fname)
+            except OSError:
+                continue
+            total -= size
+            with self._lock:
+                self.evictions += 1
+
+
+    def clear(self):
+        """Remove all entries."""
+        for fname, _, _ in self._entries():
+            try:
+                os.remove(fname)
+            except OSError:
+                pass
+
+
+    def stats(self):
+        """Hit and miss statistics of this instance."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'stores': self.stores, 'evictions': self.evictions}
+
+
+    def __deepcopy__(self, memo):
+        # The cache is a shared resource, as the GDL pool.
+        return self
+
+
+    def __getstate__(self):
+        # The lock can not be sent to other processes.
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
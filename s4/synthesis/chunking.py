@@ -0,0 +1,104 @@
+"""
+Synthesis of wide spectral ranges in chunks.
+
+Synspec runs on a single core, so a wide range, e.g., a whole echelle
+spectrum, is split into chunks that are calculated in parallel by
+`Synplot.run_many` and stitched back together. Each chunk is padded on both
+sides, so that the lines just outside it, the continuum used for the
+normalization and the convolution kernels are the same of a single run; the
+padding is trimmed when stitching.
+
+Example
+-------
+
+::
+
+    syn = Synplot(20000, 4, wstart=3800, wend=7000, vrot=50, chunks=8)
+    syn.run()
+"""
+import numpy as np
+
+
+# Speed of light in km/s
+LIGHT_SPEED = 2.997925e5
+
+# Padding, in angstroms, besides the width of the convolution kernels. It
+# covers the continuum points used by rotin3 to normalize the spectrum.
+CHUNK_PADDING = 10.
+
+
+def padding(parameters):
+    """
+    Padding of the chunks, in angstroms, for a set of Synplot parameters:
+    `CHUNK_PADDING` plus the half width of the rotational, macroturbulent and
+    instrumental profiles at `wend`.
+    """
+    wend = float(parameters['wend'])
+    velocity = abs(float(parameters.get('vrot', 0))) + \
+               2. * abs(float(parameters.get('vmac_rt', 0))) + \
+               3. * abs(float(parameters.get('vmac_iso', 0)))
+
+    return CHUNK_PADDING + wend * velocity / LIGHT_SPEED + \
+           3. * abs(float(parameters.get('fwhm', 0)))
+
+
+def split_interval(wstart, wend, chunks, pad=0.):
+    """
+    Split a wavelength interval into chunks of the same size.
+
+    Parameters
+    ----------
+
+    wstart, wend: float;
+        Wavelength interval.
+
+    chunks: int;
+        Number of chunks.
+
+    pad: float (optional);
+        Padding of each chunk, in angstroms.
+
+    Returns
+    -------
+
+    list;
+        (start, end, padded start, padded end) of each chunk. The padded
+        intervals do not go beyond `wstart` and `wend`.
+    """
+    edges = np.linspace(wstart, wend, int(chunks) + 1)
+
+    return [(low, high, max(low - pad, wstart), min(high + pad, wend))
+            for low, high in zip(edges[:-1], edges[1:])]
+
+
+def stitch(spectra, intervals):
+    """
+    Join the spectra of the chunks, trimming their padding.
+
+    Parameters
+    ----------
+
+    spectra: list;
+        Spectrum of each chunk, with wavelength and flux columns.
+
+    intervals: list;
+        Intervals of the chunks, as returned by `split_interval`.
+
+    Returns
+    -------
+
+    numpy.ndarray;
+        The spectrum of the whole interval. Each point comes from the chunk
+        that contains its wavelength, the last one including its end.
+    """
+    parts = []
+    for n, (spectrum, (low, high, _, _)) in enumerate(zip(spectra,
+                                                          intervals)):
+        wave = spectrum[:, 0]
+        if n == len(spectra) - 1:
+            inside = (wave >= low) & (wave <= high)
+        else:
+            inside = (wave >= low) & (wave < high)
+        parts.append(spectrum[inside])
+
+    return np.vstack(parts)
@@ -0,0 +1,402 @@
+"""
+A PCA emulator of synthetic spectra.
+
+`train_emulator` calculates the spectra of a rectangular grid of parameters
+with `Synplot.run_many`, resamples them to common wavelengths and compresses
+them with a principal component analysis. The weights of the components are
+interpolated linearly over the grid, so the spectrum of any point inside the
+grid is predicted in about a millisecond, with an estimate of its error.
+
+The error has two terms, added in quadrature: the part of the training
+spectra not described by the components kept, and a bound of the error of
+the linear interpolation of the weights, from their second differences along
+each axis.
+
+`Emulator.save` writes a single NumPy file with all arrays, plus a small
+JSON header, and `load_emulator` memory-maps it, so several processes share
+the same pages.
+
+Example
+-------
+
+::
+
+    emulator = train_emulator({'teff': [19000, 20000, 21000],
+                               'logg': [3.5, 4, 4.5], 'vrot': [0, 50, 100]},
+                              wstart=4460, wend=4480, relative=1)
+    spectrum, error = emulator.predict({'teff': 20400, 'logg': 4.1,
+                                        'vrot': 30})
+    emulator.save('~/.s4/emulators/he4471')
+    emulator = load_emulator('~/.s4/emulators/he4471')
+"""
+import os
+import json
+import threading
+from itertools import product
+import numpy as np
+from ..utils.elements import periodic_table, element_symbols
+from synplotwrapper import Synplot
+
+
+# Arguments of the training that are not kept on the header
+UNSAVED_PARAMETERS = ['stage', 'pool', 'cache']
+
+# Arrays of the store, in order
+ARRAYS = ['wave', 'mean', 'components', 'weights', 'weight_errors',
+          'truncation']
+
+# Open emulators by name.
+_EMULATORS = {}
+_EMULATORS_LOCK = threading.Lock()
+
+
+def store_names(name):
+    """Names of the data and header files of a saved emulator."""
+    return name + '.emulator.npy', name + '.emulator.json'
+
+
+def parameter_key(key):
+    """Name of a parameter, with chemical elements by their symbol."""
+    return element_symbols().get(key, key)
+
+
+def synplot_parameters(keys, point, kwargs):
+    """
+    Synplot arguments of a point of the grid. Chemical elements are merged
+    into `abund`.
+    """
+    params = {}
+    abund = {parameter_key(key): val
+             for key, val in kwargs.get('abund', {}).iteritems()}
+    for key, value in zip(keys, point):
+        if key in periodic_table():
+            abund[key] = value
+        else:
+            params[key] = value
+    if abund:
+        params['abund'] = abund
+
+    return params
+
+
+def train_emulator(grid, variance=0.9999, n_components=None, wave=None,
+                   workers=None, **kwargs):
+    """
+    Calculate the spectra of a grid of parameters and create their emulator.
+
+    Parameters
+    ----------
+
+    grid: dict;
+        Values of each parameter, e.g., `teff`, `logg`, `vrot` or the
+        abundance of a chemical element, by its symbol or atomic number.
+        All combinations are calculated.
+
+    variance: float (optional);
+        Fraction of the variance of the spectra kept by the components.
+
+    n_components: int (optional);
+        Number of components kept. It takes precedence over `variance`.
+
+    wave: numpy.ndarray (optional);
+        Wavelengths of the emulated spectra. The default is the wavelengths
+        of the first spectrum.
+
+    workers: int (optional);
+        Number of processes, see `Synplot.run_many`.
+
+    kwargs;
+        Synplot arguments common to all spectra, including `teff` and
+        `logg` if they are not on `grid`.
+
+    Returns
+    -------
+
+    Emulator;
+        The emulator of the grid.
+    """
+    keys = sorted(parameter_key(key) for key in grid)
+    values = {parameter_key(key): val for key, val in grid.iteritems()}
+    axes = [np.unique(np.asarray(values[key], dtype=float)) for key in keys]
+
+    parameters = [synplot_parameters(keys, point, kwargs)
+                  for point in product(*axes)]
+    spectra, errors = Synplot.run_many(parameters, workers=workers, **kwargs)
+    for params, error in zip(parameters, errors):
+        if error is not None:
+            raise RuntimeError('The synthesis of {} failed:\n{}'.format(
+                params, error))
+
+    if wave is None:
+        wave = spectra[0][:, 0]
+    flux = np.array([np.interp(wave, spectrum[:, 0], spectrum[:, 1])
+                     for spectrum in spectra])
+
+    settings = {}
+    for key, val in kwargs.iteritems():
+        if key in UNSAVED_PARAMETERS:
+            continue
+        try:
+            json.dumps(val)
+        except TypeError:
+            continue
+        settings[key] = val
+
+    return Emulator.from_spectra(keys, axes, wave, flux, variance,
+                                 n_components, settings)
+
+
+def load_emulator(name):
+    """
+    Memory-map an emulator saved by `Emulator.save`. Emulators are opened
+    only once per process.
+    """
+    name = os.path.realpath(os.path.expanduser(name))
+
+    with _EMULATORS_LOCK:
+        if name in _EMULATORS:
+            return _EMULATORS[name]
+
+    data_name, header_name = store_names(name)
+    if not all(os.path.isfile(fname) for fname in store_names(name)):
+        raise IOError("Emulator '{}' does not exist.".format(name))
+
+    with open(header_name) as infile:
+        header = json.load(infile)
+    data = np.load(data_name, mmap_mode='r')
+
+    arrays = {}
+    start = 0
+    for key in ARRAYS:
+        shape = header['shapes'][key]
+        size = int(np.prod(shape))
+        arrays[key] = data[start:start + size].reshape(shape)
+        start += size
+
+    emulator = Emulator(header['keys'], header['axes'],
+                        parameters=header['parameters'], **arrays)
+
+    with _EMULATORS_LOCK:
+        _EMULATORS[name] = emulator
+
+    return emulator
+
+
+class Emulator(object):
+    """
+    Emulator of the spectra of a rectangular grid of parameters.
+
+    Usually created by `train_emulator` or `load_emulator`.
+
+    Attributes
+    ----------
+
+    keys: list;
+        Name of the parameters, with chemical elements by their symbol.
+
+    axes: list;
+        Values of each parameter on the grid.
+
+    wave: numpy.ndarray;
+        Wavelengths of the spectra.
+
+    mean: numpy.ndarray;
+        Mean flux of the training spectra.
+
+    components: numpy.ndarray;
+        Principal components, with shape (number of components, number of
+        wavelengths).
+
+    weights, weight_errors: numpy.ndarray;
+        Weight of each component on each point of the grid and the bound of
+        the error of its interpolation, with shape (number of points, number
+        of components).
+
+    truncation: numpy.ndarray;
+        Root mean square, at each wavelength, of the training spectra not
+        described by the components.
+
+    parameters: dict;
+        Synplot arguments common to the training spectra.
+    """
+
+    def __init__(self, keys, axes, wave, mean, components, weights,
+                 weight_errors, truncation, parameters=None):
+        self.keys = [str(key) for key in keys]
+        self.axes = [np.asarray(axis, dtype=float) for axis in axes]
+        self.sizes = [len(axis) for axis in self.axes]
+        self.wave = wave
+        self.mean = mean
+        self.components = components
+        self.weights = weights
+        self.weight_errors = weight_errors
+        self.truncation = truncation
+        self.parameters = parameters or {}
+
+
+    @classmethod
+    def from_spectra(cls, keys, axes, wave, flux, variance=0.9999,
+                     n_components=None, parameters=None):
+        """
+        Create the emulator of the spectra of a grid.
+
+        Parameters
+        ----------
+
+        keys, axes: list;
+            Name and values of each parameter.
+
+        wave: numpy.ndarray;
+            Wavelengths of the spectra.
+
+        flux: numpy.ndarray;
+            Flux of each point of the grid, in the order of
+            `itertools.product(*axes)`, with shape (number of points,
+            number of wavelengths).
+
+        See `train_emulator` for the other parameters.
+        """
+        sizes = [len(axis) for axis in axes]
+        mean = flux.mean(axis=0)
+        residual = flux - mean
+        _, singular, vectors = np.linalg.svd(residual, full_matrices=False)
+
+        if n_components is None:
+            explained = np.cumsum(singular**2)
+            total = explained[-1] if explained[-1] > 0 else 1.
+            n_components = np.searchsorted(explained / total, variance) + 1
+        n_components = max(1, min(int(n_components), len(singular)))
+
+        components = vectors[:n_components]
+        weights = np.dot(residual, components.T)
+        truncation = np.sqrt(np.mean(
+            (residual - np.dot(weights, components))**2, axis=0))
+
+        # Bound of the error of the linear interpolation, |f''| h**2 / 8
+        grid_weights = weights.reshape(sizes + [n_components])
+        weight_errors = np.zeros_like(grid_weights)
+        for axis, size in enumerate(sizes):
+            if size < 3:
+                continue
+            second = np.abs(np.diff(grid_weights, n=2, axis=axis)) / 8.
+            # The nodes on the edges get the value of their neighbour
+            weight_errors += np.concatenate(
+                [second.take([0], axis=axis), second,
+                 second.take([-1], axis=axis)], axis=axis)
+
+        return cls(keys, axes, wave, mean, components, weights,
+                   weight_errors.reshape(weights.shape), truncation,
+                   parameters)
+
+
+    def covers(self, point):
+        """Check if a point, a dict by parameter, is inside the grid."""
+        point = {parameter_key(key): val for key, val in point.iteritems()}
+        return all(key in point and axis[0] <= float(point[key]) <= axis[-1]
+                   for key, axis in zip(self.keys, self.axes))
+
+
+    def corners(self, point):
+        """
+        Rows of the grid points around a point and their weights on the
+        linear interpolation.
+        """
+        indices = []
+        fractions = []
+        for key, axis in zip(self.keys, self.axes):
+            if key not in point:
+                raise ValueError("Parameter '{}' is not set.".format(key))
+            value = float(point[key])
+            if not axis[0] <= value <= axis[-1]:
+                raise ValueError('{} = {} is out of the emulator grid.'
+                                 .format(key, value))
+            if len(axis) == 1:
+                indices.append([0, 0])
+                fractions.append(0.)
+                continue
+            low = min(np.searchsorted(axis, value, side='right') - 1,
+                      len(axis) - 2)
+            indices.append([low, low + 1])
+            fractions.append((value - axis[low]) / (axis[low + 1] - axis[low]))
+
+        rows = []
+        weights = []
+        for corner in product([0, 1], repeat=len(self.keys)):
+            weight = np.prod([frac if side else 1. - frac
+                              for side, frac in zip(corner, fractions)])
+            if weight > 0:
+                rows.append(np.ravel_multi_index(
+                    [index[side] for side, index in zip(corner, indices)],
+                    self.sizes))
+                weights.append(weight)
+
+        return rows, np.array(weights)
+
+
+    def predict(self, point):
+        """
+        Predict the spectrum of a point of the grid.
+
+        Parameters
+        ----------
+
+        point: dict;
+            Value of each parameter of `keys`. Chemical elements can also be
+            given by their atomic number.
+
+        Returns
+        -------
+
+        spectrum: numpy.ndarray;
+            Wavelength and flux.
+
+        error: numpy.ndarray;
+            Estimate of the error of the flux.
+        """
+        point = {parameter_key(key): val for key, val in point.iteritems()}
+        rows, weights = self.corners(point)
+
+        comp_weights = np.dot(weights, self.weights[rows])
+        comp_errors = np.dot(weights, self.weight_errors[rows])
+
+        flux = self.mean + np.dot(comp_weights, self.components)
+        error = np.sqrt(self.truncation**2 +
+                        np.dot(comp_errors**2, self.components**2))
+
+        return np.column_stack([self.wave, flux]), error
+
+
+    def save(self, name):
+        """
+        Save the emulator to `name.emulator.npy` and `name.emulator.json`,
+        to be memory-mapped by `load_emulator`.
+        """
+        name = os.path.expanduser(name)
+        data_name, header_name = store_names(name)
+        arrays = [np.asarray(getattr(self, key), dtype=np.float64)
+                  for key in ARRAYS]
+        header = {'keys': self.keys,
+                  'axes': [axis.tolist() for axis in self.axes],
+                  'shapes': {key: array.shape
+                             for key, array in zip(ARRAYS, arrays)},
+                  'parameters': self.parameters}
+
+        # Write to temporary files and rename them, so readers never see an
+        # incomplete emulator.
+        tmp_data = data_name + '.{}.tmp'.format(os.getpid())
+        tmp_header = header_name + '.{}.tmp'.format(os.getpid())
+        try:
+            with open(tmp_data, 'wb') as out:
+                np.save(out, np.concatenate([array.ravel()
+                                             for array in arrays]))
+            with open(tmp_header, 'w') as out:
+                json.dump(header, out)
+            os.rename(tmp_data, data_name)
+            os.rename(tmp_header, header_name)
+        finally:
+            for fname in [tmp_data, tmp_header]:
+                if os.path.exists(fname):
+                    os.remove(fname)
+
+        with _EMULATORS_LOCK:
+            _EMULATORS.pop(os.path.realpath(name), None)
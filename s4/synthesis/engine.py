@@ -0,0 +1,397 @@
+"""
+A native driver to Synspec and Rotin3.
+
+`SynspecEngine` does the work of `synplot.pro` without IDL/GDL: it creates the
+model atmosphere, writes the input files of Synspec (fort.1, fort.5, fort.55
+and fort.56), links the line list, atomic data and line broadening tables,
+runs `synspec49` and `rotin3` and reads the calculated spectrum back.
+
+It accepts the same parameters as `synplot.pro`, except those related to
+plotting and to the interactive input.
+"""
+import os
+import numpy as np
+from ..io import specio, wrappers
+from synplot_abund import Synplot_abund
+from timings import Timings, command_stage, file_bytes
+import atmosphere
+import jobs
+
+
+# Speed of light in km/s, as in synplot.pro
+LIGHT_SPEED = 2.997925e5
+
+
+def unquote(value):
+    """Remove the IDL quotes of a string parameter."""
+    return str(value).strip().strip("'\"")
+
+
+def parse_abund(abund):
+    """
+    Transform the abundance parameter into a list of (first atomic number,
+    last atomic number, abundance) triads.
+
+    Parameters
+    ----------
+
+    abund: str, dict;
+        Abundances in the Synplot format, e.g., '[2, 2, 10.93]', or as a
+        dictionary, e.g., {'He': 10.93}.
+    """
+    if isinstance(abund, dict):
+        abund = Synplot_abund(abund).to_synplot()
+    values = [float(i) for i in str(abund).strip('[] ').split(',')
+              if i.strip()]
+
+    return [(int(values[i]), int(values[i+1]), values[i+2])
+            for i in range(0, len(values), 3)]
+
+
+class SynspecEngine(object):
+    """
+    Run Synspec and Rotin3 directly.
+
+    Parameters
+    ----------
+
+    parameters: dict;
+        Synplot parameters. It must contain `wstart` and `wend` and, unless
+        the parameter `atmos` is set, `teff` and `logg`.
+
+    Attributes
+    ----------
+
+    eqw: float;
+        Total equivalent width, in milliangstrom, of the last run.
+
+    log: str;
+        Output of the programs of the last run.
+
+    timings: Timings;
+        Time of each stage of the last run. With `steps`, only the Python
+        stages, i.e., the interpolation of the model atmosphere and the
+        parsing of the spectrum, are timed, as the programs are run by the
+        caller.
+    """
+
+    def __init__(self, parameters):
+        self.parameters = parameters
+        self.eqw = None
+        self.log = ''
+        self.timings = Timings()
+
+
+    def imode(self):
+        """Basic mode of Synspec."""
+        if self.get('cont'):
+            return 2
+        return int(self.get('imode', 0))
+
+
+    def wdist(self):
+        """Maximum wavelength step."""
+        return float(self.get('wdist', 0.01 if self.imode() != 2 else 0.5))
+
+
+    def get(self, key, default=None):
+        """Get a parameter, or `default` if it is not set."""
+        value = self.parameters.get(key, default)
+        if value is None:
+            return default
+        return value
+
+
+    def run(self, path):
+        """
+        Calculate the spectrum.
+
+        Parameters
+        ----------
+
+        path: str;
+            Directory in which the programs will run, usually the path of a
+            `Workspace`.
+
+        Returns
+        -------
+
+        spectrum: numpy.ndarray;
+            The synthetic spectrum, i.e., the content of fort.11.
+        """
+        def execute(command, cwd):
+            """Run and time a program."""
+            output = wrappers.run_command(command, cwd=cwd)
+            self.timings.add(command_stage(command), output.elapsed,
+                             output.cpu)
+            return output
+
+        jobs.run_steps(self.steps(path), execute)
+
+        return self.spectrum
+
+
+    def steps(self, path):
+        """
+        Generator of the commands of the calculation, as `run`, but without
+        running them. It yields (command, directory) and the output of each
+        command, (stdout, stderr), must be sent back. At the end, the
+        spectrum is on `spectrum`.
+        """
+        self.log = ''
+        self.path = path
+        self.spectrum = None
+        self.timings = Timings()
+
+        run_synspec = 'norun' not in self.parameters
+
+        self.link_inputs()
+
+        if run_synspec:
+            fort5, fort8 = self.model_atmosphere()
+            self.write_fort55(fort5, fort8)
+            self.write_fort56()
+            self.write_fort1()
+            self.link('fort.8', fort8, copy=True)
+            output = yield './synspec49 < {}'.format(fort5), self.path
+            self.record(output, 'sylog.tmp')
+            self.eqw = self.read_eqw()
+
+        vrot = float(self.get('vrot', 0.))
+        fwhm = float(self.get('fwhm', 0.))
+        if vrot >= 0 and fwhm >= 0:
+            self.write_rotin_input()
+            output = yield './rotin3 < r.tmp', self.path
+            self.record(output, 'out.tmp')
+
+        with self.timings.measure('parse') as io:
+            self.spectrum = specio.loadtxt_fast(self.file('fort.11'),
+                                                np.float)
+            io['bytes_read'] = os.path.getsize(self.file('fort.11'))
+
+
+    def file(self, fname):
+        """Return the full path of a file in the running directory."""
+        return os.path.join(self.path, fname)
+
+
+    def link(self, fname, target, copy=False):
+        """
+        Create the link `fname` to `target` in the running directory,
+        replacing any existing file. If `copy` is True, the file is copied
+        instead.
+        """
+        destination = self.file(fname)
+        if os.path.lexists(destination):
+            os.remove(destination)
+
+        if copy:
+            with open(self.file(target), 'rb') as infile:
+                with open(destination, 'wb') as out:
+                    out.write(infile.read())
+        else:
+            os.symlink(target, destination)
+
+
+    def record(self, output, log_name):
+        """Save the output of a program."""
+        stdout, stderr = output
+        with open(self.file(log_name), 'w') as out:
+            out.write(stdout)
+        self.log += '{}\n{}'.format(stdout, stderr)
+
+
+    def link_inputs(self):
+        """Link the line list, atomic data and line broadening tables."""
+        linlist = self.get('linlist')
+        if linlist is not None and unquote(linlist) != 'fort.19':
+            self.link('fort.19', unquote(linlist))
+
+        self.link('data', unquote(self.get('atdata', '../atdata')))
+
+        # Hydrogen line broadening tables
+        lemke = int(self.get('lemke', 1))
+        if lemke > 0:
+            self.link('fort.21', 'lyman')
+            self.link('fort.22', 'balmer')
+            self.ihydpr = 2122
+            if lemke > 2:
+                self.link('fort.23', 'pasch')
+                self.link('fort.24', 'brack')
+                self.ihydpr = 21222324
+        elif 'hydprf' in self.parameters:
+            hydprf = unquote(self.parameters['hydprf'])
+            self.link('fort.20', 'hydprf.dat' if hydprf == '1' else hydprf)
+            self.ihydpr = -20
+        else:
+            self.ihydpr = 0
+
+        # Helium line broadening tables
+        self.ihe1pr = self.link_profile('he1prf', 'fort.25', 25)
+        self.ihe2pr = self.link_profile('he2prf', 'fort.26', 26)
+
+        # Quasi-molecular satellites
+        quasi = int(self.get('quasi', 0))
+        self.nalp = self.nbet = self.ngam = 0
+        if quasi >= 1:
+            self.link('fort.3', 'laquasi.dat')
+            self.nalp = 3
+        if quasi >= 2:
+            self.link('fort.18', 'lbquasi.dat')
+            self.nbet = 18
+        if quasi >= 3:
+            self.link('fort.28', 'lgquasi.dat')
+            self.ngam = 28
+
+
+    def link_profile(self, key, fname, unit):
+        """Link a helium line broadening table and return its unit."""
+        value = unquote(self.get(key, 1))
+        if value == '0':
+            return 0
+        self.link(fname, key + '.dat' if value == '1' else value)
+        return unit
+
+
+    def model_atmosphere(self):
+        """
+        Obtain the names of the model atmosphere files, interpolating the
+        grid if `atmos` was not set.
+        """
+        if 'atmos' not in self.parameters:
+            metal = self.parameters.get('metal')
+            if metal is not None:
+                metal = float(metal)
+            try:
+                with self.timings.measure('model') as io:
+                    atmos = atmosphere.make_model(
+                        float(self.parameters['teff']),
+                        float(self.parameters['logg']), self.path,
+                        metal=metal)
+                    io['bytes_written'] = file_bytes(
+                        self.path, [atmos + '.5', atmos + '.7'])
+            except ValueError as err:
+                # Out of the grid, as a failed interpolation of synplot.pro
+                raise IOError('The model atmosphere can not be '
+                              'interpolated: {}'.format(err))
+        else:
+            atmos = self.parameters['atmos']
+
+        if isinstance(atmos, (list, tuple)):
+            return unquote(atmos[0]), unquote(atmos[1])
+
+        atmos = unquote(atmos)
+        return atmos + '.5', atmos + '.7'
+
+
+    def standard_depth(self, fort5, fort8, inmod):
+        """Obtain the standard depth as synplot.pro does."""
+        if 'idstd' in self.parameters:
+            return int(self.parameters['idstd'])
+        if inmod == 0 or inmod == 2:
+            return 46
+
+        with open(self.file(fort5)) as infile:
+            teff = float(infile.readline().split()[0])
+        _, params = atmosphere.read_model(self.file(fort8))
+        cooler = np.nonzero(params[:, 0] < teff)[0]
+
+        return cooler[-1] + 1
+
+
+    def write_fort55(self, fort5, fort8):
+        """Write the input file fort.55 of Synspec."""
+        imode = self.imode()
+
+        if 'kurucz' not in self.parameters:
+            inmod = 1
+        else:
+            inmod = 0 if float(self.parameters['kurucz']) >= 0 else 1
+        if os.path.basename(fort8).startswith('ap00t'):
+            inmod = 0
+        if self.get('disk'):
+            inmod = 2
+
+        nlte = 0 if inmod == 0 else int(self.get('nlte', 1))
+        icontl = int(self.get('icontl', 0))
+        ifhe2 = int(self.get('ifhe2', 0))
+        lyman = int(self.get('lyman', 0))
+        cutoff = float(self.get('cutoff', 10))
+        strength = float(self.get('strength', 1e-4))
+        wdist = self.wdist()
+
+        idst = self.standard_depth(fort5, fort8, inmod)
+
+        lines = ['{} {} 0'.format(imode, idst),
+                 '{} 0 0 1'.format(inmod),
+                 '{} {} {} {} 0'.format(lyman, self.nalp, self.nbet,
+                                        self.ngam),
+                 '1 {} {} 0 {}'.format(nlte, icontl, ifhe2),
+                 '{} {} {}'.format(self.ihydpr, self.ihe1pr, self.ihe2pr),
+                 '{} {} {} 0 {} {}'.format(float(self.parameters['wstart']),
+                                           float(self.parameters['wend']),
+                                           cutoff, strength, wdist),
+                 '0 0']
+
+        if 'vturb' in self.parameters:
+            lines.append(str(float(self.parameters['vturb'])))
+
+        nangles = int(self.get('nangles', 0))
+        if nangles > 0:
+            if 'vturb' not in self.parameters:
+                lines.append('-1')
+            lines.append('{} {} 1'.format(nangles,
+                                          float(self.get('anglmin', 0.1))))
+
+        with open(self.file('fort.55'), 'w') as out:
+            out.write('\n'.join(lines) + '\n')
+
+
+    def write_fort56(self):
+        """Write the input file fort.56 (abundance changes) of Synspec."""
+        rows = []
+        if 'abund' in self.parameters:
+            for first, last, abun in parse_abund(self.parameters['abund']):
+                rows += ['%4i%15.5e' % (atom, abun)
+                         for atom in range(first, last + 1)]
+
+        with open(self.file('fort.56'), 'w') as out:
+            out.write('\n'.join([str(len(rows))] + rows) + '\n')
+
+
+    def write_fort1(self):
+        """Write the input file fort.1 of Synspec."""
+        with open(self.file('fort.1'), 'w') as out:
+            out.write('{}\n'.format(1 if self.get('oldinp') else 0))
+
+
+    def read_eqw(self):
+        """Read the total equivalent width from fort.16."""
+        try:
+            with open(self.file('fort.16')) as infile:
+                last = infile.readlines()[-1]
+            return float(last.split()[4])
+        except (IOError, IndexError, ValueError):
+            return np.nan
+
+
+    def write_rotin_input(self):
+        """Write the input file of Rotin3."""
+        wstart = float(self.parameters['wstart'])
+        wend = float(self.parameters['wend'])
+        fwhm = float(self.get('fwhm', 0.))
+        if 'vmac_iso' in self.parameters:
+            fwhm += float(self.parameters['vmac_iso']) / LIGHT_SPEED * \
+                    (wstart + wend) * 0.5
+
+        lines = [" 'fort.7'   'fort.17'    'fort.11' ",
+                 '{} {} {}'.format(float(self.get('vrot', 0.)),
+                                   self.wdist(),
+                                   float(self.get('steprot', 0))),
+                 '{} {} {}'.format(fwhm, float(self.get('stepins', 0)),
+                                   float(self.get('vmac_rt', 0.))),
+                 '{} {} {}'.format(wstart, wend,
+                                   int(float(self.get('relative', 0))))]
+
+        with open(self.file('r.tmp'), 'w') as out:
+            out.write('\n'.join(lines) + '\n')
@@ -0,0 +1,296 @@
+"""
+A pool of persistent GDL/IDL sessions.
+
+Starting `gdl -e "..."` for every synthesis means starting the interpreter and
+compiling `synplot.pro`, `intrpmod.pro`, `gettok.pro`, etc. on each run. A
+`GDLSession` keeps an interpreter alive and feeds it commands through its
+standard input; the end of each command is detected by a marker printed after
+it. A `GDLPool` holds a few sessions that are checked out by `Synplot` runs,
+restarting sessions that died or hung.
+
+Example
+-------
+
+::
+
+    pool = GDLPool(size=4)
+    syn = Synplot(20000, 4, wstart=4460, wend=4480, pool=pool)
+    syn.run()
+    pool.close()
+"""
+import os
+import select
+import threading
+import time
+import subprocess as sp
+from Queue import Queue, Empty
+
+
+class GDLSessionError(RuntimeError):
+    """The GDL/IDL session died or did not answer in time."""
+    pass
+
+
+class GDLSessionTimeout(GDLSessionError):
+    """The GDL/IDL session did not answer in time."""
+    pass
+
+
+class GDLSession(object):
+    """
+    A long-lived GDL/IDL interpreter.
+
+    Parameters
+    ----------
+
+    software: str (optional);
+        Interpreter to be run, 'gdl' or 'idl'. The default is 'gdl'.
+
+    timeout: float (optional);
+        Maximum time, in seconds, to wait for a command. The default is None,
+        i.e., wait forever.
+    """
+
+    def __init__(self, software='gdl', timeout=None):
+        self.software = software
+        self.timeout = timeout
+        self.process = None
+        self.count = 0
+        self.start()
+
+
+    def start(self):
+        """Start the interpreter."""
+        self.process = sp.Popen([self.software, '-quiet'], stdin=sp.PIPE,
+                                stdout=sp.PIPE, stderr=sp.STDOUT,
+                                close_fds=True)
+        self._buffer = ''
+
+
+    def is_alive(self):
+        """Check if the interpreter is running."""
+        return self.process is not None and self.process.poll() is None
+
+
+    def execute(self, commands, timeout=None):
+        """
+        Execute IDL commands and wait for them to finish.
+
+        Parameters
+        ----------
+
+        commands: list;
+            Lines of IDL code.
+
+        timeout: float (optional);
+            Maximum time to wait, in seconds. The default is the timeout of the
+            session.
+
+        Returns
+        -------
+
+        output: str;
+            Everything printed by the commands.
+        """
+        if not self.is_alive():
+            raise GDLSessionError('The {} session is not running.'.format(
+                self.software))
+
+        self.count += 1
+        marker = 'S4_DONE_{}_{}'.format(os.getpid(), self.count)
+
+        # `retall` returns to the main level if a procedure stopped on an
+        # error, so the marker is always printed.
+        script = list(commands) + ['retall',
+                                   "print, '{}'".format(marker),
+                                   'flush, -1']
+        try:
+            self.process.stdin.write('\n'.join(script) + '\n')
+            self.process.stdin.flush()
+        except IOError:
+            raise GDLSessionError('The {} session died.'.format(self.software))
+
+        if timeout is None:
+            timeout = self.timeout
+
+        return self._read_until(marker, timeout)
+
+
+    def _read_until(self, marker, timeout):
+        """Read the output of the interpreter until a line with `marker`."""
+        fdesc = self.process.stdout.fileno()
+        deadline = None if timeout is None else time.time() + timeout
+
+        while True:
+            position = self._buffer.find(marker + '\n')
+            if position >= 0:
+                output = self._buffer[:position]
+                self._buffer = self._buffer[position + len(marker) + 1:]
+                return output
+
+            if deadline is None:
+                wait = None
+            else:
+                wait = deadline - time.time()
+                if wait <= 0:
+                    raise GDLSessionTimeout('The {} session did not answer '
+                                            'in {} s.'.format(self.software,
+                                                              timeout))
+
+            ready, _, _ = select.select([fdesc], [], [], wait)
+            if ready:
+                chunk = os.read(fdesc, 65536)
+                if not chunk:
+                    raise GDLSessionError('The {} session died.'.format(
+                        self.software))
+                self._buffer += chunk
+
+
+    def ping(self, timeout=10):
+        """Check if the interpreter answers to commands."""
+        try:
+            self.execute([], timeout=timeout)
+            return True
+        except GDLSessionError:
+            return False
+
+
+    def close(self):
+        """Stop the interpreter."""
+        if self.process is None:
+            return
+
+        if self.process.poll() is None:
+            try:
+                self.process.stdin.write('exit\n')
+                self.process.stdin.flush()
+            except IOError:
+                pass
+            time.sleep(0.01)
+            if self.process.poll() is None:
+                self.process.kill()
+        self.process.wait()
+        self.process = None
+
+
+    def restart(self):
+        """Stop the interpreter, if running, and start a new one."""
+        self.close()
+        self.start()
+
+
+class GDLPool(object):
+    """
+    A pool of `GDLSession`.
+
+    Parameters
+    ----------
+
+    size: int (optional);
+        Number of sessions. The default is 1.
+
+    software: str (optional);
+        Interpreter to be run, 'gdl' or 'idl'. The default is 'gdl'.
+
+    timeout: float (optional);
+        Maximum time, in seconds, to wait for a synthesis. The default is
+        None, i.e., wait forever.
+
+    Attributes
+    ----------
+
+    restarts: int;
+        Number of sessions restarted because they crashed or hung.
+    """
+
+    def __init__(self, size=1, software='gdl', timeout=None):
+        self.size = size
+        self.software = software
+        self.timeout = timeout
+        self.restarts = 0
+        self._lock = threading.Lock()
+        self._sessions = []
+        self._idle = Queue()
+
+        for _ in range(size):
+            session = GDLSession(software, timeout)
+            self._sessions.append(session)
+            self._idle.put(session)
+
+
+    def execute(self, commands, timeout=None):
+        """
+        Execute IDL commands on the first idle session.
+
+        If the session crashes or does not answer in time, it is restarted
+        and `GDLSessionError` is raised.
+        """
+        session = self._checkout()
+        try:
+            return session.execute(commands, timeout)
+        except GDLSessionError:
+            with self._lock:
+                self.restarts += 1
+            session.restart()
+            raise
+        finally:
+            self._idle.put(session)
+
+
+    def _checkout(self):
+        """Obtain an idle session, restarting it if it is not healthy."""
+        session = self._idle.get()
+        if not session.is_alive():
+            with self._lock:
+                self.restarts += 1
+            session.restart()
+        return session
+
+
+    def health_check(self, timeout=10):
+        """
+        Ping the idle sessions and restart the ones that do not answer.
+        Sessions busy with a command are skipped.
+
+        Returns
+        -------
+
+        restarted: int;
+            Number of sessions restarted.
+        """
+        restarted = 0
+        for _ in range(self._idle.qsize()):
+            try:
+                session = self._idle.get_nowait()
+            except Empty:
+                break
+            try:
+                if not session.is_alive() or not session.ping(timeout):
+                    session.restart()
+                    restarted += 1
+            finally:
+                self._idle.put(session)
+
+        with self._lock:
+            self.restarts += restarted
+        return restarted
+
+
+    def close(self):
+        """Stop all sessions."""
+        for session in self._sessions:
+            session.close()
+
+
+    def __deepcopy__(self, memo):
+        # A pool is a shared resource. Copies of the parameters of a
+        # synthesis, as done by Synfit, should use the same pool.
+        return self
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,389 @@
+"""
+Non-blocking syntheses.
+
+A synthesis is a sequence of external programs (GDL/IDL, or Synspec and
+Rotin3) with some Python work in between. `Synplot.run_steps` and
+`SynspecEngine.steps` are generators that yield each command line and receive
+its output back; `run_steps` drives them synchronously.
+
+A `Job` drives the same generator without blocking: it starts each command
+in its own process group and is advanced by a `Scheduler` when the output of
+the command arrives. A single `Scheduler` loop can drive many syntheses, with
+a limit on the number of programs running at the same time, and jobs can be
+cancelled, killing their programs.
+
+Example
+-------
+
+::
+
+    scheduler = Scheduler(max_running=8)
+    jobs = [Synplot(20000, 4, vrot=vrot, wstart=4460, wend=4480).run_async(
+                scheduler=scheduler) for vrot in range(0, 200, 10)]
+    scheduler.wait()
+    spectra = [job.result() for job in jobs]
+"""
+import os
+import errno
+import select
+import signal
+import time
+import subprocess as sp
+from ..io.wrappers import CommandTimeout, CommandResult, wait_process
+
+
+class JobCancelled(Exception):
+    """The job was cancelled."""
+    pass
+
+
+def run_steps(steps, execute):
+    """
+    Drive a generator of commands synchronously.
+
+    Parameters
+    ----------
+
+    steps: generator;
+        Yields (command, directory) and receives (stdout, stderr).
+
+    execute: function;
+        Called as `execute(command, directory)` and returns (stdout,
+        stderr).
+    """
+    output = None
+    while True:
+        try:
+            command, cwd = steps.send(output)
+        except StopIteration:
+            return
+        output = execute(command, cwd)
+
+
+class Job(object):
+    """
+    A synthesis driven without blocking.
+
+    Parameters
+    ----------
+
+    steps: generator;
+        Yields (command, directory) and receives (stdout, stderr), as
+        `Synplot.run_steps`.
+
+    result: function (optional);
+        Called without arguments when the steps are over. Its return is the
+        result of the job.
+
+    callback: function (optional);
+        Called with the job when it finishes, e.g., to calculate a
+        chi-square as soon as the spectrum is available.
+
+    timeout: float (optional);
+        Maximum time, in seconds, of each command. A command that does not
+        finish in time is killed and the job fails with `CommandTimeout`.
+
+    retries: int (optional);
+        Number of times a command that does not finish in time is run again.
+        The default is 0.
+    """
+
+    def __init__(self, steps, result=None, callback=None, timeout=None,
+                 retries=0):
+        self.steps = steps
+        self._result = result
+        self.callback = callback
+        self.timeout = timeout
+        self.retries = retries
+        self.deadline = None
+        self.started = None
+        self.command = None
+        self.attempts = 0
+
+        self.process = None
+        self.error = None
+        self.value = None
+        self.cancelled = False
+        self.finished = False
+        self._buffers = {}
+        self._open = set()
+
+
+    def start(self):
+        """Advance to the first command and start it."""
+        self._advance(None)
+
+
+    def done(self):
+        """Check if the job is over."""
+        return self.finished
+
+
+    def running(self):
+        """Check if a program of the job is running."""
+        return self.process is not None
+
+
+    def fileno(self):
+        """File descriptors of the output of the running program."""
+        if self.process is None:
+            return []
+        return list(self._open)
+
+
+    def read(self, fdesc):
+        """
+        Read the output of the running program on `fdesc`. When the program
+        ends, its output is sent to the steps and the next command starts.
+        """
+        try:
+            chunk = os.read(fdesc, 65536)
+        except OSError as err:
+            if err.errno in (errno.EAGAIN, errno.EINTR):
+                return
+            chunk = ''
+
+        if chunk:
+            self._buffers[fdesc].append(chunk)
+            return
+
+        # End of file
+        self._open.discard(fdesc)
+        if not self._open:
+            cpu = wait_process(self.process)
+            output = CommandResult(
+                ''.join(self._buffers[self.process.stdout.fileno()]),
+                ''.join(self._buffers[self.process.stderr.fileno()]),
+                self.process.returncode, attempts=self.attempts,
+                elapsed=time.time() - self.started, cpu=cpu)
+            self.process.stdout.close()
+            self.process.stderr.close()
+            self.process = None
+            self._advance(output)
+
+
+    def cancel(self):
+        """Kill the running program, if any, and stop the job."""
+        if self.finished:
+            return False
+
+        self.cancelled = True
+        self._abort(JobCancelled())
+        return True
+
+
+    def check_timeout(self):
+        """
+        Kill the running program if it did not finish in time, and start it
+        again if there are `retries` left.
+
+        Returns
+        -------
+
+        bool;
+            True if the job timed out.
+        """
+        if self.deadline is None or self.process is None or \
+           time.time() < self.deadline:
+            return False
+
+        self._kill()
+        if self.attempts <= self.retries:
+            self._start(*self.command)
+            return False
+
+        self._abort(CommandTimeout('Command did not finish in {} s.'.format(
+            self.timeout)))
+        return True
+
+
+    def result(self):
+        """
+        The result of the job. The error of the job, if any, is raised.
+        """
+        if not self.finished:
+            raise RuntimeError('The job is not done.')
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+    def _advance(self, output):
+        """Send the output to the steps and start the next command."""
+        try:
+            command, cwd = self.steps.send(output)
+        except StopIteration:
+            try:
+                if self._result is not None:
+                    self.value = self._result()
+            except Exception as err:
+                self.error = err
+            self._finish()
+            return
+        except Exception as err:
+            self.error = err
+            self._finish()
+            return
+
+        self.command = command, cwd
+        self.attempts = 0
+        self._start(command, cwd)
+
+
+    def _start(self, command, cwd):
+        """Start a command. If it can not be started, the job fails."""
+        self.attempts += 1
+        self.started = time.time()
+        try:
+            # A process group, so the whole pipeline can be killed.
+            self.process = sp.Popen(command, shell=True, cwd=cwd,
+                                    stdout=sp.PIPE, stderr=sp.PIPE,
+                                    preexec_fn=os.setsid, close_fds=True)
+        except OSError as err:
+            self._abort(err)
+            return
+
+        if self.timeout is not None:
+            self.deadline = time.time() + self.timeout
+        fdescs = [self.process.stdout.fileno(), self.process.stderr.fileno()]
+        self._buffers = {fdesc: [] for fdesc in fdescs}
+        self._open = set(fdescs)
+
+
+    def _kill(self):
+        """Kill the process group of the running program."""
+        if self.process is None:
+            return
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        self.process.wait()
+        self.process.stdout.close()
+        self.process.stderr.close()
+        self.process = None
+
+
+    def _abort(self, error):
+        """Kill the running program and stop the job with an error."""
+        self._kill()
+        self.error = error
+        try:
+            self.steps.close()
+        except Exception:
+            pass
+        self._finish()
+
+
+    def _finish(self):
+        self.finished = True
+        if self.callback is not None:
+            self.callback(self)
+
+
+class Scheduler(object):
+    """
+    Drive many jobs from a single loop.
+
+    Parameters
+    ----------
+
+    max_running: int (optional);
+        Maximum number of jobs with a program running at the same time. The
+        default is 4.
+    """
+
+    def __init__(self, max_running=4):
+        self.max_running = max_running
+        self.pending = []
+        self.active = []
+
+
+    def submit(self, job):
+        """Add a job to be run."""
+        self.pending.append(job)
+        return job
+
+
+    def cancel_all(self):
+        """Cancel all jobs that are not done."""
+        for job in self.pending + self.active:
+            job.cancel()
+        self.pending = []
+        self.active = []
+
+
+    def step(self, timeout=None):
+        """
+        Start pending jobs up to the limit and wait, at most `timeout`
+        seconds, for the output of the running ones.
+
+        Returns
+        -------
+
+        bool;
+            True if there are jobs that are not done.
+        """
+        self.active = [job for job in self.active if not job.done()]
+        self.pending = [job for job in self.pending if not job.done()]
+
+        while self.pending and len(self.active) < self.max_running:
+            job = self.pending.pop(0)
+            job.start()
+            if not job.done():
+                self.active.append(job)
+
+        fdescs = {}
+        for job in self.active:
+            for fdesc in job.fileno():
+                fdescs[fdesc] = job
+
+        if not fdescs:
+            return bool(self.pending or self.active)
+
+        # Wake up at the first deadline of the running commands
+        deadlines = [job.deadline for job in self.active
+                     if job.deadline is not None and job.running()]
+        if deadlines:
+            wait = max(min(deadlines) - time.time(), 0)
+            timeout = wait if timeout is None else min(timeout, wait)
+
+        try:
+            ready, _, _ = select.select(list(fdescs), [], [], timeout)
+        except select.error as err:
+            if err.args[0] != errno.EINTR:
+                raise
+            ready = []
+
+        for fdesc in ready:
+            job = fdescs[fdesc]
+            if not job.done() and fdesc in job.fileno():
+                job.read(fdesc)
+
+        for job in self.active:
+            if not job.done():
+                job.check_timeout()
+
+        self.active = [job for job in self.active if not job.done()]
+        return bool(self.pending or self.active)
+
+
+    def wait(self, timeout=None):
+        """
+        Run until all jobs are done.
+
+        Parameters
+        ----------
+
+        timeout: float (optional);
+            Maximum time, in seconds. If it is exceeded, the remaining jobs
+            are cancelled.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            wait = None if deadline is None else deadline - time.time()
+            if wait is not None and wait <= 0:
+                self.cancel_all()
+                return
+            if not self.step(wait):
+                return
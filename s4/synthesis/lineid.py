@@ -0,0 +1,119 @@
+"""
+Line identification tables of a synthesis.
+
+Synspec writes the lines that contribute to the spectrum, with their
+equivalent widths, to fort.12 and, for the second part of the interval, to
+fort.14. `read_table` parses both files once into a structured array, sorted
+by wavelength, so lines can be selected by strength and wavelength without
+going through the text again.
+
+Example
+-------
+
+::
+
+    syn = Synplot(20000, 4, wstart=4460, wend=4480)
+    syn.run()
+    lines = select(syn.line_table(), min_strength=50, wstart=4465)
+    lines['wave'], labels(lines)
+"""
+import os
+import re
+import numpy as np
+
+
+# Wavelength, species, ionization stage and equivalent width (mA) of a line
+LINE_PATTERN = re.compile(
+    r'(\d{4}\.\d{3})\s+(\w{1,2})\s+(I*V*I*).+(\b\d+\.\d)\s+(\*+)')
+
+TABLE_DTYPE = [('wave', 'f8'), ('species', 'S2'), ('ion', 'S4'),
+               ('strength', 'f8')]
+
+# Files of the identification tables
+TABLE_FILES = ['fort.12', 'fort.14']
+
+
+def parse_table(text):
+    """
+    Parse a line identification table.
+
+    Parameters
+    ----------
+
+    text: str;
+        Content of fort.12 and/or fort.14.
+
+    Returns
+    -------
+
+    numpy.ndarray;
+        Structured array with the `wave`, `species`, `ion` and `strength`
+        (equivalent width, in mA) of each line, sorted by wavelength.
+    """
+    rows = [(wave, species, ion, strength) for wave, species, ion, strength, _
+            in LINE_PATTERN.findall(text)]
+    table = np.array(rows, dtype=TABLE_DTYPE)
+
+    return table[np.argsort(table['wave'], kind='mergesort')]
+
+
+def read_table(path):
+    """
+    Read the line identification tables of a directory. Missing tables are
+    skipped.
+
+    Parameters
+    ----------
+
+    path: str;
+        Directory in which Synspec ran.
+    """
+    text = ''
+    for name in TABLE_FILES:
+        fname = os.path.join(path, name)
+        if os.path.isfile(fname):
+            with open(fname) as infile:
+                text += infile.read()
+
+    return parse_table(text)
+
+
+def select(table, min_strength=0., wstart=None, wend=None):
+    """
+    Select the lines of a table.
+
+    Parameters
+    ----------
+
+    table: numpy.ndarray;
+        Table, as returned by `parse_table`.
+
+    min_strength: float (optional);
+        Minimum equivalent width, in mA.
+
+    wstart, wend: float (optional);
+        Wavelength interval. The default is the whole table.
+
+    Returns
+    -------
+
+    numpy.ndarray;
+        The selected rows, sorted by wavelength.
+    """
+    first = 0 if wstart is None else \
+            np.searchsorted(table['wave'], wstart, side='left')
+    last = len(table) if wend is None else \
+           np.searchsorted(table['wave'], wend, side='right')
+    table = table[first:last]
+
+    return table[table['strength'] >= min_strength]
+
+
+def labels(table):
+    """
+    Labels of the lines of a table, e.g., 'He I 4471.473  180.5', as used
+    by `plottools.plot_line_ids`.
+    """
+    return ['{} {:.3f}  {:.1f}'.format(' '.join(filter(None, [species, ion])),
+                                       wave, strength)
+            for wave, species, ion, strength in table]
@@ -0,0 +1,282 @@
+"""
+An index of the line list (fort.19) to give Synspec only the lines it needs.
+
+Synspec reads the whole line list on every run, even for a window of a few
+angstroms. `LineIndex` keeps the wavelength, the element code and the byte
+offset of each line of the list, so the lines of a window are copied with a
+single read. Lines of hydrogen and helium, whose wings reach far from their
+centres, are always kept.
+
+The index is built once and saved next to the list, e.g., `fort.19.index.npy`,
+and memory-mapped on the next uses. It is rebuilt when the list changes.
+
+Example
+-------
+
+::
+
+    index = open_index('~/.s4/synthesis/synplot/fort.19')
+    index.write_window(4460, 4480, 'workspace/fort.19')
+"""
+import os
+import threading
+import numpy as np
+
+
+# Margin, in angstroms, around the synthesis window of the lines given to
+# Synspec.
+LINE_MARGIN = 10.
+
+# Elements whose lines are always given to Synspec.
+WIDE_ELEMENTS = [1, 2]
+
+INDEX_DTYPE = [('wave', 'f8'), ('element', 'f8'), ('offset', 'i8')]
+
+# Open indexes by real path of the line list.
+_INDEXES = {}
+_INDEXES_LOCK = threading.Lock()
+
+
+def index_name(linelist):
+    """Name of the index file of a line list."""
+    return linelist + '.index.npy'
+
+
+def has_continuation(tokens):
+    """
+    Check if the record of a line, split in tokens, is followed by a
+    continuation record, i.e., if its INEXT is not zero.
+    """
+    try:
+        return len(tokens) > 10 and float(tokens[10]) != 0
+    except ValueError:
+        return False
+
+
+def line_records(lines):
+    """
+    Group the lines of a line list in records: each line of the list with
+    its continuation record, if any.
+
+    Returns
+    -------
+
+    list;
+        The text of each record.
+    """
+    records = []
+    continuation = False
+    for line in lines:
+        if continuation:
+            records[-1] += line
+            continuation = False
+            continue
+        records.append(line)
+        continuation = has_continuation(line.split())
+
+    return records
+
+
+def build_index(linelist):
+    """
+    Index a line list.
+
+    Each line of a line list starts with the wavelength, in nm, and the code
+    of the element and ion, e.g., `447.1473  2.00`. If its eleventh value,
+    INEXT, is not zero, the next record, also numeric, is a continuation of
+    the line. Continuation records and lines that do not start with a number
+    get the wavelength of their line, so windows never split them from it.
+
+    Parameters
+    ----------
+
+    linelist: str;
+        Name of the line list.
+
+    Returns
+    -------
+
+    numpy.ndarray;
+        Wavelength, in angstroms, element code and byte offset of each line,
+        plus a last row with the size of the file.
+    """
+    with open(linelist, 'rb') as infile:
+        lines = infile.read().splitlines(True)
+
+    index = np.zeros(len(lines) + 1, dtype=INDEX_DTYPE)
+    wave = element = np.inf
+    continuation = False
+    for n, line in enumerate(lines):
+        if continuation:
+            # Record of the previous line
+            continuation = False
+            index[n] = wave, element, 0
+            continue
+
+        tokens = line.split()
+        try:
+            wave = float(tokens[0]) * 10.
+            element = float(tokens[1])
+        except (IndexError, ValueError):
+            # Continuation or blank line
+            pass
+        else:
+            continuation = has_continuation(tokens)
+        index[n] = wave, element, 0
+
+    index['offset'][1:] = np.cumsum([len(line) for line in lines])
+    index[-1] = np.inf, 0, index['offset'][-1]
+
+    return index
+
+
+def open_index(linelist):
+    """
+    Obtain the index of a line list, building and saving it if needed.
+    Indexes are opened only once per process.
+
+    Returns
+    -------
+
+    LineIndex;
+        The index of the line list.
+    """
+    linelist = os.path.realpath(os.path.expanduser(linelist))
+    stat = os.stat(linelist)
+    version = (stat.st_size, stat.st_mtime)
+
+    with _INDEXES_LOCK:
+        if linelist in _INDEXES and _INDEXES[linelist][0] == version:
+            return _INDEXES[linelist][1]
+
+    index = LineIndex(linelist)
+
+    with _INDEXES_LOCK:
+        _INDEXES[linelist] = (version, index)
+
+    return index
+
+
+class LineIndex(object):
+    """
+    The index of a line list.
+
+    Parameters
+    ----------
+
+    linelist: str;
+        Name of the line list.
+
+    Attributes
+    ----------
+
+    waves: numpy.ndarray;
+        Wavelength of each line, in angstroms.
+
+    is_sorted: bool;
+        If the wavelengths are increasing. Windows can only be taken from
+        sorted lists.
+    """
+
+    def __init__(self, linelist):
+        self.linelist = linelist
+        self.index = self._load()
+        self.waves = self.index['wave'][:-1]
+        self.is_sorted = bool(np.all(np.diff(self.waves) >= 0))
+        self.wide = np.flatnonzero(np.in1d(
+            np.floor(self.index['element'][:-1]), WIDE_ELEMENTS))
+
+
+    def _load(self):
+        """Load the saved index, or build and try to save it."""
+        fname = index_name(self.linelist)
+        size = os.path.getsize(self.linelist)
+        if os.path.isfile(fname) and \
+           os.path.getmtime(fname) >= os.path.getmtime(self.linelist):
+            index = np.load(fname, mmap_mode='r')
+            if index['offset'][-1] == size:
+                return index
+
+        index = build_index(self.linelist)
+
+        # Write a temporary file and rename it, so readers never see an
+        # incomplete index. A read-only directory keeps it in memory.
+        tmp_name = fname + '.{}.tmp'.format(os.getpid())
+        try:
+            with open(tmp_name, 'wb') as out:
+                np.save(out, index)
+            os.rename(tmp_name, fname)
+        except (IOError, OSError):
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+
+        return index
+
+
+    def __len__(self):
+        return len(self.waves)
+
+
+    def limits(self):
+        """Shortest and longest wavelength of the list, in angstroms."""
+        waves = self.waves[np.isfinite(self.waves)]
+        return waves.min(), waves.max()
+
+
+    def window(self, wstart, wend, margin=LINE_MARGIN):
+        """
+        Select the lines of a window.
+
+        Parameters
+        ----------
+
+        wstart, wend: float;
+            Wavelength interval, in angstroms.
+
+        margin: float (optional);
+            Margin, in angstroms, around the interval.
+
+        Returns
+        -------
+
+        list;
+            (first, last) byte of each block of lines to be read, in the order
+            of the list.
+        """
+        if not self.is_sorted:
+            raise ValueError("Line list '{}' is not sorted.".format(
+                self.linelist))
+
+        first = np.searchsorted(self.waves, wstart - margin, side='left')
+        last = np.searchsorted(self.waves, wend + margin, side='right')
+
+        # The lines of elements with wide wings, out of the window
+        blocks = [(row, row + 1) for row in
+                  self.wide[(self.wide < first) | (self.wide >= last)]]
+        if last > first:
+            blocks = sorted(blocks + [(first, last)])
+
+        offsets = self.index['offset']
+        return [(offsets[start], offsets[end]) for start, end in blocks]
+
+
+    def write_window(self, wstart, wend, destination, margin=LINE_MARGIN):
+        """
+        Write the lines of a window to a new line list. See `window` for the
+        parameters.
+
+        Returns
+        -------
+
+        int;
+            Number of bytes written.
+        """
+        size = 0
+        with open(self.linelist, 'rb') as infile:
+            with open(destination, 'wb') as out:
+                for start, end in self.window(wstart, wend, margin):
+                    infile.seek(start)
+                    out.write(infile.read(end - start))
+                    size += end - start
+
+        return size
@@ -0,0 +1,281 @@
+"""
+Pre-screening of the line list by the strength of the lines.
+
+Synspec rejects a line only after evaluating it at the standard depth, where
+its opacity is compared with `strength` times the continuum. This module
+does a cheap estimate of the same quantity before Synspec runs, for the
+interpolated model atmosphere, and drops the lines that are much weaker than
+the strongest line of the list.
+
+The strength of a line is estimated as the number of absorbers in its lower
+level per hydrogen atom times its oscillator strength,
+
+    log S = log gf + (log eps - 12) + log f_ion - E_low / kT,
+
+where the ionization fraction, f_ion, is given by the Saha equation with the
+temperature and the electron density of the standard depth and unit
+partition functions. It is a rough estimate, so the default threshold keeps
+lines a million times weaker than the strongest one; `Synplot.screening_error`
+measures the effect of a threshold on the spectrum.
+
+Lines of hydrogen and helium are never dropped. A line and its continuation
+record are kept or dropped together.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from ..io import specio
+import atmosphere
+from linelist import WIDE_ELEMENTS, line_records
+
+
+# Lines weaker than this fraction of the strongest line are dropped.
+SCREEN_THRESHOLD = 1e-6
+
+# Boltzmann constant in eV/K
+BOLTZMANN = 8.617333e-5
+
+# Conversion from cm^-1 to eV
+CM_TO_EV = 1. / 8065.544
+
+# Saha constant, in cm^-3 K^-3/2, including the factor 2 of the electron
+SAHA = 4.8293e15
+
+# Solar abundances, log eps with H = 12, of H to Zn (Asplund et al. 2009)
+SOLAR_ABUNDANCES = [12.00, 10.93, 1.05, 1.38, 2.70, 8.43, 7.83, 8.69, 4.56,
+                    7.93, 6.24, 7.60, 6.45, 7.51, 5.41, 7.12, 5.50, 6.40,
+                    5.03, 6.34, 3.15, 4.95, 3.93, 5.64, 5.43, 7.50, 4.99,
+                    6.22, 4.19, 4.56]
+
+# Ionization energies, in eV, of the first ions of the most abundant elements
+IONIZATION = {1: [13.598],
+              2: [24.587, 54.418],
+              6: [11.260, 24.383, 47.888, 64.494],
+              7: [14.534, 29.601, 47.449, 77.474],
+              8: [13.618, 35.121, 54.936, 77.414],
+              10: [21.565, 40.963, 63.450, 97.120],
+              11: [5.139, 47.286],
+              12: [7.646, 15.035, 80.144],
+              13: [5.986, 18.829, 28.448, 119.99],
+              14: [8.152, 16.346, 33.493, 45.142],
+              15: [10.487, 19.769, 30.203, 51.444],
+              16: [10.360, 23.338, 34.790, 47.222],
+              18: [15.760, 27.630, 40.735, 59.690],
+              19: [4.341, 31.630],
+              20: [6.113, 11.872, 50.913],
+              22: [6.828, 13.576, 27.492, 43.267],
+              24: [6.767, 16.486, 30.960, 49.160],
+              25: [7.434, 15.640, 33.668, 51.200],
+              26: [7.902, 16.199, 30.652, 54.800],
+              28: [7.640, 18.169, 35.190, 54.900]}
+
+# Number of screened line lists kept in memory.
+MEMO_SIZE = 32
+_SCREENED = OrderedDict()
+_SCREENED_LOCK = threading.Lock()
+
+
+def ionization_fractions(element, temperature, electron_density):
+    """
+    Fraction of the atoms of an element in each ionization stage, by the
+    Saha equation with unit partition functions.
+
+    Returns
+    -------
+
+    numpy.ndarray;
+        Fraction of neutral atoms, first ions, etc. Elements without
+        ionization energies are assumed to be mostly in the second and third
+        stages.
+    """
+    energies = IONIZATION.get(element)
+    if energies is None:
+        return np.array([0.01, 0.5, 0.49])
+
+    kt = BOLTZMANN * temperature
+    ratios = SAHA * temperature**1.5 / electron_density * \
+             np.exp(-np.array(energies) / kt)
+    # Logarithm of the population of each stage relative to the neutral one
+    log_pops = np.concatenate([[0.], np.cumsum(np.log(ratios))])
+    pops = np.exp(log_pops - log_pops.max())
+
+    return pops / pops.sum()
+
+
+def standard_depth(params, teff):
+    """
+    Index of the standard depth of a model, as in `synplot.pro`: the deepest
+    one cooler than the effective temperature.
+    """
+    cooler = np.nonzero(params[:, 0] < teff)[0]
+    return cooler[-1] if len(cooler) else len(params) // 2
+
+
+def abundances(abund=None, metal=None):
+    """
+    Abundances, log eps, of H to Zn.
+
+    Parameters
+    ----------
+
+    abund: list (optional);
+        Abundance changes as (first atomic number, last atomic number, log
+        eps) triads, as returned by `engine.parse_abund`.
+
+    metal: float (optional);
+        Metallicity, added to the solar abundances of the metals.
+    """
+    values = np.array(SOLAR_ABUNDANCES)
+    if metal is not None:
+        values[2:] += float(metal)
+    for first, last, abun in abund or []:
+        values[first - 1:last] = abun
+    return values
+
+
+def line_strengths(lines, temperature, electron_density, log_eps):
+    """
+    Estimate the strength of lines.
+
+    Parameters
+    ----------
+
+    lines: list;
+        Lines of the line list (fort.19), each with its continuation record,
+        as returned by `linelist.line_records`.
+
+    temperature, electron_density: float;
+        Temperature (K) and electron density (cm^-3) of the standard depth.
+
+    log_eps: numpy.ndarray;
+        Abundances of H to Zn, as returned by `abundances`.
+
+    Returns
+    -------
+
+    numpy.ndarray;
+        Logarithm of the estimated strength of each line. Lines that can not
+        be parsed have an infinite strength, so they are kept.
+    """
+    strengths = np.empty(len(lines))
+    fractions = {}
+    kt = BOLTZMANN * temperature
+    for n, line in enumerate(lines):
+        try:
+            _, code, loggf, elow = line.split(None, 4)[:4]
+            code = float(code)
+            element = int(code)
+            stage = int(round((code - element) * 100))
+            loggf = float(loggf)
+            elow = abs(float(elow)) * CM_TO_EV
+        except ValueError:
+            strengths[n] = np.inf
+            continue
+
+        if element < 1:
+            strengths[n] = np.inf
+            continue
+
+        if element not in fractions:
+            fractions[element] = ionization_fractions(element, temperature,
+                                                      electron_density)
+        if element > len(log_eps) or element in WIDE_ELEMENTS or \
+           stage >= len(fractions[element]):
+            strengths[n] = np.inf
+            continue
+
+        with np.errstate(divide='ignore'):
+            strengths[n] = loggf + log_eps[element - 1] - 12. + \
+                           np.log10(fractions[element][stage]) - \
+                           elow / kt / np.log(10.)
+
+    return strengths
+
+
+def screen_lines(lines, strengths, threshold=SCREEN_THRESHOLD):
+    """
+    Select the lines stronger than `threshold` times the strongest line.
+
+    Returns
+    -------
+
+    kept: list;
+        The selected lines, in the same order.
+
+    dropped: int;
+        Number of dropped lines.
+    """
+    finite = strengths[np.isfinite(strengths)]
+    if len(finite) == 0:
+        return list(lines), 0
+
+    keep = strengths >= finite.max() + np.log10(threshold)
+    kept = [line for line, flag in zip(lines, keep) if flag]
+
+    return kept, len(lines) - len(kept)
+
+
+def screened_list(fort19, teff, logg, path, abund=None, metal=None,
+                  threshold=SCREEN_THRESHOLD):
+    """
+    Drop the weak lines of a line list for a model atmosphere of the grid.
+
+    The result is memoized per (content of the line list, grid path,
+    atmosphere, threshold).
+
+    Parameters
+    ----------
+
+    fort19: str;
+        Content of the line list.
+
+    teff, logg: float;
+        Parameters of the interpolated model atmosphere.
+
+    path: str;
+        Directory to which the grids are relative, as in
+        `atmosphere.model_files`.
+
+    abund, metal: optional;
+        As in `abundances`.
+
+    threshold: float (optional);
+        Lines weaker than this fraction of the strongest one are dropped.
+
+    Returns
+    -------
+
+    content: str;
+        The screened line list.
+
+    dropped: int;
+        Number of dropped lines.
+    """
+    memo_key = (hashlib.sha1(fort19).hexdigest(), path, float(teff),
+                float(logg), None if metal is None else float(metal),
+                tuple(tuple(item) for item in abund or []), float(threshold))
+    with _SCREENED_LOCK:
+        if memo_key in _SCREENED:
+            _SCREENED[memo_key] = _SCREENED.pop(memo_key)
+            return _SCREENED[memo_key]
+
+    fort7, _ = atmosphere.model_files(teff, logg, path, metal)
+    header, body = fort7.split('\n', 1)
+    nd, npar = [int(i) for i in header.split()[:2]]
+    values = specio.parse_values(body)
+    params = values[nd:nd + nd * npar].reshape(nd, npar)
+    depth = standard_depth(params, teff)
+
+    lines = line_records(fort19.splitlines(True))
+    strengths = line_strengths(lines, params[depth, 0], params[depth, 1],
+                               abundances(abund, metal))
+    kept, dropped = screen_lines(lines, strengths, threshold)
+    result = (''.join(kept), dropped)
+
+    with _SCREENED_LOCK:
+        _SCREENED[memo_key] = result
+        while len(_SCREENED) > MEMO_SIZE:
+            _SCREENED.popitem(last=False)
+
+    return result
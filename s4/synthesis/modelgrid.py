@@ -0,0 +1,248 @@
+"""
+A pre-parsed binary store of a grid of model atmospheres.
+
+Reading the `.7` files of the BSTAR2006 grid means parsing about 140 MB of
+text with Fortran `D` exponents. `pack_grid` converts the whole grid, once,
+into a single NumPy file with the logarithm of the column masses and of the
+model parameters, plus a small index file with the (teff, logg) of each
+model. `ModelGrid` memory-maps it, so models are zero-copy views and several
+processes share the same pages.
+
+The store is written next to the grid, e.g., `bstar2006/BG.grid.npy` and
+`bstar2006/BG.index.npy`, and is used by `atmosphere` when it exists.
+
+Example
+-------
+
+::
+
+    pack_grid('~/.s4/synthesis/bstar2006/BG')
+    grid = ModelGrid('~/.s4/synthesis/bstar2006/BG')
+    log_dm, log_params = grid.interpolate(20400, 4.1)
+
+It can also be run from the command line:
+
+    python -m s4.synthesis.modelgrid ~/.s4/synthesis/bstar2006/BG
+"""
+import os
+import sys
+import threading
+from glob import glob
+import numpy as np
+
+
+# Smallest value of a model parameter, as in intrpmod.pro
+MIN_VALUE = 1e-35
+
+# Open stores by core name of the grid.
+_GRIDS = {}
+_GRIDS_LOCK = threading.Lock()
+
+
+def store_names(grid):
+    """Names of the data and index files of the store of a grid."""
+    return grid + '.grid.npy', grid + '.index.npy'
+
+
+def grid_node(teff, logg):
+    """Key of a model of the grid, avoiding rounding errors on log g."""
+    return int(round(teff)), int(round(logg * 100.))
+
+
+def pack_grid(grid):
+    """
+    Convert the `.7` files of a grid of model atmospheres to a binary store.
+
+    Parameters
+    ----------
+
+    grid: str;
+        Core name of the grid, e.g., `~/.s4/synthesis/bstar2006/BG`.
+
+    Returns
+    -------
+
+    n: int;
+        Number of models in the store.
+    """
+    # Import here, as atmosphere imports this module.
+    import atmosphere
+
+    grid = os.path.expanduser(grid)
+    fnames = sorted(glob(grid + '*g*v2.7'))
+    if fnames == []:
+        raise IOError("No model found for grid '{}'.".format(grid))
+
+    shape = atmosphere.read_model(fnames[0])[1].shape
+    data_name, index_name = store_names(grid)
+
+    # Write to temporary files and rename them, so readers never see an
+    # incomplete store.
+    tmp_data = data_name + '.{}.tmp'.format(os.getpid())
+    tmp_index = index_name + '.{}.tmp'.format(os.getpid())
+    data = np.lib.format.open_memmap(tmp_data, mode='w+', dtype=np.float64,
+                                     shape=(len(fnames), shape[0],
+                                            shape[1] + 1))
+    index = np.empty((len(fnames), 2))
+    try:
+        for n, fname in enumerate(fnames):
+            dm, params = atmosphere.read_model(fname)
+            if params.shape != shape:
+                raise ValueError("Model '{}' has shape {} instead of {}."
+                                 .format(fname, params.shape, shape))
+            data[n, :, 0] = np.log10(dm)
+            data[n, :, 1:] = np.log10(np.maximum(params, MIN_VALUE))
+            index[n] = atmosphere.model_parameters(fname[:-2])
+        data.flush()
+        del data
+        with open(tmp_index, 'wb') as out:
+            np.save(out, index)
+        os.rename(tmp_data, data_name)
+        os.rename(tmp_index, index_name)
+    finally:
+        for fname in [tmp_data, tmp_index]:
+            if os.path.exists(fname):
+                os.remove(fname)
+
+    with _GRIDS_LOCK:
+        _GRIDS.pop(os.path.realpath(grid), None)
+
+    return len(fnames)
+
+
+def open_grid(grid):
+    """
+    Obtain the store of a grid, if it exists. Stores are opened only once per
+    process.
+
+    Returns
+    -------
+
+    ModelGrid or None;
+        The store, or None if the grid was not packed.
+    """
+    grid = os.path.realpath(os.path.expanduser(grid))
+
+    with _GRIDS_LOCK:
+        if grid in _GRIDS:
+            return _GRIDS[grid]
+
+    if all(os.path.isfile(fname) for fname in store_names(grid)):
+        store = ModelGrid(grid)
+    else:
+        store = None
+
+    with _GRIDS_LOCK:
+        _GRIDS[grid] = store
+
+    return store
+
+
+class ModelGrid(object):
+    """
+    A memory-mapped grid of model atmospheres created by `pack_grid`.
+
+    Parameters
+    ----------
+
+    grid: str;
+        Core name of the grid.
+
+    Attributes
+    ----------
+
+    data: numpy.memmap;
+        Logarithm of the models with shape (number of models, number of
+        depths, 1 + number of parameters). The first column is the column
+        mass.
+
+    nodes: numpy.ndarray;
+        Effective temperature and surface gravity of each model.
+    """
+
+    def __init__(self, grid):
+        self.grid = os.path.expanduser(grid)
+        data_name, index_name = store_names(self.grid)
+        self.data = np.load(data_name, mmap_mode='r')
+        self.nodes = np.load(index_name)
+        self._index = {grid_node(teff, logg): n
+                       for n, (teff, logg) in enumerate(self.nodes)}
+
+
+    def __len__(self):
+        return len(self.nodes)
+
+
+    def __contains__(self, node):
+        return grid_node(*node) in self._index
+
+
+    def log_model(self, teff, logg):
+        """
+        Obtain a model of the grid.
+
+        Returns
+        -------
+
+        log_dm: numpy.ndarray;
+            Logarithm of the column mass at each depth.
+
+        log_params: numpy.ndarray;
+            Logarithm of the model parameters with shape (number of depths,
+            number of parameters).
+
+        Both are read-only views of the store.
+        """
+        model = self.data[self._index[grid_node(teff, logg)]]
+        return model[:, 0], model[:, 1:]
+
+
+    def covers(self, teff, logg):
+        """Check if the four models that bracket `teff` and `logg` exist."""
+        tef1 = int(teff) // 1000 * 1000
+        g1 = int(logg * 100.) // 25 * 25
+        return all(grid_node(tl, gl * 1e-2) in self._index
+                   for tl in [tef1, tef1 + 1000]
+                   for gl in [g1, g1 + 25])
+
+
+    def interpolate(self, teff, logg):
+        """
+        Interpolate the grid in log space, as `intrpmod.pro`.
+
+        Returns
+        -------
+
+        log_dm: numpy.ndarray;
+            Logarithm of the column mass at each depth.
+
+        log_params: numpy.ndarray;
+            Logarithm of the model parameters with shape (number of depths,
+            number of parameters).
+        """
+        tef1 = int(teff) // 1000 * 1000
+        g1 = int(logg * 100.) // 25 * 25
+        try:
+            models = [self.data[self._index[grid_node(tl, gl * 1e-2)]]
+                      for tl in [tef1, tef1 + 1000]
+                      for gl in [g1, g1 + 25]]
+        except KeyError:
+            raise ValueError('teff and log g out of the grid')
+
+        # Interpolation in log g for the low and high Teff, and then in Teff
+        a1 = (g1 + 25 - logg * 100.) / 25.
+        low = a1 * models[0] + (1. - a1) * models[1]
+        high = a1 * models[2] + (1. - a1) * models[3]
+
+        a3 = (np.log10(tef1 + 1000) - np.log10(teff)) / \
+             (np.log10(tef1 + 1000) - np.log10(tef1))
+        model = a3 * low + (1. - a3) * high
+
+        return model[:, 0], model[:, 1:]
+
+
+if __name__ == '__main__':
+    # Use the module of the package, whose imports work.
+    from s4.synthesis.modelgrid import pack_grid as pack
+    for core in sys.argv[1:]:
+        print '{}: {} models packed.'.format(core, pack(core))
@@ -28,15 +28,9 @@ from_synplot:
         Chemical element. Can be its symbol or its atomic number.
 
 """
-import os
-import json
 import re
 import numpy as np
-
-
-# Loads the chemical elements and their atomic numbers
-PERIODIC = json.load(open(os.getenv('HOME')+'/.s4/extra_resc'+\
-                          '/chemical_elements.json'))
+from ..utils.elements import periodic_table, element_symbols
 
 
 
@@ -88,7 +82,8 @@ class Synplot_abund():
 
         # If the chemical element is identified with its symbol, swap to the
         #atomic number
-        self.abundance = {PERIODIC[key]:val
+        periodic = periodic_table()
+        self.abundance = {periodic[key]:val
                          for key, val in self.abundance.iteritems()}
 
         try:
@@ -112,8 +107,8 @@ class Synplot_abund():
         Gets the abundance of a desired chemical element from a string of
         abundances in the SYNPLOT format.
         """
-        # Reverse the Periodica Table
-        reverse_periodic = {val:key for key, val in PERIODIC.iteritems()}
+        periodic = periodic_table()
+        reverse_periodic = element_symbols()
 
         # Check if `element` is a list. If not, turn it into one
         if not isinstance(element, list):
@@ -130,7 +125,7 @@ class Synplot_abund():
                 element_symbol.append(reverse_periodic[elem])
             elif isinstance(elem, str):
                 # It is a chemical element symvol
-                atom_number.append(str(PERIODIC[elem]))
+                atom_number.append(str(periodic[elem]))
                 element_symbol.append(elem)
             else:
                 raise TypeError('The variable `element` should be a string ' +\
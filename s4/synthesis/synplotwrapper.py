@@ -10,60 +10,245 @@ abund: str, dic (optional);
 """
 #=============================================================================
 # Modules
-import shutil
 import numpy as np
 import os
-import matplotlib.pyplot as plt
-import re
-from ..spectools import rvcorr
-from ..utils import File
+import copy
+import json
+import shutil
+import tempfile
+import traceback
+import multiprocessing as mp
+from ..spectools import rvcorr, broadening
 from ..plottools import plot_windows, plot_line_ids
 from ..io import specio, wrappers
 from synplot_abund import Synplot_abund
+from workspace import Workspace
+from engine import SynspecEngine, parse_abund
+from cache import SpectrumCache, cache_key, normalize_value, dependencies, \
+    file_hash, POSTPROCESS_KEYS
+from timings import Timings, command_stage, written_files, bytes_written, \
+    file_bytes, input_files, bytes_read
+from gdlpool import GDLSessionError, GDLSessionTimeout
+import atmosphere
+import chunking
+import linelist
+import linestrength
+import lineid
+import jobs
 #=============================================================================
 
+# Parameters used only by the convolution and normalization of the spectrum.
+# When only these and `cache.POSTPROCESS_KEYS`, applied by `apply_scale` and
+# `plot`, change, Synspec does not run again.
+CONVOLUTION_KEYS = ['vrot', 'vmac_rt', 'vmac_iso', 'fwhm', 'steprot',
+                    'stepins', 'relative']
+
+# Output files of Synspec kept to convolve its spectrum again
+UNCONVOLVED_FILES = ['fort.7', 'fort.17', 'fort.12', 'fort.14']
+
 
 
 class Synplot:
-    """Add docstring"""
+    """
+    Wrapper to Synplot.
+
+    Each run is done in its own `Workspace`, a temporary directory with links
+    to the read-only files in `synplot_path`, so several instances can run at
+    the same time. The workspace of the last run is kept, so its files can be
+    inspected (e.g., by `lineid_select`), until the next run or until
+    `cleanup` is called.
+
+    The wall and CPU time, bytes read and written and cache hits of each
+    stage of the last run are on `timings`.
+
+    Parameters
+    ----------
+
+    teff: float;
+        Effective temperature.
+
+    logg: float;
+        Surface gravity.
+
+    synplot_path: str (optional);
+        Path to the Synplot directory. The default is
+        `~/.s4/synthesis/synplot/`.
+
+    idl: bool (optional);
+        If True, runs Synplot with IDL instead of GDL.
+
+    backend: str (optional);
+        Software used to calculate the spectrum. One of 'gdl' and 'idl', to
+        run `synplot.pro`, or 'python', to run Synspec and Rotin3 directly
+        with `SynspecEngine`. The default is 'idl' if `idl` is True or 'gdl'
+        otherwise.
+
+    pool: GDLPool (optional);
+        A pool of persistent GDL/IDL sessions. If set, `synplot.pro` is run on
+        one of its sessions instead of on a new interpreter, with the same
+        `timeout` and `retries`.
+
+    cache: SpectrumCache, bool (optional);
+        A cache of synthetic spectra. If True, the default cache on
+        `~/.s4/cache` is used. Runs with the same parameters and input files
+        are read from the cache instead of being calculated.
+
+    tmpdir: str (optional);
+        Directory in which the workspaces will be created. The default is the
+        system temporary directory.
+
+    interpolate: bool (optional);
+        If True, the model atmosphere is interpolated in Python and given to
+        `synplot.pro` as `atmos`, instead of being interpolated by
+        `intrpmod.pro` and `intrpmet.pro`. If the grid does not cover the
+        parameters, `synplot.pro` interpolates it. The default is True.
+
+    convolution: str (optional);
+        Software used for the rotational, macroturbulent and instrumental
+        convolution. One of 'rotin3' and 'python', which uses
+        `spectools.broadening` on the unconvolved spectrum. With 'python', a
+        run with `norun` and the unconvolved spectrum staged does not run
+        any external program. The default is 'rotin3'.
+
+    timeout: float (optional);
+        Maximum time, in seconds, of each external program. A program that
+        does not finish in time is killed, with its children, and
+        `wrappers.CommandTimeout` is raised. The default is None, i.e., no
+        limit.
+
+    retries: int (optional);
+        Number of times an external program that does not finish in time is
+        run again. The default is 0. Only timeouts are retried: GDL and IDL
+        do not return a non-zero status when synplot.pro fails, so a crashed
+        run is only noticed when its spectrum is missing and raises
+        IOError.
+
+    max_output: int (optional);
+        Maximum number of bytes kept of the output of each external program.
+        Only the last bytes are kept. The default is 1 MB.
+
+    chunks: int (optional);
+        If greater than 1, `run` splits the interval into this number of
+        chunks, padded by `chunking.padding`, calculates them in parallel
+        with `run_many` and stitches them back. Then there is no workspace
+        nor log and `eqw` is None. The default is None, i.e., a single run.
+
+    workers: int (optional);
+        Number of processes of a chunked run. The default is the number of
+        chunks.
+
+    line_margin: float (optional);
+        Synspec is given only the lines of the line list within this margin,
+        in angstroms, of the interval, plus all hydrogen and helium lines,
+        using a `linelist.LineIndex`. The margin is never less than `cutoff`.
+        If None, it reads the whole list. The default is
+        `linelist.LINE_MARGIN`.
+
+    screen_threshold: float (optional);
+        If set, the lines estimated by `linestrength` to be weaker than this
+        fraction of the strongest line, for the interpolated model
+        atmosphere, are dropped before running Synspec. The number of
+        dropped lines is on `lines_dropped` and `screening_error` measures
+        the effect on the spectrum. The default is None, i.e., no screening.
+
+    reconvolve: bool (optional);
+        If True, the unconvolved spectrum of the last synthesis is kept and,
+        when only `CONVOLUTION_KEYS` and `POSTPROCESS_KEYS` of `parameters`
+        change, the next run only convolves it again. If only
+        `POSTPROCESS_KEYS` change, the spectrum is not calculated at all.
+        A change of the line list or of the model atmospheres is always
+        calculated again. See `reuse_mode`. The default is True.
+
+    kwargs:
+        Synplot parameters. `observ`, the observed spectrum to be plotted,
+        is a file name or an array with its wavelength and flux.
+    """
 
     def __init__(self, teff, logg, synplot_path = None, idl = False,
-                 **kwargs):
+                 tmpdir = None, backend = None, pool = None, cache = None,
+                 interpolate = True, convolution = 'rotin3', timeout = None,
+                 retries = 0, max_output = 2**20, chunks = None,
+                 workers = None, line_margin = linelist.LINE_MARGIN,
+                 screen_threshold = None, reconvolve = True, **kwargs):
         if synplot_path is None:
             self.spath = os.getenv('HOME')+'/.s4/synthesis/synplot/'
         else:
             self.spath = synplot_path
 
+        self.tmpdir = tmpdir
+
         # Set software to run Synplot.pro
-        if idl:
-            self.software = 'idl'
-        else:
-            self.software = 'gdl'
+        if backend is None:
+            backend = 'idl' if idl else 'gdl'
+        if backend not in ['gdl', 'idl', 'python']:
+            raise ValueError("Unknown backend '{}'.".format(backend))
+        self.backend = backend
+        self.software = 'idl' if backend == 'idl' else 'gdl'
+        self.pool = pool
+        self.interpolate = interpolate
+
+        if convolution not in ['rotin3', 'python']:
+            raise ValueError("Unknown convolution '{}'.".format(convolution))
+        self.convolution = convolution
+
+        self.timeout = timeout
+        self.retries = retries
+        self.max_output = max_output
+        self.chunks = chunks
+        self.workers = workers
+        self.line_margin = line_margin
+        self.line_window = False
+        self.screen_threshold = screen_threshold
+        self.lines_dropped = None
+        self.reconvolve = reconvolve
+        self.reconvolving = False
+        self.last_run = None
+
+        if cache is True:
+            cache = SpectrumCache()
+        self.cache = cache or None
+        self.cache_hit = None
 
         # Setting teff and logg on the dictionary
         kwargs['teff'] = teff
         kwargs['logg'] = logg
 
+        # Check for line list
+        if 'linlist' in kwargs:
+            abspath = os.path.abspath(kwargs['linlist'])
+            if os.path.isfile(abspath):
+                kwargs['linlist'] = r"'{}'".format(abspath)
+                self.line_list = abspath
+            else:
+                raise IOError("File '{}' does not exist.".format(abspath))
+        else:
+            self.line_list = self.spath + 'fort.19'
+
         #Check if some params were defined
+        if 'wstart' not in kwargs.keys() or 'wend' not in kwargs.keys():
+            wmin, wmax = linelist.open_index(self.line_list).limits()
+
         if 'wstart' not in kwargs.keys():
-            kwargs['wstart'] = float(File(self.spath + 'fort.19').\
-                               head()[0].split()[0]) * 10
+            kwargs['wstart'] = wmin
             print 'wstart not defined.'
             print 'Setting as {:.2f} Angstrons.\n'.format(kwargs['wstart'])
 
         if 'wend' not in kwargs.keys():
-            kwargs['wend'] = float(File(self.spath + 'fort.19').\
-                               tail()[0].split()[0]) * 10
+            kwargs['wend'] = wmax
             print 'wend not defined.'
             print 'Setting as {:.2f} Angstrons.\n'.format(kwargs['wend'])
 
         self.parameters = kwargs
 
-        # Check if a observation spectrum is available
+        # Check if a observation spectrum is available. It can be a file
+        # name or an already loaded spectrum, which is not copied.
         if 'observ' in self.parameters:
-            self.observation = specio.load_spectrum(self.parameters['observ'])
             #Delete entry to not input in IDL
-            del self.parameters['observ']
+            observ = self.parameters.pop('observ')
+            if isinstance(observ, np.ndarray):
+                self.observation = observ
+            else:
+                self.observation = specio.load_spectrum(observ)
 
         #Override IDL plotting
         self.parameters['noplot'] = '1'
@@ -72,25 +257,66 @@ class Synplot:
         if 'relative' not in self.parameters:
             self.parameters['relative'] = 0
 
-        # Check for line list
-        if 'linlist' in self.parameters:
-            abspath = os.path.abspath(self.parameters['linlist'])
-            if os.path.isfile(abspath):
-                self.parameters['linlist'] = r"'{}'".format(abspath)
-            else:
-                raise IOError("File '{}' does not exist.".format(abspath))
-
         # Initizalize variable 'spectrum'
         self.spectrum = None
 
+        # Workspace of the last run and its output log
+        self.workspace = None
+        self.log = None
+        self.eqw = None
+        self.line_ids = None
+        self.timings = Timings()
+
 
     #=========================================================================
     #
-    def synplot_input(self):
-        """Build the synplot command to IDL/GDL."""
+    def synplot_input(self, path=None):
+        """
+        Build the synplot command to IDL/GDL.
+
+        Parameters
+        ----------
+
+        path: str (optional);
+            Directory in which Synplot will run. The default is the current
+            workspace, if there is one, or `synplot_path`.
+        """
+        cmd = ' & '.join(self.synplot_statements(path))
+
+        return self.software + ' -e "' + cmd + '"'
+
+    def synplot_statements(self, path=None, parameters=None):
+        """
+        Build the IDL statements that run synplot.
+
+        Parameters
+        ----------
+
+        path: str (optional);
+            Directory in which Synplot will run. The default is the current
+            workspace, if there is one, or `synplot_path`.
+
+        parameters: dict (optional);
+            Synplot parameters. The default is the parameters of this
+            instance.
+
+        Returns
+        -------
+
+        list;
+            The statements to change to the running directory and to call
+            synplot.
+        """
+        if path is None:
+            if self.workspace is not None:
+                path = self.workspace.path
+            else:
+                path = self.spath
 
         # Copy the parameters
-        parameters_copy = self.parameters.copy()
+        if parameters is None:
+            parameters = self.parameters
+        parameters_copy = parameters.copy()
         if 'abund' in parameters_copy:
             abund = Synplot_abund(parameters_copy['abund'])
             parameters_copy['abund'] = abund.to_synplot()
@@ -98,48 +324,679 @@ class Synplot:
         synplot_command = [key+' = '+str(value)                              \
                            for key, value in parameters_copy.iteritems()]
 
-        cmd = "CD, '"+self.spath+"' & synplot, "+ \
-                        ', '.join(synplot_command)
-
-        return self.software + ' -e "' + cmd + '"'
+        return ["CD, '"+path+"'", 'synplot, ' + ', '.join(synplot_command)]
     #=========================================================================
 
     #=========================================================================
     # Run synplot and return the computed spectra
-    def run(self):
-        """Run synplot and store the computed spectra"""
+    def run(self, stage=None):
+        """
+        Run synplot and store the computed spectra
 
-        # remove old calculated spectrum
-        # Stack Overflow #10840533
-        try:
-            os.remove((self.spath + 'fort.11'))
-        except OSError:
-            pass
+        Parameters
+        ----------
 
+        stage: dict (optional);
+            Files to be copied into the workspace before running, e.g.,
+            `{'fort.7': path_7, 'fort.17': path_17}` to only convolve an
+            already calculated spectrum.
+        """
+        if self.chunks > 1:
+            self.run_chunked(stage)
+        else:
+            jobs.run_steps(self.run_steps(stage), self.execute)
 
-        # Synplot erases the fort.19 (line list) if parameter `linlist` has
-        # been set.
-        # Thus, we will need to do a backup of the original and restore it
-        # after.
+    def run_chunked(self, stage=None):
+        """
+        Calculate the spectrum in `chunks` pieces in parallel. See `run` for
+        the parameters.
+        """
+        self.cleanup()
+        self.timings = Timings()
+        self.log = ''
+        self.eqw = None
+        self.line_ids = None
+
+        intervals = chunking.split_interval(float(self.parameters['wstart']),
+                                            float(self.parameters['wend']),
+                                            self.chunks,
+                                            chunking.padding(self.parameters))
+
+        kwargs = dict(self.parameters, synplot_path=self.spath,
+                      tmpdir=self.tmpdir, backend=self.backend,
+                      cache=self.cache, interpolate=self.interpolate,
+                      convolution=self.convolution, timeout=self.timeout,
+                      retries=self.retries, max_output=self.max_output,
+                      line_margin=self.line_margin,
+                      screen_threshold=self.screen_threshold)
+        # The constructor quotes the line list again
+        if 'linlist' in kwargs:
+            kwargs['linlist'] = kwargs['linlist'].strip("'")
+
+        with self.timings.measure('chunks'):
+            spectra, errors = Synplot.run_many(
+                [dict(wstart=start, wend=end, stage=stage)
+                 for _, _, start, end in intervals],
+                workers=self.workers or len(intervals), **kwargs)
+
+        for error in errors:
+            if error is not None:
+                raise RuntimeError('The synthesis of a chunk failed.\n' +
+                                   error)
+
+        self.spectrum = chunking.stitch(spectra, intervals)
+
+    def run_async(self, stage=None, scheduler=None, callback=None):
+        """
+        Run synplot without blocking. Chunked syntheses and syntheses on a
+        GDL `pool` can not, and raise ValueError.
 
-        if 'linlist' in self.parameters:
-            ## Make a backup of the original line list
-            shutil.copyfile(self.spath + '/fort.19', '/tmp/fort.19')
+        Parameters
+        ----------
 
+        stage: dict (optional);
+            As in `run`.
 
-        wrappers.run_command(self.synplot_input(), do_log = True)
+        scheduler: Scheduler (optional);
+            If set, the job is submitted to it.
+
+        callback: function (optional);
+            Called with the job when it finishes.
+
+        Returns
+        -------
+
+        Job;
+            The job, whose result is the computed spectrum. It can be
+            cancelled.
+        """
+        if self.chunks > 1:
+            raise ValueError('A chunked synthesis can not be run without '
+                             'blocking.')
+        if self.pool is not None and self.backend != 'python':
+            # The sessions of the pool are not driven by the scheduler
+            raise ValueError('A synthesis on a GDL pool can not be run '
+                             'without blocking.')
+        job = jobs.Job(self.run_steps(stage), result=lambda: self.spectrum,
+                       callback=callback, timeout=self.timeout,
+                       retries=self.retries)
+        if scheduler is not None:
+            scheduler.submit(job)
+        return job
+
+    def execute(self, command, cwd):
+        """Run a command of `run_steps`."""
+        return wrappers.run_command(command, cwd=cwd, timeout=self.timeout,
+                                    retries=self.retries,
+                                    max_output=self.max_output)
+
+    def run_steps(self, stage=None):
+        """
+        Generator of the commands of `run`. It yields (command, directory)
+        and the output of each command, (stdout, stderr), must be sent back.
+        """
 
-        if 'linlist' in self.parameters:
-            ## Make a backup of the original line list
-            shutil.copyfile('/tmp/fort.19', self.spath + '/fort.19')
+        self.timings = Timings()
+        mode = self.reuse_mode(stage)
+        if mode == 'spectrum':
+            # The spectrum and the workspace of the last run are still right
+            self.spectrum = self.last_run['spectrum']
+            self.timings.count('reused')
+            return
+
+        self.reconvolving = mode == 'convolution'
+        if self.reconvolving:
+            stage = self.last_run['files']
+            self.timings.count('reconvolved')
+        norun = 'norun' in self.parameters or self.reconvolving
+
+        self.line_window = False
+        self.lines_dropped = None
+        self.line_ids = None
+
+        # Start from a fresh workspace. The line list is linked in it, so the
+        # original fort.19 is never touched by Synplot.
+        self.cleanup()
+        with self.timings.measure('workspace') as io:
+            self.workspace = Workspace(self.spath, tmpdir=self.tmpdir)
+
+            if stage is not None:
+                self.workspace.stage(stage)
+                io['bytes_written'] = sum(os.path.getsize(fname)
+                                          for fname in stage.itervalues())
+
+        if self.cache is not None:
+            with self.timings.measure('cache') as io:
+                # A convolution again gives the spectrum of a full run
+                key = cache_key(self.cache_parameters(), self.spath,
+                                None if self.reconvolving else stage)
+                entry = self.cache.get(key)
+                self.cache_hit = entry is not None
+                if self.cache_hit:
+                    self.restore_cached(entry)
+                    io['bytes_read'] = self.spectrum.nbytes
+            self.timings.count('cache_hits' if self.cache_hit
+                               else 'cache_misses')
+            if self.cache_hit:
+                self.remember_run(stage)
+                return
+
+        if self.line_margin is not None and not norun:
+            with self.timings.measure('linelist') as io:
+                io['bytes_written'] = self.window_line_list()
+
+        if self.screen_threshold is not None and \
+           not norun and 'atmos' not in self.parameters:
+            with self.timings.measure('screening') as io:
+                io['bytes_written'] = self.screen_line_list()
+            if self.lines_dropped is not None:
+                self.timings.count('lines_dropped', self.lines_dropped)
 
         #load synthetized spectra
         try:
-            self.spectrum = specio.loadtxt_fast(self.spath + 'fort.11',
-                                                np.float)
-        except IOError:
+            if self.convolution == 'python' and norun and stage is not None:
+                # Only the convolution is needed
+                self.log = ''
+                steps = None
+            elif self.backend == 'python':
+                steps = self.engine_steps()
+            else:
+                steps = self.synplot_steps()
+
+            output = None
+            while steps is not None:
+                try:
+                    command = steps.send(output)
+                except StopIteration:
+                    break
+                before = written_files(command[1])
+                output = yield command
+                stage = command_stage(command[0])
+                self.timings.add(stage,
+                                 getattr(output, 'elapsed', None) or 0.,
+                                 getattr(output, 'cpu', None),
+                                 bytes_read=bytes_read(command[1],
+                                                       input_files(stage)),
+                                 bytes_written=bytes_written(
+                                     before, written_files(command[1])))
+
+            if self.convolution == 'python':
+                with self.timings.measure('convolve') as io:
+                    self.spectrum = self.convolve()
+                    io['bytes_read'] = sum(
+                        os.path.getsize(self.workspace.file(name))
+                        for name in ['fort.7', 'fort.17']
+                        if os.path.isfile(self.workspace.file(name)))
+        except IOError as err:
             raise IOError('Calculated spectrum is not available. Check if ' +
-                'syn(spec|plot) ran correctly.')
+                'syn(spec|plot) ran correctly. ({})'.format(err))
+
+        if self.cache is not None:
+            with self.timings.measure('cache') as io:
+                self.cache.put(key, self.spectrum, self.eqw,
+                               self.workspace.path)
+                io['bytes_written'] = self.spectrum.nbytes
+
+        self.remember_run(stage)
+
+    def cache_parameters(self):
+        """
+        Parameters of the cache key: `parameters` plus the settings that
+        change the calculated spectrum.
+        """
+        parameters = self.parameters
+        if self.convolution == 'python':
+            parameters = dict(parameters, convolution='python')
+        if self.screen_threshold is not None:
+            parameters = dict(parameters,
+                              screen_threshold=self.screen_threshold)
+        if self.line_margin is not None:
+            parameters = dict(parameters, line_margin=self.window_margin())
+        return parameters
+
+    def run_state(self):
+        """
+        Normalized parameters and settings of a synthesis, and the content
+        hashes of the files it depends on, as in `cache_key`, to be compared
+        with the ones of the last run.
+        """
+        state = {key: normalize_value(val)
+                 for key, val in self.parameters.iteritems()}
+        files = sorted([os.path.basename(fname), file_hash(fname)]
+                       for fname in dependencies(self.parameters, self.spath))
+        state[None] = normalize_value([self.spath, self.backend,
+                                       self.interpolate, self.convolution,
+                                       self.line_margin,
+                                       self.screen_threshold, self.chunks,
+                                       files])
+        return state
+
+    def reuse_mode(self, stage=None):
+        """
+        Check which part of the last run can be reused by the next one.
+
+        Returns
+        -------
+
+        str;
+            'spectrum' if only `POSTPROCESS_KEYS` changed, so the last
+            spectrum is still right; 'convolution' if only
+            `CONVOLUTION_KEYS` changed as well, so only the unconvolved
+            spectrum of the last run is convolved again; or None.
+        """
+        if not self.reconvolve or self.last_run is None or \
+           stage is not None or 'norun' in self.parameters:
+            return None
+
+        last = self.last_run['state']
+        state = self.run_state()
+        changed = set(key for key in set(last) | set(state)
+                      if last.get(key) != state.get(key))
+
+        if not changed.difference(POSTPROCESS_KEYS):
+            return 'spectrum'
+        if self.last_run['files'] and \
+           not changed.difference(POSTPROCESS_KEYS + CONVOLUTION_KEYS):
+            return 'convolution'
+        return None
+
+    def remember_run(self, stage=None):
+        """
+        Keep the state and spectrum of a successful run and, if Synspec ran,
+        its unconvolved spectrum and line identification tables, for
+        `reuse_mode`. Runs on staged files are not kept.
+        """
+        if self.reconvolving:
+            self.reconvolving = False
+            self.last_run['state'] = self.run_state()
+            self.last_run['spectrum'] = self.spectrum
+            if self.eqw is None:
+                self.eqw = self.last_run['eqw']
+            return
+
+        self.forget_run()
+        if not self.reconvolve or stage is not None or \
+           'norun' in self.parameters:
+            return
+
+        names = [name for name in UNCONVOLVED_FILES
+                 if os.path.isfile(self.workspace.file(name))]
+        files = {}
+        path = None
+        if 'fort.7' in names and 'fort.17' in names:
+            path = tempfile.mkdtemp(prefix='s4-unconvolved-',
+                                    dir=self.tmpdir)
+            for name in names:
+                files[name] = os.path.join(path, name)
+                try:
+                    os.link(self.workspace.file(name), files[name])
+                except OSError:
+                    shutil.copyfile(self.workspace.file(name), files[name])
+
+        self.last_run = {'state': self.run_state(), 'spectrum': self.spectrum,
+                         'eqw': self.eqw, 'path': path, 'files': files}
+
+    def forget_run(self):
+        """Delete the files kept from the last run."""
+        if self.last_run is not None and self.last_run['path'] is not None:
+            shutil.rmtree(self.last_run['path'], ignore_errors=True)
+        self.last_run = None
+
+    def restore_cached(self, entry):
+        """
+        Use a cached synthesis. The cached output files are written on the
+        workspace as if they had been calculated.
+        """
+        self.spectrum = entry['spectrum']
+        self.eqw = entry['eqw']
+        self.log = 'Spectrum read from cache.'
+
+        for name, content in entry.iteritems():
+            if name.startswith('fort.'):
+                with open(self.workspace.file(name), 'wb') as out:
+                    out.write(content)
+
+    def window_margin(self):
+        """
+        Margin of the line list window: `line_margin`, but never less than
+        `cutoff`, the distance over which Synspec still adds the lines.
+        """
+        return max(self.line_margin, float(self.parameters.get('cutoff', 10)))
+
+    def window_line_list(self):
+        """
+        Write the lines of the interval, within `window_margin`, as the line
+        list (fort.19) of the workspace. If the line list can not be
+        indexed, e.g., it is not sorted, the whole list is used.
+
+        Returns
+        -------
+
+        int;
+            Number of bytes written.
+        """
+        destination = self.workspace.file('fort.19')
+        tmp_name = destination + '.window'
+        try:
+            size = linelist.open_index(self.line_list).write_window(
+                float(self.parameters['wstart']),
+                float(self.parameters['wend']), tmp_name, self.window_margin())
+        except (IOError, OSError, ValueError):
+            return 0
+
+        # Never write through the link to the shared directory.
+        if os.path.lexists(destination):
+            os.remove(destination)
+        os.rename(tmp_name, destination)
+        self.line_window = True
+
+        return size
+
+    def screen_line_list(self):
+        """
+        Drop the weak lines of the line list of the run, writing the others
+        as the line list (fort.19) of the workspace. If the model atmosphere
+        is not on the grid, the line list is not changed.
+
+        Returns
+        -------
+
+        int;
+            Number of bytes written.
+        """
+        destination = self.workspace.file('fort.19')
+        source = destination if self.line_window else self.line_list
+        abund = self.parameters.get('abund')
+        metal = self.parameters.get('metal')
+        try:
+            with open(source) as infile:
+                content = infile.read()
+            content, self.lines_dropped = linestrength.screened_list(
+                content, float(self.parameters['teff']),
+                float(self.parameters['logg']), self.workspace.path,
+                None if abund is None else parse_abund(abund),
+                None if metal is None else float(metal),
+                self.screen_threshold)
+        except (IOError, ValueError):
+            return 0
+
+        # Never write through the link to the shared directory.
+        if os.path.lexists(destination):
+            os.remove(destination)
+        with open(destination, 'w') as out:
+            out.write(content)
+        self.line_window = True
+
+        return len(content)
+
+    def screening_error(self, stage=None):
+        """
+        Measure the error caused by the screening of the line list.
+
+        The spectrum is calculated, if needed, and compared with one
+        calculated with all lines.
+
+        Returns
+        -------
+
+        float;
+            The largest absolute difference of flux.
+        """
+        if self.spectrum is None:
+            self.run(stage=stage)
+
+        reference = copy.copy(self)
+        reference.workspace = None
+        reference.cache = None
+        reference.screen_threshold = None
+        # The reference run is not kept to be convolved again
+        reference.last_run = None
+        reference.reconvolve = False
+        try:
+            reference.run(stage=stage)
+            full = np.interp(self.spectrum[:, 0], reference.spectrum[:, 0],
+                             reference.spectrum[:, 1])
+        finally:
+            reference.cleanup()
+            reference.forget_run()
+
+        return np.abs(self.spectrum[:, 1] - full).max()
+
+    def run_parameters(self):
+        """
+        Obtain the parameters of the external programs. If `convolution` is
+        'python', rotin3 only normalizes the spectrum. If the line list was
+        written on the workspace, `linlist` is dropped.
+        """
+        parameters = self.parameters.copy()
+        if self.reconvolving:
+            parameters['norun'] = 1
+        if self.line_window:
+            parameters.pop('linlist', None)
+        if self.convolution == 'python':
+            for key in ['steprot', 'stepins', 'vmac_iso', 'vmac_rt']:
+                parameters.pop(key, None)
+            parameters['vrot'] = 0
+            parameters['fwhm'] = 0
+        return parameters
+
+    def convolve(self):
+        """
+        Convolve the unconvolved spectrum of the workspace (fort.7 and
+        fort.17) with `spectools.broadening`, as rotin3 does.
+        """
+        vrot = float(self.parameters.get('vrot', 0))
+        fwhm = float(self.parameters.get('fwhm', 0))
+        if vrot < 0 or fwhm < 0:
+            return self.spectrum
+
+        wstart = float(self.parameters['wstart'])
+        wend = float(self.parameters['wend'])
+        if 'vmac_iso' in self.parameters:
+            fwhm += float(self.parameters['vmac_iso']) / \
+                    broadening.LIGHT_SPEED * (wstart + wend) * 0.5
+
+        detailed = specio.loadtxt_fast(self.workspace.file('fort.7'),
+                                       np.float)
+        continuum = specio.loadtxt_fast(self.workspace.file('fort.17'),
+                                        np.float)
+        if len(detailed) == 0:
+            raise IOError('Unconvolved spectrum is empty.')
+
+        imode = int(float(self.parameters.get('imode', 0)))
+        chard = float(self.parameters.get('wdist',
+                                          0.01 if imode != 2 else 0.5))
+
+        return broadening.rotin(detailed[:, 0], detailed[:, 1],
+                                continuum[:, 0], continuum[:, 1], wstart,
+                                wend, vrot, fwhm,
+                                float(self.parameters.get('vmac_rt', 0)),
+                                int(float(self.parameters['relative'])),
+                                chard,
+                                float(self.parameters.get('steprot', 0)),
+                                float(self.parameters.get('stepins', 0)))
+
+    def synplot_parameters(self):
+        """
+        Obtain the parameters given to synplot.pro. If `interpolate` is True,
+        the model atmosphere is interpolated in the workspace and is passed as
+        `atmos`.
+        """
+        parameters = self.run_parameters()
+        if not self.interpolate or 'atmos' in parameters or \
+           'norun' in parameters:
+            return parameters
+
+        metal = parameters.pop('metal', None)
+        try:
+            with self.timings.measure('model') as io:
+                atmos = atmosphere.make_model(float(parameters['teff']),
+                                              float(parameters['logg']),
+                                              self.workspace.path,
+                                              metal=None if metal is None
+                                              else float(metal))
+                io['bytes_written'] = file_bytes(self.workspace.path,
+                                                 [atmos + '.5', atmos + '.7'])
+        except (IOError, ValueError):
+            # Leave it to intrpmod.pro
+            return self.run_parameters()
+
+        parameters['atmos'] = "'{}'".format(atmos)
+        # synplot.pro only sets the atomic data when it selects the models
+        parameters.setdefault('atdata', "'../atdata'")
+
+        return parameters
+
+    def synplot_steps(self):
+        """Run synplot.pro with IDL/GDL, as a generator of `run_steps`."""
+        statements = self.synplot_statements(
+            parameters=self.synplot_parameters())
+        if self.pool is not None:
+            # The session runs on another process, so only the wall time
+            # is known.
+            with self.timings.measure('gdl', self.workspace.path):
+                self.log = self.pool_execute(statements)
+        else:
+            cmd = self.software + ' -e "' + ' & '.join(statements) + '"'
+            stdout, stderr = yield cmd, self.workspace.path
+            self.log = '{}\n{}'.format(stdout, stderr)
+
+        with open(self.workspace.file('run.log'), 'w') as out:
+            out.write(self.log)
+
+        with self.timings.measure('parse') as io:
+            self.spectrum = specio.loadtxt_fast(
+                self.workspace.file('fort.11'), np.float)
+            io['bytes_read'] = os.path.getsize(self.workspace.file('fort.11'))
+
+    def pool_execute(self, statements):
+        """
+        Run IDL statements on a session of the pool, with the `timeout` and
+        `retries` of external programs. The pool restarts sessions that
+        crash or hang.
+
+        Raises
+        ------
+
+        wrappers.CommandTimeout;
+            If the last attempt did not finish in time.
+
+        wrappers.CommandError;
+            If the session crashed.
+        """
+        for attempt in range(1, self.retries + 2):
+            try:
+                return self.pool.execute(statements, timeout=self.timeout)
+            except GDLSessionTimeout as err:
+                error = err
+            except GDLSessionError as err:
+                raise wrappers.CommandError(str(err))
+
+        raise wrappers.CommandTimeout('{} ({} attempts)'.format(error,
+                                                                attempt))
+
+    def engine_steps(self):
+        """
+        Run Synspec and Rotin3 directly, without IDL/GDL, as a generator of
+        `run_steps`.
+        """
+        engine = SynspecEngine(self.run_parameters())
+        steps = engine.steps(self.workspace.path)
+        try:
+            output = None
+            while True:
+                try:
+                    command = steps.send(output)
+                except StopIteration:
+                    break
+                output = yield command
+            self.spectrum = engine.spectrum
+        finally:
+            self.log = engine.log
+            self.eqw = engine.eqw
+            self.timings.merge(engine.timings)
+
+    def cleanup(self):
+        """Delete the workspace of the last run."""
+        if self.workspace is not None:
+            self.workspace.cleanup()
+            self.workspace = None
+
+    def __del__(self):
+        try:
+            self.cleanup()
+            self.forget_run()
+        except Exception:
+            pass
+
+    @staticmethod
+    def run_many(parameters, workers=None, **kwargs):
+        """
+        Calculate several spectra on a pool of processes.
+
+        Identical parameter sets are calculated only once. Each synthesis
+        runs in its own workspace.
+
+        Parameters
+        ----------
+
+        parameters: list;
+            A dictionary of Synplot arguments for each spectrum, including
+            `teff` and `logg`. A `stage` key is given to `run`.
+
+        workers: int (optional);
+            Number of processes. The default is the number of CPUs. If 1, the
+            spectra are calculated in this process.
+
+        kwargs:
+            Arguments common to all spectra. The values of `parameters` take
+            precedence. A `pool` can not be shared between processes.
+
+        Returns
+        -------
+
+        spectra: list;
+            The calculated spectrum of each parameter set, in the same order,
+            or None if it failed.
+
+        errors: list;
+            None for each successful synthesis, or the traceback of the error.
+        """
+        if kwargs.get('pool') is not None:
+            raise ValueError('A GDL pool can not be shared by processes.')
+
+        items = [dict(kwargs, **params) for params in parameters]
+
+        # Deduplicate
+        keys = [json.dumps(normalize_value(item), sort_keys=True)
+                for item in items]
+        unique = {}
+        for key, item in zip(keys, items):
+            unique.setdefault(key, item)
+        unique_keys = list(unique)
+
+        if workers is None:
+            workers = mp.cpu_count()
+        workers = min(workers, len(unique_keys))
+
+        if workers <= 1:
+            results = [_run_one(unique[key]) for key in unique_keys]
+        else:
+            pool = mp.Pool(workers)
+            try:
+                results = pool.map(_run_one,
+                                   [unique[key] for key in unique_keys],
+                                   chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+
+        results = dict(zip(unique_keys, results))
+        spectra = [None if results[key][0] is None
+                   else np.array(results[key][0]) for key in keys]
+        errors = [results[key][1] for key in keys]
+
+        return spectra, errors
 
     def save_spec(self, file_name, **kwargs):
         """
@@ -175,6 +1032,7 @@ class Synplot:
         file_name: str;
             Name of the file to be saved.
         """
+        import matplotlib.pyplot as plt
 
         self.check_if_run()
 
@@ -277,30 +1135,40 @@ class Synplot:
     # Select lines to line identification
     def lineid_select(self, ident):
         """Identify lines to be plot by lineid_plot"""
-        # List of chemical elements
-        table = open(self.spath + 'fort.12').read() +                         \
-                open(self.spath + 'fort.14').read()
+        table = lineid.select(self.line_table(), ident)
 
-        # Pattern for regex
-        ptrn = r'(\d{4}\.\d{3})\s+(\w{1,2}\s+I*V*I*).+(\b\d+\.\d)\s+(\*+)'
+        return table['wave'].tolist(), lineid.labels(table)
 
-        #Find patterns
-        regex_table = re.findall(ptrn, table)
+    def line_table(self):
+        """
+        Line identification table of the last run, parsed from fort.12 and
+        fort.14 on the first call and kept until the next run. See
+        `lineid.select` to query it. A chunked run has no table.
+
+        Returns
+        -------
+
+        numpy.ndarray;
+            The `wave`, `species`, `ion` and `strength` (equivalent width, in
+            mA) of each line, as returned by `lineid.parse_table`.
+        """
+        self.check_if_run()
 
-        # Parse table
-        wavelengths = [float(line[0]) for line in regex_table
-                       if float(line[2]) >= ident]
-        chem_elements = [line[1] + ' ' + line[0] + '  ' + line[2]
-                         for line in regex_table
-                         if float(line[2]) >= ident]
+        if self.line_ids is None:
+            if self.workspace is None:
+                return lineid.parse_table('')
+            self.line_ids = lineid.read_table(self.workspace.path)
 
-        return wavelengths, chem_elements
+        return self.line_ids
     #=========================================================================
 
     #=========================================================================
     #Apply scale
     def apply_scale(self):
         """ Apply scale. """
+        # On a copy, so the spectrum kept by `remember_run` or a cache is not
+        # changed.
+        self.spectrum = self.spectrum.copy()
         self.spectrum[:, 1] *= self.parameters['scale']
 
 
@@ -311,3 +1179,31 @@ class Synplot:
 
         if isinstance(self.spectrum, type(None)):
             self.run()
+
+
+#=============================================================================
+def _run_one(parameters):
+    """
+    Calculate one spectrum of `Synplot.run_many`. It is a function of the
+    module so it can be sent to other processes.
+
+    Returns
+    -------
+
+    spectrum: numpy.ndarray or None;
+        The calculated spectrum.
+
+    error: str or None;
+        The traceback of the error, if any.
+    """
+    kwargs = dict(parameters)
+    stage = kwargs.pop('stage', None)
+    try:
+        synthesis = Synplot(**kwargs)
+        try:
+            synthesis.run(stage=stage)
+            return synthesis.spectrum, None
+        finally:
+            synthesis.cleanup()
+    except Exception:
+        return None, traceback.format_exc()
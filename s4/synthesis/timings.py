@@ -0,0 +1,225 @@
+"""
+Timing of the stages of a synthesis.
+
+Each run of `Synplot` records, per stage (e.g., the interpolation of the
+model atmosphere, each external program and the parsing of fort.11), the
+wall and CPU time, the number of bytes read and written and the number of
+calls. The CPU time of an external program is the one of its process group,
+as returned by `wait4`, so it is right even when several programs run at the
+same time. The bytes written by a stage are those of its known output files,
+`OUTPUT_FILES`, and the bytes read by an external program those of its known
+input files, `INPUT_FILES`, which are only checked with `stat`. Measuring
+costs a few microseconds per stage, so it is always on.
+
+Example
+-------
+
+::
+
+    syn = Synplot(20000, 4, wstart=4460, wend=4480)
+    syn.run()
+    print syn.timings
+    syn.timings['synspec49']['wall']
+"""
+import os
+import stat
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+# Quantities recorded for each stage
+FIELDS = ['calls', 'wall', 'cpu', 'bytes_read', 'bytes_written']
+
+# Output files of the external programs: the spectra of Synspec and rotin3
+# and the line identification tables.
+OUTPUT_FILES = ['fort.7', 'fort.17', 'fort.11', 'fort.12', 'fort.14']
+
+# Input files of Synspec: the model atmosphere, the line list, which may be
+# a window of the full list, and its other input files.
+SYNSPEC_INPUT_FILES = ['fort.5', 'fort.8', 'fort.19', 'fort.55', 'fort.56']
+
+# Input files of the external programs, by the start of their stage name.
+# GDL and IDL run Synspec, and rotin3 convolves the spectrum of Synspec.
+INPUT_FILES = [('synspec', SYNSPEC_INPUT_FILES),
+               ('gdl', SYNSPEC_INPUT_FILES),
+               ('idl', SYNSPEC_INPUT_FILES),
+               ('rotin', ['fort.7', 'fort.17'])]
+
+
+def command_stage(command):
+    """
+    Name of the stage of a command line, i.e., the name of its program,
+    e.g., 'synspec49' for './synspec49 < fort.5'.
+    """
+    return os.path.basename(command.split()[0]) if command.strip() else ''
+
+
+def cpu_time():
+    """CPU time, user and system, of this process."""
+    times = os.times()
+    return times[0] + times[1]
+
+
+def written_files(path, names=OUTPUT_FILES):
+    """
+    Size and modification time of some regular files of a directory. Links,
+    e.g., to the files of a `Workspace`, and missing files are skipped.
+    """
+    files = {}
+    for name in names:
+        try:
+            info = os.lstat(os.path.join(path, name))
+        except OSError:
+            continue
+        if stat.S_ISREG(info.st_mode):
+            files[name] = (info.st_size, info.st_mtime)
+    return files
+
+
+def file_bytes(path, names):
+    """Number of bytes of the files of a directory that exist."""
+    return sum(size for size, _ in written_files(path, names).itervalues())
+
+
+def input_files(stage):
+    """Known input files of the program of a stage, see `INPUT_FILES`."""
+    for prefix, names in INPUT_FILES:
+        if stage.startswith(prefix):
+            return names
+    return []
+
+
+def bytes_read(path, names):
+    """
+    Number of bytes of the files of a directory that exist. Links, e.g., to
+    the full line list, count as the files they point to.
+    """
+    size = 0
+    for name in names:
+        try:
+            size += os.path.getsize(os.path.join(path, name))
+        except OSError:
+            continue
+    return size
+
+
+def bytes_written(before, after):
+    """Number of bytes of the files created or changed between snapshots."""
+    return sum(size for name, (size, mtime) in after.iteritems()
+               if before.get(name) != (size, mtime))
+
+
+class Timings(object):
+    """
+    Wall and CPU time, in seconds, bytes read and written and number of
+    calls of each stage, plus counters, e.g., of cache hits.
+
+    `timings[stage]` is a dictionary with the keys of `FIELDS`.
+    """
+
+    def __init__(self):
+        self.stages = OrderedDict()
+        self.counters = OrderedDict()
+
+
+    def __getitem__(self, stage):
+        return self.stages[stage]
+
+
+    def __contains__(self, stage):
+        return stage in self.stages
+
+
+    def __iter__(self):
+        return iter(self.stages)
+
+
+    def __len__(self):
+        return len(self.stages)
+
+
+    def add(self, stage, wall=0., cpu=0., bytes_read=0, bytes_written=0,
+            calls=1):
+        """Add a measurement to a stage."""
+        if stage not in self.stages:
+            self.stages[stage] = dict.fromkeys(FIELDS, 0)
+        values = self.stages[stage]
+        values['calls'] += calls
+        values['wall'] += wall
+        values['cpu'] += cpu or 0.
+        values['bytes_read'] += bytes_read
+        values['bytes_written'] += bytes_written
+
+
+    def count(self, name, n=1):
+        """Increment a counter."""
+        self.counters[name] = self.counters.get(name, 0) + n
+
+
+    @contextmanager
+    def measure(self, stage, path=None):
+        """
+        Measure the wall and CPU time of a block of this process.
+
+        Parameters
+        ----------
+
+        stage: str;
+            Name of the stage.
+
+        path: str (optional);
+            If set, the bytes of the `OUTPUT_FILES` written on this
+            directory, and of the `INPUT_FILES` of the stage on it, are added
+            to the stage.
+
+        It yields a dictionary in which `bytes_read` and `bytes_written` can
+        be set.
+        """
+        before = written_files(path) if path is not None else None
+        io = {'bytes_read': 0, 'bytes_written': 0}
+        wall = time.time()
+        cpu = cpu_time()
+        try:
+            yield io
+        finally:
+            wall = time.time() - wall
+            cpu = cpu_time() - cpu
+            if before is not None:
+                io['bytes_read'] += bytes_read(path, input_files(stage))
+                io['bytes_written'] += bytes_written(before,
+                                                     written_files(path))
+            self.add(stage, wall, cpu, **io)
+
+
+    def merge(self, other):
+        """Add the stages and counters of other timings to these."""
+        for stage, values in other.stages.iteritems():
+            self.add(stage, **values)
+        for name, n in other.counters.iteritems():
+            self.count(name, n)
+
+
+    def total(self, field='wall'):
+        """Sum of a field over all stages."""
+        return sum(values[field] for values in self.stages.itervalues())
+
+
+    def as_dict(self):
+        """The timings as a dictionary, e.g., to be saved as JSON."""
+        return {'stages': {stage: dict(values)
+                           for stage, values in self.stages.iteritems()},
+                'counters': dict(self.counters)}
+
+
+    def __str__(self):
+        lines = ['{:<12s}{:>7s}{:>10s}{:>10s}{:>12s}{:>12s}'.format(
+            'stage', 'calls', 'wall (s)', 'cpu (s)', 'read (B)',
+            'written (B)')]
+        for stage, values in self.stages.iteritems():
+            lines.append('{:<12s}{calls:>7d}{wall:>10.3f}{cpu:>10.3f}'
+                         '{bytes_read:>12d}{bytes_written:>12d}'.format(
+                             stage, **values))
+        lines += ['{}: {}'.format(name, n)
+                  for name, n in self.counters.iteritems()]
+        return '\n'.join(lines)
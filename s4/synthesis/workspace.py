@@ -0,0 +1,165 @@
+"""
+Isolated scratch directories for Synplot runs.
+
+Synplot.pro, Synspec and Rotin3 read and write a lot of files (fort.5, fort.7,
+fort.8, fort.11, fort.17, fort.55, ...) in their working directory. If several
+syntheses share the same `synplot_path` they overwrite each other's files. A
+`Workspace` is a throwaway copy of the Synplot directory layout in which the
+read-only inputs (programs, IDL procedures, broadening tables, atomic data and
+model atmospheres) are symbolic links to the original files and everything
+produced by a run stays private to it.
+
+The layout mimics the installed one, since `synplot.pro` refers to the model
+atmospheres and atomic data as `../bstar2006` and `../atdata`:
+
+    <root>/synplot/    -> links to the files in `synplot_path`
+    <root>/bstar2006   -> link to `synplot_path/../bstar2006`
+    <root>/atdata      -> link to `synplot_path/../atdata`
+"""
+import os
+import shutil
+import tempfile
+from fnmatch import fnmatch
+
+
+# Files created by a run of Synplot/Synspec/Rotin3. They are never linked
+# into a workspace because writing through the link would change the shared
+# directory.
+SCRATCH_PATTERNS = ['fort.*', '*.tmp', 'f1', 'f12', 'f55', 'intrp*', 'begf',
+                    'midf', 'endf', 'tetmp', 'data', 'run.log']
+
+# Files matching `SCRATCH_PATTERNS` that are inputs nonetheless.
+KEEP_FILES = ['fort.19']
+
+# Directories, relative to the parent of `synplot_path`, that are needed by a
+# run.
+SHARED_DIRS = ['bstar2006', 'atdata']
+
+
+def is_scratch(fname):
+    """
+    Check if a file name is one of the files written during a run.
+
+    Parameters
+    ----------
+
+    fname: str;
+        Base name of the file.
+
+    Returns
+    -------
+
+    bool;
+        True if the file is produced by a run and should not be linked.
+    """
+    if fname in KEEP_FILES:
+        return False
+
+    return any(fnmatch(fname, pattern) for pattern in SCRATCH_PATTERNS)
+
+
+class Workspace(object):
+    """
+    A private working directory for a single synthesis.
+
+    Parameters
+    ----------
+
+    synplot_path: str;
+        Path to the Synplot directory whose read-only content will be linked.
+
+    tmpdir: str (optional);
+        Directory in which the workspace will be created. The default is the
+        system temporary directory.
+
+    keep: bool (optional);
+        If True, the workspace is not deleted by `cleanup`. Useful to inspect
+        the files of a run. The default is False.
+
+    Attributes
+    ----------
+
+    root: str;
+        Root of the workspace.
+
+    path: str;
+        Synplot directory inside the workspace, ending with a '/'. This is
+        the directory where the programs should run.
+
+    Example
+    -------
+
+    ::
+
+        with Workspace(synplot_path) as ws:
+            run_something_in(ws.path)
+    """
+
+    def __init__(self, synplot_path, tmpdir=None, keep=False):
+        self.source = os.path.abspath(synplot_path)
+        self.keep = keep
+
+        self.root = tempfile.mkdtemp(prefix='s4_', dir=tmpdir)
+        self.path = os.path.join(self.root, 'synplot') + '/'
+
+        try:
+            self._populate()
+        except:
+            shutil.rmtree(self.root, ignore_errors=True)
+            raise
+
+
+    def _populate(self):
+        """Create the links to the read-only inputs."""
+        os.mkdir(self.path)
+
+        for fname in os.listdir(self.source):
+            if is_scratch(fname):
+                continue
+            os.symlink(os.path.join(self.source, fname),
+                       os.path.join(self.path, fname))
+
+        parent = os.path.dirname(self.source)
+        for dname in SHARED_DIRS:
+            target = os.path.join(parent, dname)
+            if os.path.isdir(target):
+                os.symlink(target, os.path.join(self.root, dname))
+
+
+    def file(self, fname):
+        """Return the full path of a file inside the workspace."""
+        return self.path + fname
+
+
+    def stage(self, files):
+        """
+        Copy files into the workspace.
+
+        Parameters
+        ----------
+
+        files: dict;
+            Dictionary whose keys are the names inside the workspace and the
+            values are the paths of the files to be copied, e.g.,
+            `{'fort.7': '/tmp/my_spectrum.7'}`.
+        """
+        for fname, source in files.iteritems():
+            destination = self.file(fname)
+            # Never write through a link to the shared directory.
+            if os.path.islink(destination):
+                os.remove(destination)
+            shutil.copyfile(source, destination)
+
+
+    def cleanup(self):
+        """Delete the workspace, unless it was created with `keep=True`."""
+        if not self.keep and os.path.isdir(self.root):
+            shutil.rmtree(self.root, ignore_errors=True)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.cleanup()
@@ -0,0 +1,39 @@
+"""
+Chemical elements and their atomic numbers.
+
+The table is shipped with the package and read on its first use, so
+importing `s4` does not read it. The returned dictionaries are shared by all
+modules and must not be changed.
+"""
+import os
+import json
+import threading
+
+
+TABLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'chemical_elements.json')
+
+_TABLES = {}
+_TABLES_LOCK = threading.Lock()
+
+
+def _load():
+    """Read the table, only once per process."""
+    with _TABLES_LOCK:
+        if not _TABLES:
+            with open(TABLE_FILE) as infile:
+                periodic = json.load(infile)
+            _TABLES['symbols'] = {val:key for key, val in
+                                  periodic.iteritems()}
+            _TABLES['periodic'] = periodic
+    return _TABLES
+
+
+def periodic_table():
+    """Atomic number of each chemical element by its symbol, e.g., 'He'."""
+    return _load()['periodic']
+
+
+def element_symbols():
+    """Symbol of each chemical element by its atomic number."""
+    return _load()['symbols']
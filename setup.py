@@ -69,6 +69,7 @@ setup(name=NAME,
                 's4.utils',
                 's4.io',
                 's4'],
+      package_data={'s4.utils': ['chemical_elements.json']},
       data_files=[(path+'/synthesis/atdata', atdata),
                   (path+'/synthesis/bstar2006', bstar2006),
                   (path+'/synthesis/synplot', synplot),
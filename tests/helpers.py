@@ -0,0 +1,68 @@
+"""Fixtures shared by the test suites"""
+import os
+import tempfile
+import numpy as np
+
+# Center, depth and width of the lines of the fake spectra
+HE_4471 = [(4471.5, 0.6, 0.15)]
+
+# A line list with the He I 4471 line
+LINE_LIST = '  447.1473  2.00  -0.278\n'
+
+
+def fake_synspec(path, wstart=4440, wend=4500, lines=HE_4471, flux=1e8,
+                 slope=0.):
+    """
+    Write the unconvolved spectrum (fort.7) and the continuum (fort.17) of
+    Synspec: Gaussian lines, given by (center, depth, width), on a linear
+    continuum of `flux` at `wstart`.
+
+    Returns
+    -------
+
+    dict;
+        Path of each file, by name, to be staged in a run.
+    """
+    def continuum(wave):
+        return flux * (1 + slope * (wave - wstart))
+
+    wave = np.arange(wstart, wend, 0.01)
+    profile = 1 - sum(depth * np.exp(-((wave - center) / width)**2)
+                      for center, depth, width in lines)
+    np.savetxt(os.path.join(path, 'fort.7'),
+               np.column_stack([wave, continuum(wave) * profile]),
+               fmt='%12.5f%15.5E')
+    cont_wave = np.arange(wstart - 20, wend + 20, 5.)
+    np.savetxt(os.path.join(path, 'fort.17'),
+               np.column_stack([cont_wave, continuum(cont_wave)]),
+               fmt='%12.5f%15.5E')
+
+    return {name: os.path.join(path, name) for name in ['fort.7', 'fort.17']}
+
+
+def fake_synplot(line_list=False, **kwargs):
+    """
+    Create a temporary directory with an empty Synplot installation,
+    `synplot/`, with `LINE_LIST` if `line_list` is True, and the output of
+    `fake_synspec`, which takes the other arguments.
+
+    Returns
+    -------
+
+    root: str;
+        Directory to be removed.
+
+    spath: str;
+        Path of the Synplot installation.
+
+    stage: dict;
+        Files of `fake_synspec`.
+    """
+    root = tempfile.mkdtemp()
+    spath = os.path.join(root, 'synplot') + '/'
+    os.mkdir(spath)
+    if line_list:
+        with open(spath + 'fort.19', 'w') as out:
+            out.write(LINE_LIST)
+
+    return root, spath, fake_synspec(root, **kwargs)
@@ -0,0 +1,141 @@
+"""Test suite for the rotational and instrumental broadening"""
+import os
+import shutil
+import tempfile
+import subprocess as sp
+import numpy as np
+from s4.spectools import broadening
+from s4.synthesis import Synplot
+from s4.synthesis.cache import SpectrumCache, cache_key
+from helpers import fake_synspec, fake_synplot
+
+
+ROTIN3 = os.path.join(os.getenv('HOME'), '.s4', 'synthesis', 'synplot',
+                      'rotin3')
+
+# Lines and continuum of the unconvolved spectra
+SPECTRUM = dict(lines=[(4471.5, 0.6, 0.15), (4481.2, 0.3, 0.05)],
+                slope=0.001)
+
+
+def test_kernels():
+    """The kernels should be normalized and symmetric"""
+    for kernel in [broadening.rotation_kernel(0.5, 100),
+                   broadening.macroturbulence_kernel(0.5, 20),
+                   broadening.gaussian_kernel(0.5, 30)]:
+        assert len(kernel) % 2 == 1
+        assert np.isclose(kernel.sum(), 1)
+        assert np.allclose(kernel, kernel[::-1])
+
+    assert np.array_equal(broadening.rotation_kernel(1, 0.5), [1.])
+
+
+def test_broaden_conserves_equivalent_width():
+    """Broadening should conserve the equivalent width of a line"""
+    wave = np.arange(4400, 4500, 0.005)
+    flux = 1 - 0.5 * np.exp(-((wave - 4450) / 0.1)**2)
+    broad = broadening.broaden(wave, flux, vrot=100, vmac=20, fwhm=0.5)
+
+    assert np.isclose(np.trapz(1 - broad, wave), np.trapz(1 - flux, wave),
+                      rtol=1e-3)
+    assert broad.min() > flux.min()
+
+
+def test_rotin_as_rotin3():
+    """Test if the convolution reproduces rotin3"""
+    path = tempfile.mkdtemp()
+    try:
+        fake_synspec(path, **SPECTRUM)
+        shutil.copy(ROTIN3, path)
+        wave, flux = np.loadtxt(os.path.join(path, 'fort.7'), unpack=True)
+        cont_wave, cont_flux = np.loadtxt(os.path.join(path, 'fort.17'),
+                                          unpack=True)
+
+        for vrot, fwhm, vmac in [(50, 0.5, 0), (10, 0.1, 0), (150, 0.2, 20),
+                                 (0, 0.3, 0)]:
+            with open(os.path.join(path, 'r.tmp'), 'w') as out:
+                out.write(" 'fort.7'   'fort.17'    'fort.11' \n" +
+                          '{} 0.01 0\n{} 0 {}\n4460 4490 1\n'.format(
+                              vrot, fwhm, vmac))
+            sp.check_call('./rotin3 < r.tmp > out.tmp', shell=True, cwd=path)
+            expected = np.loadtxt(os.path.join(path, 'fort.11'))
+
+            spec = broadening.rotin(wave, flux, cont_wave, cont_flux, 4460,
+                                    4490, vrot, fwhm, vmac, relative=1)
+
+            assert spec.shape == expected.shape
+            assert np.allclose(spec[:, 0], expected[:, 0], atol=1e-3)
+            assert np.allclose(spec[:, 1], expected[:, 1], rtol=5e-3)
+    finally:
+        shutil.rmtree(path)
+
+
+def test_synplot_convolution_only():
+    """A convolution-only run should not need Synspec or GDL"""
+    root, spath, stage = fake_synplot(**SPECTRUM)
+    try:
+        syn = Synplot(20000, 4, synplot_path=spath, wstart=4460, wend=4480,
+                      relative=1, vrot=50, fwhm=0.3, norun=1,
+                      convolution='python')
+        syn.run(stage=stage)
+
+        assert syn.spectrum[0, 0] == 4460
+        assert np.all(syn.spectrum[:, 1] < 1 + 1e-6)
+        assert syn.spectrum[:, 1].min() > 0.5
+
+        syn.cleanup()
+    finally:
+        shutil.rmtree(root)
+
+
+def test_synplot_reconvolve():
+    """Only the convolution should run when only vrot or fwhm change"""
+    root, spath, _ = fake_synplot(line_list=True, **SPECTRUM)
+    try:
+        # A full synthesis, read from the cache with its unconvolved spectrum
+        cache = SpectrumCache(os.path.join(root, 'cache'))
+        syn = Synplot(20000, 4, synplot_path=spath, wstart=4460, wend=4480,
+                      relative=1, vrot=0, convolution='python', cache=cache,
+                      tmpdir=root)
+        cache.put(cache_key(syn.cache_parameters(), spath), np.zeros((10, 2)),
+                  path=root)
+        syn.run()
+        assert syn.cache_hit
+        assert sorted(syn.last_run['files']) == ['fort.17', 'fort.7']
+
+        syn.parameters.update(vrot=50, fwhm=0.3)
+        assert syn.reuse_mode() == 'convolution'
+        syn.run()
+        assert syn.timings.counters['reconvolved'] == 1
+        assert syn.spectrum[0, 0] == 4460
+        assert syn.spectrum[:, 1].min() > 0.5
+        assert np.all(syn.spectrum[:, 1] < 1 + 1e-6)
+
+        spectrum = syn.spectrum
+        syn.parameters['scale'] = 2
+        syn.run()
+        assert syn.timings.counters == {'reused': 1}
+        assert syn.spectrum is spectrum
+
+        syn.apply_scale()
+        assert syn.last_run['spectrum'][:, 1].max() <= 1 + 1e-6
+
+        # A changed line list is calculated again
+        with open(spath + 'fort.19', 'a') as out:
+            out.write('  448.1126 12.01   0.740\n')
+        assert syn.reuse_mode() is None
+        syn.remember_run()
+        assert syn.reuse_mode() == 'spectrum'
+        syn.chunks = 2
+        assert syn.reuse_mode() is None
+        syn.chunks = None
+
+        syn.parameters['teff'] = 21000
+        assert syn.reuse_mode() is None
+
+        path = syn.last_run['path']
+        syn.cleanup()
+        syn.forget_run()
+        assert not os.path.exists(path)
+    finally:
+        shutil.rmtree(root)
@@ -0,0 +1,100 @@
+"""Test suite for the cache of synthetic spectra"""
+import os
+import shutil
+import tempfile
+import numpy as np
+from s4.synthesis import Synplot
+from s4.synthesis.cache import SpectrumCache, cache_key
+
+
+def make_tree():
+    """Creates a fake Synplot installation with a line list."""
+    root = tempfile.mkdtemp()
+    spath = os.path.join(root, 'synplot') + '/'
+    os.mkdir(spath)
+    with open(spath + 'fort.19', 'w') as out:
+        out.write('  447.1473  2.00  -0.278\n')
+    return root, spath
+
+
+def test_cache_key():
+    """Test if the key depends only on what changes the spectrum"""
+    root, spath = make_tree()
+    params = dict(teff=20000, logg=4, wstart=4460, wend=4480,
+                  abund={'He': 10.93})
+
+    key = cache_key(params, spath)
+    same = dict(params, teff=20000.0, noplot='1', abund={2: 10.93}, scale=2,
+                rv=-30)
+    assert cache_key(same, spath) == key
+    assert cache_key(dict(params, vrot=10), spath) != key
+
+    # A different line list content changes the key
+    with open(spath + 'fort.19', 'a') as out:
+        out.write('  448.1126 12.01   0.740\n')
+    os.utime(spath + 'fort.19', (0, 0))
+    assert cache_key(params, spath) != key
+
+    shutil.rmtree(root)
+
+
+def test_cache_put_get():
+    """Test storing and loading an entry"""
+    root, spath = make_tree()
+    cache = SpectrumCache(os.path.join(root, 'cache'))
+    spectrum = np.random.random((100, 2))
+
+    with open(spath + 'fort.7', 'w') as out:
+        out.write('unconvolved')
+
+    assert cache.get('abc') is None
+    cache.put('abc', spectrum, 12.5, spath)
+    entry = cache.get('abc')
+
+    assert np.array_equal(entry['spectrum'], spectrum)
+    assert entry['eqw'] == 12.5
+    assert entry['fort.7'] == 'unconvolved'
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'stores': 1,
+                             'evictions': 0}
+
+    shutil.rmtree(root)
+
+
+def test_cache_eviction():
+    """Test if the least recently used entries are evicted"""
+    root, _ = make_tree()
+    cache = SpectrumCache(os.path.join(root, 'cache'))
+    spectrum = np.random.random((1000, 2))
+
+    for n, key in enumerate(['a', 'b', 'c']):
+        cache.put(key, spectrum)
+        os.utime(cache.path(key), (n, n))
+
+    # Use 'a', so 'b' is the least recently used
+    cache.get('a')
+    cache.max_size = cache.size() - 1
+    cache.evict()
+
+    assert cache.evictions == 1
+    assert not os.path.exists(cache.path('b'))
+    assert os.path.exists(cache.path('a'))
+
+    shutil.rmtree(root)
+
+
+def test_synplot_cache_hit():
+    """Test if Synplot reads a cached spectrum without running"""
+    root, spath = make_tree()
+    cache = SpectrumCache(os.path.join(root, 'cache'))
+    spectrum = np.random.random((100, 2))
+
+    syn = Synplot(20000, 4, synplot_path=spath, wstart=4460, wend=4480,
+                  cache=cache)
+    cache.put(cache_key(syn.cache_parameters(), spath), spectrum)
+    syn.run()
+
+    assert syn.cache_hit
+    assert np.array_equal(syn.spectrum, spectrum)
+
+    syn.cleanup()
+    shutil.rmtree(root)
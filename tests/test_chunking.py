@@ -0,0 +1,47 @@
+"""Test suite for the synthesis of wide ranges in chunks"""
+import shutil
+import numpy as np
+from s4.synthesis import Synplot
+from s4.synthesis.chunking import split_interval, stitch, padding
+from helpers import fake_synplot
+
+
+def test_split_interval():
+    """Test if the chunks cover the interval and are padded inside it"""
+    intervals = split_interval(4000, 4300, 3, pad=20)
+    assert intervals == [(4000, 4100, 4000, 4120), (4100, 4200, 4080, 4220),
+                         (4200, 4300, 4180, 4300)]
+
+    spectra = [np.column_stack([np.arange(start, end + 1), np.ones(
+        int(end - start) + 1)]) for _, _, start, end in intervals]
+    spectrum = stitch(spectra, intervals)
+    assert np.array_equal(spectrum[:, 0], np.arange(4000, 4301))
+
+    # Padding covers the rotational profile
+    assert padding({'wend': 5000, 'vrot': 300}) > 5000 * 300 / 3e5
+
+
+def test_chunked_convolution():
+    """Test if a chunked run matches a single run"""
+    root, spath, stage = fake_synplot(
+        wstart=4400, wend=4560, slope=0.001,
+        lines=[(4471.5, 0.6, 0.15), (4481.2, 0.3, 0.05), (4500., 0.5, 0.1)])
+    try:
+        params = dict(synplot_path=spath, wstart=4420, wend=4540, relative=1,
+                      vrot=80, fwhm=0.3, norun=1, convolution='python')
+        single = Synplot(20000, 4, **params)
+        single.run(stage=stage)
+        chunked = Synplot(20000, 4, chunks=4, workers=2, **params)
+        chunked.run(stage=stage)
+
+        assert chunked.spectrum[0, 0] == 4420
+        assert chunked.spectrum[-1, 0] <= 4540
+        assert np.all(np.diff(chunked.spectrum[:, 0]) > 0)
+        assert np.allclose(np.interp(single.spectrum[:, 0],
+                                     chunked.spectrum[:, 0],
+                                     chunked.spectrum[:, 1]),
+                           single.spectrum[:, 1], atol=1e-3)
+
+        single.cleanup()
+    finally:
+        shutil.rmtree(root)
@@ -0,0 +1,21 @@
+"""Test suite for the table of chemical elements and the import of S4"""
+import sys
+import subprocess as sp
+from s4.utils.elements import periodic_table, element_symbols
+
+
+def test_periodic_table():
+    """Test if the table is read once and shared"""
+    assert periodic_table()['He'] == 2
+    assert element_symbols()[26] == 'Fe'
+    assert periodic_table() is periodic_table()
+    assert all(element_symbols()[number] == symbol
+               for symbol, number in periodic_table().iteritems())
+
+
+def test_lazy_import():
+    """Test if importing S4 does not load the plotting and FITS libraries"""
+    script = ("import sys, s4; "
+              "print [name for name in ['matplotlib', 'astropy'] "
+              "if name in sys.modules]")
+    assert sp.check_output([sys.executable, '-c', script]).strip() == '[]'
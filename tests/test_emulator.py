@@ -0,0 +1,70 @@
+"""Test suite for the PCA emulator of spectra"""
+import os
+import shutil
+import tempfile
+import numpy as np
+from s4.synthesis.emulator import Emulator, train_emulator, load_emulator
+
+
+AXES = [np.linspace(19000, 21000, 5), np.linspace(3.5, 4.5, 5)]
+
+
+def profile(teff, logg, wave):
+    """A line whose depth and width change with the parameters."""
+    depth = 0.3 + 0.2 * (teff - 19000) / 2000.
+    width = 0.5 + 0.4 * (logg - 3.5)
+    return 1 - depth * np.exp(-((wave - 4471.5) / width)**2)
+
+
+def make_emulator():
+    """Emulator of `profile` on the grid of AXES."""
+    wave = np.linspace(4460, 4480, 400)
+    flux = np.array([profile(teff, logg, wave)
+                     for teff in AXES[0] for logg in AXES[1]])
+    return Emulator.from_spectra(['teff', 'logg'], AXES, wave, flux)
+
+
+def test_predict():
+    """Test if the prediction is close to the true spectrum"""
+    emulator = make_emulator()
+
+    # The grid points are reproduced
+    spectrum, error = emulator.predict({'teff': 20000, 'logg': 4.})
+    assert np.allclose(spectrum[:, 1], profile(20000, 4., spectrum[:, 0]),
+                       atol=1e-3)
+
+    # Between them, the error estimate bounds the true error
+    spectrum, error = emulator.predict({'teff': 20250, 'logg': 3.85})
+    true_error = np.abs(spectrum[:, 1] - profile(20250, 3.85,
+                                                 spectrum[:, 0]))
+    assert true_error.max() < 0.01
+    assert np.all(true_error <= 2 * error + 1e-4)
+
+    assert emulator.covers({'teff': 20250, 'logg': 3.85})
+    assert not emulator.covers({'teff': 22000, 'logg': 3.85})
+    try:
+        emulator.predict({'teff': 22000, 'logg': 3.85})
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('A point out of the grid was predicted.')
+
+
+def test_save_load():
+    """Test if a saved emulator is memory-mapped and predicts the same"""
+    emulator = make_emulator()
+    root = tempfile.mkdtemp()
+    try:
+        name = os.path.join(root, 'he4471')
+        emulator.save(name)
+        loaded = load_emulator(name)
+
+        assert loaded is load_emulator(name)
+        assert isinstance(loaded.components.base, np.memmap)
+        assert loaded.keys == ['teff', 'logg']
+        point = {'teff': 19700, 'logg': 4.3}
+        for expected, result in zip(emulator.predict(point),
+                                    loaded.predict(point)):
+            assert np.array_equal(expected, result)
+    finally:
+        shutil.rmtree(root)
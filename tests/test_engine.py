@@ -0,0 +1,117 @@
+"""Test suite for the native Synspec driver"""
+import os
+import shutil
+import tempfile
+import numpy as np
+from s4.synthesis import atmosphere
+from s4.synthesis.engine import SynspecEngine, parse_abund
+
+
+BSTAR = os.path.join(os.path.dirname(__file__), '..', 's4', 'synthesis',
+                     'bstar2006')
+
+
+def test_parse_abund():
+    """Test the conversion of abundances to triads"""
+    assert parse_abund('[2, 2, 10.93]') == [(2, 2, 10.93)]
+    assert parse_abund({'He': 10.93}) == [(2, 2, 10.93)]
+    assert parse_abund('[6, 8, 8.5, 2, 2, 11]') == [(6, 8, 8.5),
+                                                    (2, 2, 11.)]
+
+
+def test_bracketing_models():
+    """Test the choice of models that bracket teff and logg"""
+    models = atmosphere.bracketing_models(20400, 4.1, grid='BG')
+    assert models == ['BG20000g400v2', 'BG20000g425v2',
+                      'BG21000g400v2', 'BG21000g425v2']
+
+    try:
+        atmosphere.bracketing_models(35000, 4.)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('teff out of range was accepted')
+
+
+def test_interpolate_models_node():
+    """The interpolation on a node of the grid should return its model"""
+    core = os.path.join(BSTAR, 'BG')
+    models = atmosphere.bracketing_models(20000, 4., grid=core)
+    dm, params = atmosphere.interpolate_models(models, 20000, 4.)
+    dm0, params0 = atmosphere.read_model(models[0] + '.7')
+
+    assert np.allclose(dm, dm0)
+    assert np.allclose(params, np.maximum(params0, 1e-35))
+
+
+def test_model_files_memoized():
+    """Test if the interpolated model is memoized and can be read back"""
+    files = atmosphere.model_files(20400, 4.1, BSTAR, grid='BG')
+    assert atmosphere.model_files(20400, 4.1, BSTAR, grid='BG') is files
+
+    path = tempfile.mkdtemp()
+    with open(os.path.join(path, 'intrp.7'), 'w') as out:
+        out.write(files[0])
+    dm, params = atmosphere.read_model(os.path.join(path, 'intrp.7'))
+    models = atmosphere.bracketing_models(20400, 4.1,
+                                          grid=os.path.join(BSTAR, 'BG'))
+    dm0, params0 = atmosphere.interpolate_models(models, 20400, 4.1)
+
+    assert np.allclose(dm, dm0, rtol=1e-5)
+    assert np.allclose(params, params0, rtol=1e-5)
+    shutil.rmtree(path)
+
+
+def test_interpolate_metallicity():
+    """Test the interpolation in metallicity and the new `.5` file"""
+    core = os.path.join(BSTAR, 'BG')
+    models = atmosphere.bracketing_models(20000, 4., grid=core)
+    model1 = atmosphere.interpolate_models(models, 20400, 4.1)
+    model2 = (model1[0] * 2., model1[1] * 2.)
+
+    dm, params = atmosphere.interpolate_metallicity(model1, model2, 0., -0.3,
+                                                    0.)
+    assert np.allclose(dm, model1[0])
+    dm, params = atmosphere.interpolate_metallicity(model1, model2, 0., -0.3,
+                                                    -0.15)
+    assert np.allclose(params, model1[1] * 2**0.5)
+
+    with open(models[0] + '.5') as infile:
+        fort5 = infile.read()
+    lines = atmosphere.metallicity_input(fort5, -0.3).splitlines()
+    assert len(lines) == len(fort5.splitlines()) - 1
+    assert lines[23] == '    2  -0.501      0  ! Mg'
+
+
+def test_write_inputs():
+    """Test the input files of Synspec and Rotin3"""
+    path = tempfile.mkdtemp()
+    shutil.copyfile(os.path.join(BSTAR, 'BG20000g400v2.5'),
+                    os.path.join(path, 'model.5'))
+    shutil.copyfile(os.path.join(BSTAR, 'BG20000g400v2.7'),
+                    os.path.join(path, 'model.7'))
+
+    engine = SynspecEngine(dict(teff=20000, logg=4, wstart=4460, wend=4480,
+                                vrot=10, relative=1, abund={'He': 10.93},
+                                vturb=2))
+    engine.path = path
+    engine.ihydpr, engine.ihe1pr, engine.ihe2pr = 2122, 25, 26
+    engine.nalp = engine.nbet = engine.ngam = 0
+    engine.write_fort55('model.5', 'model.7')
+    engine.write_fort56()
+    engine.write_rotin_input()
+
+    fort55 = open(os.path.join(path, 'fort.55')).read().splitlines()
+    assert fort55[0] == '0 34 0'
+    assert fort55[5].split()[:2] == ['4460.0', '4480.0']
+    assert fort55[-1] == '2.0'
+
+    fort56 = open(os.path.join(path, 'fort.56')).read().splitlines()
+    assert fort56[0] == '1'
+    assert fort56[1].split() == ['2', '1.09300e+01']
+
+    rotin = open(os.path.join(path, 'r.tmp')).read().splitlines()
+    assert rotin[1].split()[0] == '10.0'
+    assert rotin[3].split() == ['4460.0', '4480.0', '1']
+
+    shutil.rmtree(path)
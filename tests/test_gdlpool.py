@@ -0,0 +1,135 @@
+"""Test suite for the pool of GDL sessions"""
+import os
+import stat
+import sys
+import tempfile
+import time
+import threading
+from s4.synthesis import Synplot
+from s4.io.wrappers import CommandTimeout
+from s4.synthesis.gdlpool import GDLPool, GDLSession, GDLSessionError
+
+
+# A fake interpreter that understands `print, '...'`, `exit` and `crash`.
+FAKE_GDL = '''#!{}
+import sys
+while True:
+    line = sys.stdin.readline()
+    if not line or line.strip() in ['exit', 'crash']:
+        break
+    if line.startswith('print,'):
+        sys.stdout.write(line.split("'")[1] + '\\n')
+    elif line.startswith('hang'):
+        while True:
+            pass
+    sys.stdout.flush()
+'''
+
+
+def fake_gdl():
+    """Write the fake interpreter and return its path."""
+    fdesc, fname = tempfile.mkstemp()
+    os.write(fdesc, FAKE_GDL.format(sys.executable))
+    os.close(fdesc)
+    os.chmod(fname, stat.S_IRWXU)
+    return fname
+
+
+def test_session_execute():
+    """Test if a session returns the output of each command"""
+    software = fake_gdl()
+    session = GDLSession(software)
+
+    assert session.execute(["print, 'one'"]) == 'one\n'
+    assert session.execute(["print, 'two'", "print, 'three'"]) == \
+        'two\nthree\n'
+    assert session.ping()
+
+    session.close()
+    assert not session.is_alive()
+    os.remove(software)
+
+
+def test_session_crash():
+    """Test if a crash and a hang are reported"""
+    software = fake_gdl()
+    session = GDLSession(software)
+
+    try:
+        session.execute(['crash'])
+    except GDLSessionError:
+        pass
+    else:
+        raise AssertionError('Crash not detected')
+
+    session.restart()
+    try:
+        session.execute(['hang'], timeout=0.5)
+    except GDLSessionError:
+        pass
+    else:
+        raise AssertionError('Hang not detected')
+
+    session.close()
+    os.remove(software)
+
+
+def test_pool_restart():
+    """Test if the pool restarts crashed sessions"""
+    software = fake_gdl()
+
+    with GDLPool(size=2, software=software) as pool:
+        try:
+            pool.execute(['crash'])
+        except GDLSessionError:
+            pass
+        assert pool.restarts == 1
+
+        results = []
+
+        def work(n):
+            results.append(pool.execute(["print, '{}'".format(n)]))
+
+        threads = [threading.Thread(target=work, args=(n,))
+                   for n in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert sorted(results) == ['{}\n'.format(n) for n in range(6)]
+        assert pool.health_check() == 0
+
+    os.remove(software)
+
+
+def test_pool_timeout():
+    """Test if a hung session is retried and a busy one is not checked"""
+    software = fake_gdl()
+
+    with GDLPool(size=2, software=software) as pool:
+        syn = Synplot(20000, 4, wstart=4460, wend=4480, pool=pool,
+                      timeout=0.3, retries=1)
+        try:
+            syn.pool_execute(['hang'])
+        except CommandTimeout:
+            pass
+        else:
+            raise AssertionError('Hang not detected')
+        assert pool.restarts == 2
+
+        def hang():
+            try:
+                pool.execute(['hang'], timeout=1)
+            except GDLSessionError:
+                pass
+
+        thread = threading.Thread(target=hang)
+        thread.start()
+        time.sleep(0.1)
+        start = time.time()
+        assert pool.health_check() == 0
+        assert time.time() - start < 0.5
+        thread.join()
+
+    os.remove(software)
@@ -0,0 +1,151 @@
+"""Test suite for the non-blocking syntheses"""
+import os
+import time
+import shutil
+import tempfile
+from nose.tools import assert_raises
+from s4.synthesis import Synplot
+from s4.io.wrappers import CommandTimeout
+from s4.synthesis.jobs import Job, JobCancelled, Scheduler, run_steps
+from helpers import fake_synplot
+
+
+def echo_steps(name, results, delay=0.2):
+    """Steps with two commands, recording their outputs."""
+    stdout, _ = yield 'sleep {}; echo {}'.format(delay, name), None
+    results.append(stdout.strip())
+    stdout, stderr = yield 'echo {}-err 1>&2'.format(name), None
+    results.append(stderr.strip())
+
+
+def test_run_steps():
+    """Test the synchronous driver"""
+    results = []
+    run_steps(echo_steps('a', results, 0),
+              lambda cmd, cwd: ('a\n', '') if 'sleep' in cmd else
+              ('', 'a-err\n'))
+    assert results == ['a', 'a-err']
+
+
+def test_scheduler():
+    """Test if jobs run concurrently, up to the limit"""
+    results = []
+    scheduler = Scheduler(max_running=4)
+    finished = []
+    all_jobs = [scheduler.submit(Job(echo_steps(str(n), results),
+                                     result=lambda: 'ok',
+                                     callback=finished.append))
+                for n in range(8)]
+
+    start = time.time()
+    scheduler.wait()
+    elapsed = time.time() - start
+
+    # Two rounds of 0.2 s
+    assert 0.4 <= elapsed < 1.2
+    assert sorted(results) == sorted([str(n) for n in range(8)] +
+                                     ['{}-err'.format(n) for n in range(8)])
+    assert [job.result() for job in all_jobs] == ['ok'] * 8
+    assert len(finished) == 8
+
+
+def test_cancel():
+    """Test if a cancelled job kills its program"""
+    results = []
+    scheduler = Scheduler()
+    slow = scheduler.submit(Job(echo_steps('slow', results, 30)))
+    fast = scheduler.submit(Job(echo_steps('fast', results, 0)))
+
+    scheduler.step(0.1)
+    assert slow.running()
+    pid = slow.process.pid
+    slow.cancel()
+    scheduler.wait(timeout=5)
+
+    assert fast.result() is None
+    assert results == ['fast', 'fast-err']
+    try:
+        slow.result()
+    except JobCancelled:
+        pass
+    else:
+        raise AssertionError('Cancelled job has a result')
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        pass
+    else:
+        raise AssertionError('Program was not killed')
+
+
+def test_synplot_run_async():
+    """Test a convolution-only run driven by a scheduler"""
+    root, spath, stage = fake_synplot(flux=1)
+    try:
+        scheduler = Scheduler()
+        syn = Synplot(20000, 4, synplot_path=spath, wstart=4460, wend=4480,
+                      vrot=50, norun=1, convolution='python')
+        job = syn.run_async(stage=stage, scheduler=scheduler)
+        scheduler.wait()
+
+        assert job.result() is syn.spectrum
+        assert syn.spectrum[:, 1].min() > 0.5
+
+        syn.cleanup()
+    finally:
+        shutil.rmtree(root)
+
+
+def test_job_timeout():
+    """Test if a job is killed when a command does not finish in time"""
+    scheduler = Scheduler()
+    job = scheduler.submit(Job(echo_steps('a', [], delay=5), timeout=0.3))
+
+    start = time.time()
+    scheduler.wait()
+
+    assert time.time() - start < 1
+    with assert_raises(CommandTimeout):
+        job.result()
+
+
+def test_job_retries():
+    """Test if a command that does not finish in time is run again"""
+    root = tempfile.mkdtemp()
+    flag = os.path.join(root, 'flag')
+    # The first attempt hangs, the second one finishes
+    command = 'if [ -e {0} ]; then echo done; else touch {0}; sleep 5; fi'
+    outputs = []
+
+    def steps():
+        outputs.append((yield command.format(flag), None))
+
+    scheduler = Scheduler()
+    job = scheduler.submit(Job(steps(), timeout=0.3, retries=1))
+    scheduler.wait()
+
+    assert job.result() is None
+    assert outputs == [('done\n', '')]
+    assert outputs[0].attempts == 2
+    shutil.rmtree(root)
+
+
+def test_job_start_error():
+    """Test if a command that can not be started fails its job"""
+    def steps():
+        yield 'echo a', '/nonexistent/directory'
+
+    scheduler = Scheduler()
+    job = scheduler.submit(Job(steps()))
+    scheduler.wait()
+
+    assert job.done()
+    with assert_raises(OSError):
+        job.result()
+
+
+def test_run_async_pool():
+    """Test if a synthesis on a GDL pool is not run without blocking"""
+    syn = Synplot(20000, 4, wstart=4460, wend=4480, pool=object())
+    with assert_raises(ValueError):
+        syn.run_async()
@@ -0,0 +1,47 @@
+"""Test suite for the Levenberg-Marquardt fitter"""
+import numpy as np
+from s4.fitting.leastsq import levenberg_marquardt
+
+
+X = np.linspace(0, 5, 50)
+
+
+def gaussian_residuals(points, calls):
+    """Residuals of a Gaussian with amplitude 2 and width 1.5."""
+    calls.append(len(points))
+    data = 2 * np.exp(-(X / 1.5)**2)
+    return [data - point[0] * np.exp(-(X / point[1])**2) for point in points]
+
+
+def test_levenberg_marquardt():
+    """Test if the minimum and its covariance are found"""
+    calls = []
+    result = levenberg_marquardt(lambda points: gaussian_residuals(points,
+                                                                   calls),
+                                 [1, 1], [0, 0.5], [5, 5], [1e-3, 1e-3])
+
+    assert result['converged']
+    assert np.allclose(result['x'], [2, 1.5], atol=1e-3)
+    assert result['chisquare'] < 1e-8
+    assert result['covariance'].shape == (2, 2)
+    # The perturbed points of each Jacobian are asked at once
+    assert 2 in calls
+
+
+def test_levenberg_marquardt_bounds():
+    """Test if the points are inside the bounds and feasible"""
+    asked = []
+
+    def residuals(points):
+        asked.extend(points)
+        return gaussian_residuals(points, [])
+
+    def feasible(point):
+        return point[0] <= 1.8
+
+    result = levenberg_marquardt(residuals, [1, 1], [0, 0.5], [5, 1.4],
+                                 [1e-3, 1e-3], feasible=feasible)
+
+    assert all(point[0] <= 1.8 and 0.5 <= point[1] <= 1.4
+               for point in asked)
+    assert result['x'][1] == 1.4
@@ -0,0 +1,59 @@
+"""Test suite for the line identification tables"""
+import os
+import numpy as np
+from s4.synthesis import Synplot
+from s4.synthesis.workspace import Workspace
+from s4.synthesis.lineid import parse_table, select, labels
+
+
+SPATH = os.path.join(os.path.dirname(__file__), '..', 's4', 'synthesis',
+                     'synplot') + os.sep
+
+FORT12 = """\
+  4471.473 HE I       1.49  169087.0   2.0     -0.278     180.5 *********
+  4467.120 FE II      0.81   22409.8   1.0     -2.630       3.2 *
+  4468.507 TI II      5.58   75000.4   2.0     -0.600      12.7 ***
+"""
+
+FORT14 = """\
+  4481.126 MG II      3.59   71490.2   1.0      0.740     210.3 **********
+ continuation line without identification
+"""
+
+
+def test_parse_table():
+    """Test if the table is parsed, sorted and queried"""
+    table = parse_table(FORT12 + FORT14)
+
+    assert len(table) == 4
+    assert np.all(np.diff(table['wave']) > 0)
+    assert list(table['species']) == ['FE', 'TI', 'HE', 'MG']
+    assert list(table['ion']) == ['II', 'II', 'I', 'II']
+
+    strong = select(table, 10)
+    assert list(strong['strength']) == [12.7, 180.5, 210.3]
+    assert list(select(table, 10, wstart=4470, wend=4480)['wave']) == \
+        [4471.473]
+    assert labels(select(table, 200)) == ['MG II 4481.126  210.3']
+    assert len(parse_table('')) == 0
+
+
+def test_line_table():
+    """Test if Synplot parses the tables of its workspace once per run"""
+    syn = Synplot(20000, 4, synplot_path=SPATH, wstart=4460, wend=4490)
+    syn.spectrum = np.zeros((1, 2))
+    syn.workspace = Workspace(SPATH)
+    try:
+        with open(syn.workspace.file('fort.12'), 'w') as out:
+            out.write(FORT12)
+
+        wave, text = syn.lineid_select(10)
+        assert wave == [4468.507, 4471.473]
+        assert all(isinstance(row, str) for row in text)
+        assert [float(row.split()[-1]) for row in text] == [12.7, 180.5]
+
+        # Kept until the next run
+        os.remove(syn.workspace.file('fort.12'))
+        assert len(syn.line_table()) == 3
+    finally:
+        syn.cleanup()
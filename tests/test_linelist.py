@@ -0,0 +1,120 @@
+"""Test suite for the index of the line list"""
+import os
+import time
+import shutil
+import tempfile
+from nose.tools import assert_raises
+from s4.synthesis import Synplot
+from s4.synthesis.workspace import Workspace
+from s4.synthesis.linelist import open_index, index_name
+
+LINES = ['  410.1734  1.00   -0.753\n',
+         '  440.0000 26.01   -2.000\n',
+         '  446.0500  8.01   -1.000\n',
+         '  447.1473  2.00   -0.278\n',
+         '  448.1126 12.01    0.740\n',
+         '  455.2622 14.01    0.292\n',
+         '  486.1323  1.00   -0.020\n']
+
+
+def make_tree():
+    """Creates a fake Synplot installation with a line list."""
+    root = tempfile.mkdtemp()
+    spath = os.path.join(root, 'synplot') + '/'
+    os.mkdir(spath)
+    with open(spath + 'fort.19', 'w') as out:
+        out.writelines(LINES)
+    return root, spath
+
+
+def test_window():
+    """Test if a window has the lines around it and all H and He lines"""
+    root, spath = make_tree()
+    index = open_index(spath + 'fort.19')
+
+    assert len(index) == len(LINES)
+    assert os.path.isfile(index_name(spath + 'fort.19'))
+    assert index.limits() == (4101.734, 4861.323)
+
+    out = os.path.join(root, 'window')
+    index.write_window(4470, 4480, out, margin=5)
+    assert open(out).readlines() == [LINES[0], LINES[3], LINES[4], LINES[6]]
+
+    index.write_window(4600, 4700, out, margin=5)
+    assert open(out).readlines() == [LINES[0], LINES[3], LINES[6]]
+
+    # A changed list is indexed again
+    time.sleep(0.01)
+    with open(spath + 'fort.19', 'w') as out_list:
+        out_list.writelines(LINES[::-1])
+    index = open_index(spath + 'fort.19')
+    assert not index.is_sorted
+    with assert_raises(ValueError):
+        index.window(4470, 4480)
+
+    shutil.rmtree(root)
+
+
+def test_synplot_window():
+    """Test if Synplot gives Synspec only the lines of the window"""
+    root, spath = make_tree()
+
+    syn = Synplot(20000, 4, synplot_path=spath, linlist=spath + 'fort.19')
+    assert (syn.parameters['wstart'], syn.parameters['wend']) == \
+           (4101.734, 4861.323)
+
+    syn = Synplot(20000, 4, synplot_path=spath, wstart=4540, wend=4560,
+                  linlist=spath + 'fort.19')
+    syn.workspace = Workspace(spath)
+    assert syn.window_line_list() > 0
+    assert not os.path.islink(syn.workspace.file('fort.19'))
+    assert open(syn.workspace.file('fort.19')).readlines() == \
+           [LINES[0], LINES[3], LINES[5], LINES[6]]
+    assert 'linlist' not in syn.run_parameters()
+    # The original list is untouched
+    assert open(spath + 'fort.19').readlines() == LINES
+
+    syn.cleanup()
+    shutil.rmtree(root)
+
+
+def test_continuation_records():
+    """Test if continuation records are kept with their line"""
+    root, spath = make_tree()
+    lines = ['  446.0500  8.01  -1.000  1.0  1.0  1.0  1.0  0.0  0.0  0.0  0\n',
+             '  447.1473  2.00  -0.278  1.0  1.0  1.0  1.0  0.0  0.0  0.0  1\n',
+             '  0.1  0.2  0.3  0.4  0  0  -1\n',
+             '  448.1126 12.01   0.740  1.0  1.0  1.0  1.0  0.0  0.0  0.0  1\n',
+             '  448.5  449.0  450.0  451.0  0  0  -1\n',
+             '  455.2622 14.01   0.292  1.0  1.0  1.0  1.0  0.0  0.0  0.0  0\n']
+    with open(spath + 'fort.19', 'w') as out:
+        out.writelines(lines)
+
+    index = open_index(spath + 'fort.19')
+    assert index.is_sorted
+    assert list(index.waves) == [4460.5, 4471.473, 4471.473, 4481.126,
+                                 4481.126, 4552.622]
+
+    out = os.path.join(root, 'window')
+    index.write_window(4475, 4480, out, margin=2)
+    assert open(out).readlines() == lines[1:5]
+    index.write_window(4500, 4560, out, margin=5)
+    assert open(out).readlines() == lines[1:3] + lines[5:]
+
+    shutil.rmtree(root)
+
+
+def test_cutoff_margin():
+    """Test if the window keeps the lines within the cutoff of Synspec"""
+    root, spath = make_tree()
+
+    syn = Synplot(20000, 4, synplot_path=spath, wstart=4540, wend=4560,
+                  linlist=spath + 'fort.19', cutoff=60)
+    assert syn.window_margin() == 60
+    syn.workspace = Workspace(spath)
+    syn.window_line_list()
+    assert open(syn.workspace.file('fort.19')).readlines() == \
+           [LINES[0], LINES[3], LINES[4], LINES[5], LINES[6]]
+
+    syn.cleanup()
+    shutil.rmtree(root)
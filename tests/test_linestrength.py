@@ -0,0 +1,93 @@
+"""Test suite for the screening of the line list"""
+import os
+import shutil
+import tempfile
+import numpy as np
+from s4.synthesis import Synplot, linestrength
+from s4.synthesis.workspace import Workspace
+
+SPATH = os.path.join(os.path.dirname(__file__), '..', 's4', 'synthesis',
+                     'synplot') + '/'
+
+LINES = ['  410.1734  1.00   -0.753   82259.105\n',
+         '  441.9596 26.02   -2.218   66464.610\n',
+         '  445.0000 26.00   -4.500   40000.000\n',
+         '  447.1473  2.00   -0.278  169087.830\n',
+         '  448.1126 12.01    0.740   71490.190\n',
+         '  449.0000 14.01   -6.000  100000.000\n']
+
+
+def test_ionization_fractions():
+    """Test if iron is mostly twice ionized in a B star"""
+    fractions = linestrength.ionization_fractions(26, 20000., 1e15)
+    assert np.isclose(fractions.sum(), 1.)
+    assert fractions.argmax() == 2
+    assert fractions[0] < 1e-6
+
+
+def test_screen_lines():
+    """Test if weak lines are dropped and H and He lines are kept"""
+    log_eps = linestrength.abundances()
+    strengths = linestrength.line_strengths(LINES, 20000., 1e15, log_eps)
+    assert np.isinf(strengths[[0, 3]]).all()
+    assert max(strengths[2], strengths[5]) < \
+           min(strengths[1], strengths[4]) - 4
+
+    kept, dropped = linestrength.screen_lines(LINES, strengths, 1e-4)
+    assert kept == [LINES[0], LINES[1], LINES[3], LINES[4]]
+    assert dropped == 2
+
+    # Changing the abundance of an element changes its lines
+    log_eps = linestrength.abundances([(26, 26, 9.5)])
+    assert linestrength.line_strengths(LINES[1:2], 20000., 1e15,
+                                       log_eps)[0] == strengths[1] + 2.
+
+
+def test_continuation_records():
+    """Test if a line is screened with its continuation record"""
+    lines = ['  441.9596 26.02   -2.218   66464.610  1.0  1.0  1.0  0.0  0.0'
+             '  0.0  1\n',
+             '  0.1  0.2  0.3  0.4  0  0  -1\n',
+             '  449.0000 14.01   -6.000  100000.000  1.0  1.0  1.0  0.0  0.0'
+             '  0.0  1\n',
+             '  0.1  0.2  0.3  0.4  0  0  -1\n']
+    content, dropped = linestrength.screened_list(''.join(lines), 20000, 4.,
+                                                  SPATH, threshold=1e-4)
+    assert dropped == 1
+    assert content.splitlines(True) == lines[:2]
+
+    # A record that is not a line is kept
+    strengths = linestrength.line_strengths(lines[1:2], 20000., 1e15,
+                                            linestrength.abundances())
+    assert np.isinf(strengths[0])
+
+
+def test_screened_list():
+    """Test the screening for a model atmosphere of the grid"""
+    content, dropped = linestrength.screened_list(''.join(LINES), 20000, 4.,
+                                                  SPATH, threshold=1e-4)
+    assert dropped == 2
+    assert content.splitlines(True) == [LINES[0], LINES[1], LINES[3],
+                                        LINES[4]]
+    # Memoized
+    assert linestrength.screened_list(''.join(LINES), 20000, 4., SPATH,
+                                      threshold=1e-4) is not None
+
+
+def test_synplot_screening():
+    """Test if Synplot gives Synspec the screened line list"""
+    root = tempfile.mkdtemp()
+    fname = os.path.join(root, 'lines.19')
+    with open(fname, 'w') as out:
+        out.writelines(LINES)
+
+    syn = Synplot(20000, 4, synplot_path=SPATH, wstart=4410, wend=4500,
+                  linlist=fname, line_margin=None, screen_threshold=1e-4)
+    syn.workspace = Workspace(SPATH)
+    assert syn.screen_line_list() > 0
+    assert syn.lines_dropped == 2
+    assert len(open(syn.workspace.file('fort.19')).readlines()) == 4
+    assert 'linlist' not in syn.run_parameters()
+
+    syn.cleanup()
+    shutil.rmtree(root)
@@ -0,0 +1,78 @@
+"""Test suite for the binary store of model atmospheres"""
+import os
+import shutil
+import tempfile
+import numpy as np
+from s4.synthesis import atmosphere, modelgrid
+
+
+BSTAR = os.path.join(os.path.dirname(__file__), '..', 's4', 'synthesis',
+                     'bstar2006')
+
+
+def make_grid():
+    """Copy the four models around 20000 K and 4.0 to a temporary grid."""
+    path = tempfile.mkdtemp()
+    for model in atmosphere.bracketing_models(20000, 4., grid='BG'):
+        for ext in ['.5', '.7']:
+            shutil.copy(os.path.join(BSTAR, model + ext), path)
+    return path, os.path.join(path, 'BG')
+
+
+def test_pack_grid():
+    """Test if the store has the same models of the text files"""
+    path, core = make_grid()
+
+    assert modelgrid.open_grid(core) is None
+    assert modelgrid.pack_grid(core) == 4
+
+    store = modelgrid.open_grid(core)
+    assert len(store) == 4
+    assert (21000, 4.25) in store
+    assert store.covers(20400, 4.1)
+    assert not store.covers(21400, 4.1)
+
+    log_dm, log_params = store.log_model(20000, 4.)
+    dm, params = atmosphere.read_model(core + '20000g400v2.7')
+    assert np.allclose(10**log_dm, dm)
+    assert np.allclose(10**log_params, np.maximum(params, 1e-35))
+    assert not log_params.flags.writeable
+
+    shutil.rmtree(path)
+
+
+def test_store_interpolation():
+    """The store should interpolate as the text files"""
+    path, core = make_grid()
+    modelgrid.pack_grid(core)
+    store = modelgrid.open_grid(core)
+
+    models = atmosphere.bracketing_models(20400, 4.1, grid=core)
+    dm, params = atmosphere.interpolate_models(models, 20400, 4.1)
+    log_dm, log_params = store.interpolate(20400, 4.1)
+
+    assert np.allclose(10**log_dm, dm)
+    assert np.allclose(10**log_params, params)
+
+    shutil.rmtree(path)
+
+
+def test_grid_covers():
+    """Test the coverage of the grid, which is not a rectangle"""
+    synplot = os.path.join(BSTAR, '..', 'synplot')
+    assert atmosphere.grid_covers(20400, 4.1, synplot)
+    assert atmosphere.grid_covers(15500, 1.9, synplot) is False
+    assert atmosphere.grid_covers(15500, 2.1, synplot)
+    assert not atmosphere.grid_covers(30000, 4., synplot)
+    assert not atmosphere.grid_covers(20000, 4.8, synplot)
+
+    # Only the four models of the temporary grid
+    path, core = make_grid()
+    assert atmosphere.grid_covers(20400, 4.1, path, 'BG')
+    assert not atmosphere.grid_covers(21400, 4.1, path, 'BG')
+    modelgrid.pack_grid(core)
+    for model in atmosphere.bracketing_models(20000, 4., grid=core):
+        os.remove(model + '.7')
+    assert atmosphere.grid_covers(20400, 4.1, path, 'BG')
+
+    shutil.rmtree(path)
@@ -0,0 +1,58 @@
+"""Test suite for the observed spectrum of a fit"""
+import pickle
+import numpy as np
+from s4.fitting.observation import Observation
+
+
+def make_observation():
+    """An observation with a window on half of its pixels."""
+    wave = np.linspace(4460, 4480, 300)
+    flux = 1 - 0.5 * np.exp(-((wave - 4471.5) / 0.8)**2)
+    weights = (wave > 4465) & (wave < 4475)
+    return np.column_stack([wave, flux]), weights.astype(float)
+
+
+def test_chi_square():
+    """Test if the batch chi-square is the one of numpy.interp"""
+    spectrum, weights = make_observation()
+    observation = Observation(spectrum, weights)
+    assert len(observation.wave) == weights.sum()
+
+    spectra = []
+    for width, step in [(0.6, 0.01), (0.7, 0.01), (0.9, 0.013)]:
+        wave = np.arange(4458, 4482, step)
+        spectra.append((wave,
+                        1 - 0.5 * np.exp(-((wave - 4471.5) / width)**2)))
+
+    chisq = observation.chi_square(spectra)
+    for (wave, flux), result in zip(spectra, chisq):
+        flm = np.interp(spectrum[:, 0], wave, flux)
+        expected = np.sum(((spectrum[:, 1] - flm)**2/flm) * weights)
+        assert np.isclose(result, expected, rtol=1e-12)
+        assert result == observation.chi_square([(wave, flux)])[0]
+        assert np.isclose(np.sum(observation.residuals(wave, flux)**2),
+                          expected, rtol=1e-12)
+
+    # One operator per synthetic grid
+    assert len(observation._operators) == 2
+    assert observation.operator(spectra[0][0]) is \
+        observation.operator(spectra[1][0])
+
+    # Values out of the synthetic grid are those of its edges
+    wave = np.linspace(4468, 4470, 5)
+    flm = observation.resample(wave, wave - 4468)[0]
+    assert np.array_equal(flm, np.interp(observation.wave, wave, wave - 4468))
+
+
+def test_pickle():
+    """Test if an observation can be sent to other processes"""
+    spectrum, weights = make_observation()
+    observation = Observation(spectrum, weights)
+    wave = np.arange(4458, 4482, 0.01)
+    flux = np.ones_like(wave)
+    observation.chi_square([(wave, flux)])
+
+    copy = pickle.loads(pickle.dumps(observation, 2))
+    assert len(copy._operators) == 0
+    assert copy.chi_square([(wave, flux)]) == \
+        observation.chi_square([(wave, flux)])
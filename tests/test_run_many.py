@@ -0,0 +1,37 @@
+"""Test suite for the batch synthesis"""
+import shutil
+import numpy as np
+from s4.synthesis import Synplot
+from helpers import fake_synplot
+
+
+def test_run_many():
+    """Test the order, the deduplication and the errors of a batch"""
+    root, spath, stage = fake_synplot()
+    try:
+        parameters = [dict(teff=20000, logg=4, vrot=50),
+                      dict(teff=20000, logg=4, vrot=100),
+                      dict(teff=20000, logg=4, vrot=50.0),
+                      dict(teff=20000, logg=4, vrot=50, convolution='rotins')]
+        spectra, errors = Synplot.run_many(parameters, workers=2,
+                                           synplot_path=spath, wstart=4460,
+                                           wend=4480, relative=1, norun=1,
+                                           convolution='python', stage=stage)
+
+        assert errors[:3] == [None, None, None]
+        assert "Unknown convolution 'rotins'" in errors[3]
+        assert spectra[3] is None
+
+        assert np.array_equal(spectra[0], spectra[2])
+        assert spectra[0] is not spectra[2]
+        # Faster rotation, shallower line
+        assert spectra[1][:, 1].min() > spectra[0][:, 1].min()
+
+        # The same in this process
+        serial, _ = Synplot.run_many(parameters[:2], workers=1,
+                                     synplot_path=spath, wstart=4460,
+                                     wend=4480, relative=1, norun=1,
+                                     convolution='python', stage=stage)
+        assert np.array_equal(serial[1], spectra[1])
+    finally:
+        shutil.rmtree(root)
@@ -0,0 +1,44 @@
+"""Test suite for the parsers of text spectra"""
+import os
+import shutil
+import tempfile
+import numpy as np
+from nose.tools import assert_raises
+from s4.io.specio import loadtxt_fast, parse_values
+
+
+def test_parse_values():
+    """Test Fortran exponents and conversion errors"""
+    values = parse_values(' 1.5D+02  -2.0d-01\n3\n')
+    assert np.allclose(values, [150., -0.2, 3.])
+    assert np.array_equal(parse_values('1 2\n3', np.int), [1, 2, 3])
+
+    with assert_raises(ValueError):
+        parse_values('1.0 2.0 x 4.0')
+
+
+def test_loadtxt_fast():
+    """Test fixed-width columns, headers and an incomplete last line"""
+    path = tempfile.mkdtemp()
+    fname = os.path.join(path, 'fort.7')
+    spectrum = np.column_stack([np.arange(4460, 4461, 0.25),
+                                [1e8, 2e-3, 3.5, 4e12]])
+
+    np.savetxt(fname, spectrum, fmt='%12.5f%15.5E')
+    assert np.allclose(loadtxt_fast(fname, np.float), spectrum)
+
+    with open(fname, 'w') as out:
+        out.write('wave flux\n')
+        out.write('\n'.join('{:.2f}  {:.5E}'.format(*row)
+                            for row in spectrum).replace('E', 'D'))
+        out.write('\n4462.00')
+    data = loadtxt_fast(fname, np.float, skiprows=1)
+    assert data.shape == (4, 2)
+    assert np.allclose(data, spectrum)
+
+    with open(fname, 'w') as out:
+        out.write('1,2\n3,4\n')
+    assert np.array_equal(loadtxt_fast(fname, np.int, delimiter=','),
+                          [[1, 2], [3, 4]])
+
+    shutil.rmtree(path)
@@ -2,10 +2,15 @@
 Test suite for Synfit and complementary functions.
 """
 import os
+import shutil
 import numpy as np
 import s4
 from s4.synthesis import Synplot
+from s4.synthesis.cache import SpectrumCache, cache_key
 from s4.fitting import Synfit
+from s4.fitting.synfit import branch_and_bound
+from s4.synthesis.emulator import train_emulator
+from helpers import fake_synplot
 
 
 def test_sample_params_error():
@@ -49,8 +54,8 @@ def test_synfit_one():
         fit.fit()
     except:
         # Print the output log of the Synplot command
-        with open('run.log') as log:
-            print(log.read())
+        if hasattr(fit, 'synthesis'):
+            print(fit.synthesis.log)
         raise
 
     # Remove synthetic spectrum
@@ -292,3 +297,219 @@ def test_synfit_windows():
     assert len(fit.best_fit.keys()) == 2
     assert fit.best_fit['vrot'] == params['vrot']
     assert fit.best_fit['chisquare'] == 0  # chi^2
+
+
+def make_convolution_fit():
+    """
+    Create a Synplot tree, an observation with vrot=16 and a cache with the
+    unconvolved spectrum, so fits of vrot with `convolution='python'` do
+    not need Synspec.
+
+    Returns
+    -------
+
+    root: str;
+        Directory to be removed.
+
+    kwargs: dict;
+        Synfit arguments.
+    """
+    # An unconvolved spectrum, read from the cache as the library spectrum
+    root, spath, stage = fake_synplot(line_list=True, flux=1)
+
+    params = dict(wstart=4460, wend=4480, relative=1, noplot=True,
+                  convolution='python', synplot_path=spath)
+    observ = os.path.join(root, 'observ.dat')
+    syn = Synplot(20000, 4, vrot=16, norun=1, **params)
+    syn.run(stage=stage)
+    syn.save_spec(observ)
+
+    cache = SpectrumCache(os.path.join(root, 'cache'))
+    library = Synplot(20000, 4, vrot=0, vmac_rt=0, observ=observ, **params)
+    cache.put(cache_key(library.cache_parameters(), spath),
+              np.zeros((10, 2)), path=root)
+
+    return root, dict(params, teff=20000, logg=4, observ=observ, cache=cache)
+
+
+def test_synfit_workers():
+    """Test if a parallel fit gives the chi-square values of a serial one"""
+    root, kwargs = make_convolution_fit()
+    try:
+        chisq_values = []
+        for workers in [1, 2]:
+            fit = Synfit({'vrot': [10, 20, 2]}, workers=workers, **kwargs)
+            fit.fit()
+            assert fit.best_fit['vrot'] == 16
+            assert not fit.failed
+            chisq_values.append(fit.chisq_values)
+
+        assert np.array_equal(chisq_values[0], chisq_values[1])
+    finally:
+        shutil.rmtree(root)
+
+
+def test_synfit_observation_once():
+    """Test if the observed spectrum is loaded only when the fit is created"""
+    root, kwargs = make_convolution_fit()
+    try:
+        observ = kwargs['observ']
+        expected = s4.io.specio.load_spectrum(observ)
+
+        fits = [Synfit({'vrot': [10, 20, 2]}, workers=workers, **kwargs)
+                for workers in [1, 2]]
+        os.remove(observ)
+
+        for fit in fits:
+            assert not fit.observed_spectrum.flags.writeable
+            assert np.array_equal(fit.observed_spectrum, expected)
+            fit.fit()
+            assert fit.best_fit['vrot'] == 16
+            assert not fit.failed
+
+        # Synplot shares an observation given as an array
+        syn = Synplot(20000, 4, observ=fits[0].observed_spectrum,
+                      **{key: val for key, val in kwargs.iteritems()
+                         if key not in ['teff', 'logg', 'observ', 'cache']})
+        assert syn.observation is fits[0].observed_spectrum
+    finally:
+        shutil.rmtree(root)
+
+
+def test_synfit_refine():
+    """Test if the refinement finds the best point of the dense grid"""
+    root, kwargs = make_convolution_fit()
+    try:
+        dense = Synfit({'vrot': [0, 40, 1]}, **kwargs)
+        dense.fit()
+
+        fit = Synfit({'vrot': [0, 40, 1]}, refine=True, **kwargs)
+        fit.fit()
+
+        assert fit.best_fit == dense.best_fit
+        assert fit.best_fit['vrot'] == 16
+        assert fit.refinement['dense_syntheses'] == 42
+        assert fit.refinement['saved'] > 20
+        assert np.isnan(fit.chisq_values['chisquare']).sum() == \
+            fit.refinement['saved']
+
+        # Calculated points have the chi-square of the dense grid
+        done = np.isfinite(fit.chisq_values['chisquare'])
+        assert np.array_equal(fit.chisq_values[done], dense.chisq_values[done])
+    finally:
+        shutil.rmtree(root)
+
+
+def test_synfit_lm():
+    """Test if Levenberg-Marquardt finds vrot with few syntheses"""
+    root, kwargs = make_convolution_fit()
+    try:
+        fit = Synfit({'vrot': [0, 40, 1]}, method='lm', workers=2,
+                     lm_initial={'vrot': 10}, **kwargs)
+        fit.fit()
+
+        assert abs(fit.best_fit['vrot'] - 16) < 0.05
+        assert fit.best_fit['chisquare'] < 1e-4
+        assert fit.best_fit['chisquare'] in fit.chisq_values['chisquare']
+        # Fewer syntheses than the grid of 41 points
+        assert len(fit.chisq_values) < 20
+        assert fit.covariance.shape == (1, 1)
+        assert fit.uncertainties['vrot'] < 0.1
+        assert fit.least_squares_fit['converged']
+        assert fit.least_squares_fit['points'] == len(fit.chisq_values)
+        assert not fit.failed
+    finally:
+        shutil.rmtree(root)
+
+
+
+def test_branch_and_bound():
+    """Test if pruning keeps the minimum of a chi-square surface"""
+    sizes = [30, 20]
+    teff, logg = np.indices(sizes)
+    surface = (1 + (teff - 21)**2 + 2 * (logg - 6)**2 +
+               (teff - 21) * (logg - 6)).ravel()
+    asked = []
+
+    def evaluate(rows):
+        asked.extend(rows)
+        return surface[rows]
+
+    for convex in [False, True]:
+        del asked[:]
+        chisquare, pruned = branch_and_bound(evaluate, sizes, [5, 15],
+                                             convex=convex)
+        assert np.nanargmin(chisquare) == np.argmin(surface)
+        assert len(asked) == len(set(asked)) == (~pruned).sum()
+        assert np.isnan(chisquare[pruned]).all()
+        assert np.array_equal(chisquare[~pruned], surface[~pruned])
+        if convex:
+            assert pruned.sum() > monotonic
+        monotonic = pruned.sum()
+    assert monotonic > 200
+
+
+def test_synfit_prune():
+    """Test if pruning finds the best point of the grid"""
+    root, kwargs = make_convolution_fit()
+    try:
+        dense = Synfit({'vrot': [0, 40, 1]}, **kwargs)
+        dense.fit()
+
+        fit = Synfit({'vrot': [0, 40, 1]}, prune=True, prune_seed={'vrot': 30},
+                     **kwargs)
+        fit.fit()
+
+        assert fit.best_fit == dense.best_fit
+        assert fit.pruning['pruned'] == fit.pruned.sum() > 10
+        assert np.isnan(fit.chisq_values['chisquare'][fit.pruned]).all()
+        done = ~fit.pruned
+        assert np.array_equal(fit.chisq_values[done], dense.chisq_values[done])
+    finally:
+        shutil.rmtree(root)
+
+
+def test_synfit_emulator():
+    """Test if a fit against an emulator is verified by a synthesis"""
+    root, kwargs = make_convolution_fit()
+    try:
+        settings = {key: kwargs[key] for key in
+                    ['wstart', 'wend', 'relative', 'convolution',
+                     'synplot_path', 'teff', 'logg']}
+        stage = {name: os.path.join(root, name)
+                 for name in ['fort.7', 'fort.17']}
+        emulator = train_emulator({'vrot': np.arange(0, 41, 4)}, workers=1,
+                                  norun=1, stage=stage, **settings)
+        assert emulator.keys == ['vrot']
+        assert 'stage' not in emulator.parameters
+
+        for method in ['grid', 'lm']:
+            fit = Synfit({'vrot': [0, 40, 1]}, emulator=emulator,
+                         method=method, **kwargs)
+            fit.fit()
+
+            assert abs(fit.best_fit['vrot'] - 16) < 0.5
+            assert fit.best_fit['chisquare'] == \
+                fit.verification['synthesized'] < 1e-3
+            assert not fit.failed
+            # The points of the fit were emulated
+            assert fit.timings['emulator']['calls'] >= 5
+
+        # Spectra with other settings than the training are not emulated
+        vrot = {'vrot': [0, 40, 1]}
+        for fit_params, changes in [(vrot, {'wend': 4490}),
+                                    (vrot, {'vmac_rt': 5}),
+                                    (vrot, {'relative': 0}),
+                                    (vrot, {'abund': {2: 11}}),
+                                    ({'vmac_rt': [0, 10, 5]}, {})]:
+            fit = Synfit(fit_params, emulator=emulator,
+                         **dict(kwargs, **changes))
+            try:
+                fit.fit()
+            except ValueError as err:
+                assert 'emulator' in str(err)
+            else:
+                raise AssertionError('A fit used an emulator of other '
+                                     'settings.')
+    finally:
+        shutil.rmtree(root)
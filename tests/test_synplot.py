@@ -12,13 +12,12 @@ PARAMS = dict(wstart=4000, wend=4500, noplot=True, relative=1)
 
 def test_synplot_run():
     """Test if Synplot is calculating a spectrum"""
+    syn = Synplot(TEFF, LOGG, **PARAMS)
     try:
-        syn = Synplot(TEFF, LOGG, **PARAMS)
         syn.run()
     except:
         # Print the output log of the Synplot command
-        with open('run.log') as log:
-            print(log.read())
+        print(syn.log)
         raise
 
     assert isinstance(syn.spectrum, np.ndarray)
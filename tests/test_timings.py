@@ -0,0 +1,93 @@
+"""Test suite for the timing of the stages of a synthesis"""
+import os
+import time
+import shutil
+import tempfile
+from s4.synthesis import Synplot
+from s4.synthesis.cache import SpectrumCache
+from s4.synthesis.timings import Timings, command_stage, input_files
+from helpers import fake_synplot
+
+
+def test_timings():
+    """Test measuring, adding and merging stages"""
+    timings = Timings()
+    root = tempfile.mkdtemp()
+
+    with timings.measure('write', root) as io:
+        with open(os.path.join(root, 'fort.11'), 'w') as out:
+            out.write('x' * 100)
+        # Only the output files are checked
+        with open(os.path.join(root, 'other'), 'w') as out:
+            out.write('x' * 10)
+        io['bytes_read'] = 10
+        time.sleep(0.05)
+    timings.add('synspec49', wall=1., cpu=0.5)
+    timings.count('cache_hits')
+
+    assert timings['write']['wall'] >= 0.05
+    assert timings['write']['bytes_written'] == 100
+    assert timings['write']['bytes_read'] == 10
+
+    total = Timings()
+    total.merge(timings)
+    total.merge(timings)
+    assert total['synspec49'] == {'calls': 2, 'wall': 2., 'cpu': 1.,
+                                  'bytes_read': 0, 'bytes_written': 0}
+    assert total.counters['cache_hits'] == 2
+    assert 'synspec49' in str(total)
+
+    assert command_stage('./synspec49 < fort.5') == 'synspec49'
+    assert command_stage('gdl -e "synplot"') == 'gdl'
+
+    shutil.rmtree(root)
+
+
+def test_bytes_read():
+    """Test if the input files of a program, and their links, are read"""
+    root = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(root, 'linelist'), 'w') as out:
+            out.write('x' * 200)
+        os.symlink(os.path.join(root, 'linelist'),
+                   os.path.join(root, 'fort.19'))
+        with open(os.path.join(root, 'fort.8'), 'w') as out:
+            out.write('x' * 50)
+
+        timings = Timings()
+        with timings.measure('gdl', root):
+            with open(os.path.join(root, 'fort.7'), 'w') as out:
+                out.write('x' * 30)
+        with timings.measure('convolve', root):
+            pass
+
+        assert timings['gdl']['bytes_read'] == 250
+        assert timings['gdl']['bytes_written'] == 30
+        assert timings['convolve']['bytes_read'] == 0
+        assert 'fort.8' in input_files('synspec49')
+        assert input_files('rotin3') == ['fort.7', 'fort.17']
+    finally:
+        shutil.rmtree(root)
+
+
+def test_synplot_timings():
+    """Test if the stages of a run and the cache hits are recorded"""
+    root, spath, stage = fake_synplot(flux=1)
+    try:
+        syn = Synplot(20000, 4, synplot_path=spath, wstart=4460, wend=4480,
+                      vrot=50, norun=1, convolution='python',
+                      cache=SpectrumCache(os.path.join(root, 'cache')))
+        syn.run(stage=stage)
+
+        assert list(syn.timings) == ['workspace', 'cache', 'convolve']
+        assert syn.timings['cache']['calls'] == 2
+        assert syn.timings['convolve']['bytes_read'] > 0
+        assert syn.timings.counters == {'cache_misses': 1}
+
+        syn.run(stage=stage)
+        assert 'convolve' not in syn.timings
+        assert syn.timings.counters == {'cache_hits': 1}
+
+        syn.cleanup()
+    finally:
+        shutil.rmtree(root)
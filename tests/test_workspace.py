@@ -0,0 +1,84 @@
+"""Test suite for the Synplot workspaces"""
+import os
+import shutil
+import tempfile
+import threading
+from s4.synthesis.workspace import Workspace, is_scratch
+
+
+def make_synplot_tree():
+    """Creates a fake Synplot installation and returns its synplot path."""
+    root = tempfile.mkdtemp()
+    spath = os.path.join(root, 'synplot')
+    for dname in ['synplot', 'bstar2006', 'atdata']:
+        os.mkdir(os.path.join(root, dname))
+
+    for fname in ['synplot.pro', 'synspec49', 'fort.19', 'fort.11',
+                  'intrp.7', 'f55']:
+        with open(os.path.join(spath, fname), 'w') as out:
+            out.write(fname)
+
+    return spath + '/'
+
+
+def test_is_scratch():
+    """Test the classification of files written by a run."""
+    assert is_scratch('fort.7')
+    assert is_scratch('intrp.5')
+    assert is_scratch('out.tmp')
+    assert not is_scratch('fort.19')
+    assert not is_scratch('synplot.pro')
+
+
+def test_workspace_links():
+    """Test if only the read-only inputs are linked in a workspace."""
+    spath = make_synplot_tree()
+
+    with Workspace(spath) as wsp:
+        assert sorted(os.listdir(wsp.path)) == ['fort.19', 'synplot.pro',
+                                                'synspec49']
+        assert all(os.path.islink(wsp.file(fname))
+                   for fname in os.listdir(wsp.path))
+        assert os.path.isdir(os.path.join(wsp.path, '../bstar2006'))
+        assert os.path.isdir(os.path.join(wsp.path, '../atdata'))
+        root = wsp.root
+
+    assert not os.path.exists(root)
+    shutil.rmtree(os.path.dirname(spath.rstrip('/')))
+
+
+def test_workspace_stage():
+    """Test if staged files do not overwrite the shared directory."""
+    spath = make_synplot_tree()
+    source = os.path.join(spath, 'fort.11')
+
+    with Workspace(spath) as wsp:
+        wsp.stage({'fort.19': source})
+        assert not os.path.islink(wsp.file('fort.19'))
+        assert open(wsp.file('fort.19')).read() == 'fort.11'
+
+    assert open(os.path.join(spath, 'fort.19')).read() == 'fort.19'
+    shutil.rmtree(os.path.dirname(spath.rstrip('/')))
+
+
+def test_workspace_concurrent():
+    """Test if concurrent workspaces are independent."""
+    spath = make_synplot_tree()
+    roots = []
+
+    def work(n):
+        with Workspace(spath) as wsp:
+            with open(wsp.file('fort.11'), 'w') as out:
+                out.write(str(n))
+            roots.append((n, wsp.root, open(wsp.file('fort.11')).read()))
+
+    threads = [threading.Thread(target=work, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(root for _, root, _ in roots)) == 8
+    assert all(str(n) == content for n, _, content in roots)
+    assert open(os.path.join(spath, 'fort.11')).read() == 'fort.11'
+    shutil.rmtree(os.path.dirname(spath.rstrip('/')))
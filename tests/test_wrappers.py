@@ -0,0 +1,70 @@
+"""Test suite for the execution of external programs"""
+import os
+import time
+import shutil
+import tempfile
+from nose.tools import assert_raises
+from s4.io.wrappers import (run_command, RingBuffer, CommandError,
+                            CommandTimeout)
+
+
+def test_run_command():
+    """Test if the output is a (stdout, stderr) pair with the status"""
+    stdout, stderr = result = run_command('echo out; echo err 1>&2; exit 3')
+
+    assert (stdout, stderr) == ('out\n', 'err\n')
+    assert result.returncode == 3
+    assert result.attempts == 1
+    assert result.cpu >= 0
+
+    with assert_raises(CommandError) as err:
+        run_command('exit 3', check=True)
+    assert err.exception.result.returncode == 3
+
+
+def test_timeout_kills_group():
+    """Test if a command that hangs is killed with its children"""
+    root = tempfile.mkdtemp()
+    flag = os.path.join(root, 'flag')
+
+    start = time.time()
+    with assert_raises(CommandTimeout) as err:
+        # The child would write the flag after the timeout
+        run_command('(sleep 1; touch {}) & sleep 5'.format(flag),
+                    timeout=0.3)
+    assert time.time() - start < 1
+    assert err.exception.result.returncode is None
+
+    time.sleep(1.2)
+    assert not os.path.exists(flag)
+
+    shutil.rmtree(root)
+
+
+def test_retries():
+    """Test if a command that times out is run again"""
+    root = tempfile.mkdtemp()
+    counter = os.path.join(root, 'counter')
+
+    # Hangs only on the first attempt
+    cmd = ('echo x >> {0}; test $(wc -l < {0}) -gt 1 && echo done '
+           '|| sleep 5').format(counter)
+    result = run_command(cmd, timeout=0.3, retries=2)
+
+    assert result.stdout == 'done\n'
+    assert result.attempts == 2
+
+    shutil.rmtree(root)
+
+
+def test_ring_buffer():
+    """Test if only the last bytes of the output are kept"""
+    buf = RingBuffer(5)
+    for chunk in ['abc', 'def', 'gh']:
+        buf.write(chunk)
+    assert buf.getvalue() == 'defgh'
+    assert buf.truncated
+
+    stdout, _ = result = run_command('seq 1000', max_output=9)
+    assert stdout == '999\n1000\n'
+    assert result.truncated